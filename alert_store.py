@@ -0,0 +1,172 @@
+import json
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+ALERT_SINK_TYPES = ('jsonl', 'sqlite')
+ALERT_SINK_PATHS = {'jsonl': 'alerts.jsonl', 'sqlite': 'alerts.db'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    alert_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    timestamp TEXT,
+    ts REAL,
+    user_id TEXT,
+    alert_type TEXT NOT NULL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user_ts ON alerts (user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_type_ts ON alerts (alert_type, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts (ts);
+"""
+
+
+def _epoch(value):
+    # Event times are compared as UTC epoch seconds; naive times are taken as UTC.
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return ts.timestamp()
+
+
+class SQLiteAlertSink:
+    """
+    Append-only alert store. Alerts are buffered and inserted in batched
+    transactions, each getting an increasing alert_id and a created_at time.
+    Indexes on (user_id, time), (alert_type, time) and time keep queries like
+    "alerts for user X in the last 24h" to an index range scan.
+    """
+
+    def __init__(self, path=ALERT_SINK_PATHS['sqlite'], batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._pending = []
+
+    def append(self, alerts):
+        created_at = datetime.now(timezone.utc).isoformat()
+        for alert in alerts:
+            self._pending.append((
+                created_at, alert.get('timestamp'), _epoch(alert.get('timestamp')),
+                alert.get('user_id'), alert['alert_type'], alert.get('details'),
+            ))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO alerts (created_at, timestamp, ts, user_id, alert_type, details) VALUES (?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def query(self, user_id=None, alert_type=None, since=None, until=None, limit=None):
+        """Alerts matching every given filter, oldest first. ``since``/``until`` bound the event time."""
+        self.flush()
+        clauses, params = [], []
+        for clause, value in (("user_id = ?", user_id), ("alert_type = ?", alert_type),
+                              ("ts >= ?", _epoch(since)), ("ts < ?", _epoch(until))):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        sql = "SELECT alert_id, created_at, timestamp, user_id, alert_type, details FROM alerts"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY ts, alert_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        columns = ['alert_id', 'created_at', 'timestamp', 'user_id', 'alert_type', 'details']
+        return [dict(zip(columns, row)) for row in self.conn.execute(sql, params)]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class JSONLAlertSink:
+    """
+    Append-only alerts.jsonl, one alert per line with an alert_id and
+    created_at. Batches are written with a single write and flushed to disk.
+    Queries are a linear scan; use the SQLite sink for indexed lookups.
+    """
+
+    def __init__(self, path=ALERT_SINK_PATHS['jsonl'], batch_size=1000):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self._pending = []
+        self._next_id = self._last_id() + 1
+
+    def _last_id(self):
+        # Ids continue from the last line, so reopening the file never reuses one.
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return 0
+        with open(self.path, 'r+b') as f:
+            pos = f.seek(0, 2)
+            chunk = b''
+            while pos > 0 and chunk.count(b'\n') < 2:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step) + chunk
+            if not chunk.endswith(b'\n'):
+                # A last line without its newline is a write cut short by a crash;
+                # drop it so the next batch does not get glued onto it.
+                keep = chunk.rfind(b'\n') + 1
+                print(f"Warning: dropping a partial last line ({len(chunk) - keep} bytes) from '{self.path}'.")
+                f.truncate(pos + keep)
+                chunk = chunk[:keep]
+        lines = chunk.strip().splitlines()
+        return json.loads(lines[-1])['alert_id'] if lines else 0
+
+    def append(self, alerts):
+        created_at = datetime.now(timezone.utc).isoformat()
+        for alert in alerts:
+            self._pending.append({'alert_id': self._next_id, 'created_at': created_at, **alert})
+            self._next_id += 1
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(alert) + '\n' for alert in self._pending))
+        self._pending = []
+
+    def query(self, user_id=None, alert_type=None, since=None, until=None, limit=None):
+        self.flush()
+        since, until = _epoch(since), _epoch(until)
+        matches = []
+        if not self.path.exists():
+            return matches
+        with open(self.path, 'r') as f:
+            for line in f:
+                alert = json.loads(line)
+                ts = _epoch(alert.get('timestamp'))
+                if ((user_id is None or alert.get('user_id') == user_id)
+                        and (alert_type is None or alert['alert_type'] == alert_type)
+                        and (since is None or (ts is not None and ts >= since))
+                        and (until is None or (ts is not None and ts < until))):
+                    matches.append(alert)
+        matches.sort(key=lambda a: (_epoch(a.get('timestamp')) or 0, a['alert_id']))
+        return matches if limit is None else matches[:limit]
+
+    def close(self):
+        self.flush()
+
+
+def open_alert_sink(kind, path=None, batch_size=1000):
+    sink_class = {'jsonl': JSONLAlertSink, 'sqlite': SQLiteAlertSink}[kind]
+    return sink_class(path or ALERT_SINK_PATHS[kind], batch_size=batch_size)
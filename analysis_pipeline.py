@@ -1,9 +1,16 @@
+import argparse
 import pandas as pd
+import numpy as np
 import json
 from datetime import datetime
 import math 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from alert_store import ALERT_SINK_PATHS, ALERT_SINK_TYPES, open_alert_sink
+from sketches import CountMinSketch, ScalableBloomFilter, hash_positions
+from profile_store import PROFILE_SQLITE_DB, SQLiteProfileStore
 
 PROFILE_DB = 'user_profiles.json'
+GROUP_SKETCH_DB = 'peer_group_sketches.json'
 
 
 class CustomEncoder(json.JSONEncoder):
@@ -25,6 +32,17 @@ def save_profiles(profiles):
     with open(PROFILE_DB, 'w') as f:
         json.dump(profiles, f, indent=2, cls=CustomEncoder)
 
+def load_group_sketches():
+    try:
+        with open(GROUP_SKETCH_DB, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_group_sketches(sketches):
+    with open(GROUP_SKETCH_DB, 'w') as f:
+        json.dump(sketches, f)
+
 def get_or_create_profile(profiles, user_id):
     if user_id not in profiles:
         profiles[user_id] = {
@@ -37,92 +55,362 @@ def get_or_create_profile(profiles, user_id):
         }
     return profiles[user_id]
 
-def run_analysis():
-    alert_weights = {
-        "New IP": 5,
-        "New Host": 10,
-        "Peer Group Deviation": 25,
-        "Suspicious Sequence": 50
-    }
+ALERT_WEIGHTS = {
+    "New IP": 5,
+    "New Host": 10,
+    "Peer Group Deviation": 25,
+    "Suspicious Sequence": 50,
+    "Anomalous Sequence": 25  # raised by stream_detector.py
+}
+
+RULE_COLUMNS = ['user_id', 'timestamp', 'src_ip', 'host', 'session_id', 'action', 'status']
+
+def _as_text(series):
+    # Missing values render as 'nan', the same as formatting them in an f-string.
+    values = series.astype(object)
+    return values.where(values.notna(), 'nan').astype(str)
+
+def _alert_frame(rows, rule_order, alert_type, details):
+    return pd.DataFrame({
+        'pos': rows['pos'], 'rule': rule_order, 'alert_type': alert_type,
+        'user_id': rows['user_id'], 'details': details, 'timestamp': rows['timestamp'],
+    })
+
+def _alert_records(frame):
+    records = frame[['alert_type', 'user_id', 'details']].assign(timestamp=[ts.isoformat() for ts in frame['timestamp']])
+    return records.to_dict('records')
+
+KNOWN_ENTITY_RULES = [
+    ("New IP", 'src_ip', 'known_ips', "New IP "),
+    ("New Host", 'host', 'known_hosts', "Accessed new host "),
+]
+
+# Sketch-backed baselines: per-user scalable Bloom filters stored in the
+# profile under '<known_key>_bloom', which start at 'capacity' values and grow
+# up to 'max_capacity', and a count-min sketch of host visits per peer group
+# kept next to the profiles. A host is unusual for a group while its
+# estimated earlier visits are below 'group_rare_count'.
+DEFAULT_SKETCH = {'capacity': 16, 'max_capacity': 4096, 'group_capacity': 256, 'group_rare_count': 1, 'fp_rate': 0.01}
+
+def _bloom_new_values(first, column, known, bloom_key, capacity, fp_rate, max_capacity=None):
+    """
+    Which (user, value) first occurrences a per-user scalable Bloom filter
+    would call new, fed the values in event order. A value is new if no full
+    layer holds it and one of its bits in the newest layer was unset before
+    it: not set in the stored filter and not set by an earlier value in this
+    batch. Returns (mask, updated filters as dicts).
+    """
+    codes, uniques = pd.factorize(first[column].astype(str))
+    layer_positions = {}
+
+    def positions(layer, rows):
+        key = (layer.num_hashes, layer.num_bits)
+        if key not in layer_positions:
+            layer_positions[key] = hash_positions(uniques, *key)
+        return layer_positions[key][codes[rows]]
+
+    is_new = np.zeros(len(first), dtype=bool)
+    filters = {}
+    for user_id, rows in first.groupby('user_id', sort=False).indices.items():
+        bloom = ScalableBloomFilter.from_dict(known[user_id].get(bloom_key), capacity, fp_rate, max_capacity)
+        while len(rows):
+            for full in bloom.layers if bloom.needs_layer() else bloom.layers[:-1]:
+                rows = rows[~full.test_bits(positions(full, rows)).all(axis=1)]
+            if not len(rows):
+                break
+            layer = bloom.current_layer()
+            user_positions = positions(layer, rows)
+            first_hit = ~pd.Series(user_positions.ravel()).duplicated().to_numpy()
+            new = (first_hit & ~layer.test_bits(user_positions.ravel())).reshape(user_positions.shape).any(axis=1)
+            # Values up to the one that fills the layer go in; the rest start the next
+            # layer. The last layer the cap allows takes everything.
+            room = layer.capacity - layer.count if bloom.can_grow() else len(rows)
+            fits = np.cumsum(new) <= room
+            layer.set_bits(user_positions[fits].ravel())
+            layer.count += int(new[fits].sum())
+            is_new[rows[fits]] = new[fits]
+            rows = rows[~fits]
+        filters[user_id] = bloom.to_dict()
+    return is_new, filters
+
+def user_rule_alerts(events, known, sketch=None):
+    """
+    The per-user rules (New IP, New Host, Suspicious Sequence) for the events
+    of any set of users. ``known`` maps each user_id to their profile (or the
+    known_* entries of it) and is not modified. Returns (alert frame, learned):
+    the new values per known_* key and user, or with ``sketch`` settings the
+    updated Bloom filters per '<known_key>_bloom' key and user.
+    Module-level so shards can run in worker processes.
+    """
+    alert_frames = []
+    learned = {}
+
+    # Rules 1 & 2: first time a user is seen with a value they don't already know.
+    for rule_order, (alert_type, column, known_key, prefix) in enumerate(KNOWN_ENTITY_RULES):
+        seen = events[events[column].notna()]
+        first = seen[~seen.duplicated(['user_id', column])]
+        if sketch:
+            is_new, learned[known_key + '_bloom'] = _bloom_new_values(
+                first, column, known, known_key + '_bloom', sketch['capacity'], sketch['fp_rate'], sketch.get('max_capacity'))
+            new = first[is_new]
+        else:
+            known_pairs = {(user_id, value) for user_id in first['user_id'].unique() for value in known[user_id][known_key]}
+            is_new = [pair not in known_pairs for pair in zip(first['user_id'], first[column])]
+            new = first[is_new]
+            learned[known_key] = {user_id: values.tolist() for user_id, values in new.groupby('user_id', sort=False)[column]}
+        alert_frames.append(_alert_frame(new, rule_order, alert_type, prefix + new[column].astype(str)))
+
+    # Rule 4: a successful login right after a failed one within the same session.
+    tracked = events[events['session_id'].notna() & events['action'].notna()]
+    state = _as_text(tracked['action']) + '_' + _as_text(tracked['status'])
+    previous = state.groupby(tracked['session_id']).shift(1)
+    sequences = tracked[(previous == 'login_failure') & (tracked['action'] == 'login') & (tracked['status'] == 'success')]
+    alert_frames.append(_alert_frame(
+        sequences, 3, "Suspicious Sequence",
+        "Successful login followed a failed login in the same session."
+    ))
+    return pd.concat(alert_frames, ignore_index=True), learned
 
+def _group_sketch_rarity(hosted, group_sketches, capacity, fp_rate, rare_count):
+    """
+    Per event, whether the host is rare for its peer group (estimated earlier
+    visits below ``rare_count``) and how many distinct hosts the group knew
+    before it, from each group's count-min sketch fed the events in order.
+    ``group_sketches`` maps str(group) to {'cms': sketch dict, 'hosts': n}
+    and is updated in place.
+    """
+    codes, uniques = pd.factorize(hosted['host'].astype(str))
+    cells_by_shape = {}
+    rare = np.zeros(len(hosted), dtype=bool)
+    hosts_before = np.zeros(len(hosted), dtype=np.int64)
+    for group, rows in hosted.groupby('peer_group', sort=False).indices.items():
+        stored = group_sketches.get(str(group))
+        cms = CountMinSketch.from_dict(stored['cms']) if stored else CountMinSketch.for_capacity(capacity, fp_rate)
+        known_hosts = stored['hosts'] if stored else 0
+        shape = (cms.width, cms.depth)
+        if shape not in cells_by_shape:
+            cells_by_shape[shape] = cms.cells(uniques)
+        cells = cells_by_shape[shape][codes[rows]]
+        # Visits before each event: the stored counters plus earlier events in this batch on the same cell.
+        before = np.min([cms.table[d, cells[:, d]] + pd.Series(cells[:, d]).groupby(cells[:, d]).cumcount().to_numpy()
+                         for d in range(cms.depth)], axis=0)
+        new_host = before == 0
+        rare[rows] = before < rare_count
+        hosts_before[rows] = known_hosts + np.cumsum(new_host) - new_host
+        cms.add_cells(cells)
+        group_sketches[str(group)] = {'cms': cms.to_dict(), 'hosts': known_hosts + int(new_host.sum())}
+    return rare, hosts_before
+
+def peer_group_alerts(events, user_to_group, sketch=None, group_sketches=None):
+    """
+    Rule 3: a host that is new to the whole peer group, once the group already knows more than 5 hosts.
+
+    With ``sketch`` settings, "new" means rare: each group's count-min sketch
+    in ``group_sketches`` (updated in place, so it carries over between runs)
+    estimates fewer than sketch['group_rare_count'] earlier visits to the host.
+    """
+    peer_group = events['user_id'].map(user_to_group)
+    hosted = events[peer_group.notna() & events['host'].notna()].copy()
+    hosted['peer_group'] = peer_group[hosted.index].astype(int)
+    if sketch:
+        rare, hosts_before = _group_sketch_rarity(
+            hosted, {} if group_sketches is None else group_sketches,
+            sketch['group_capacity'], sketch['fp_rate'], sketch['group_rare_count'])
+        deviations = hosted[rare & (hosts_before > 5)]
+    else:
+        is_first = ~hosted.duplicated(['peer_group', 'host'])
+        hosts_before = is_first.astype(int).groupby(hosted['peer_group']).cumsum() - 1
+        deviations = hosted[is_first & (hosts_before > 5)]
+    return _alert_frame(
+        deviations, 2, "Peer Group Deviation",
+        "Accessed unusual host '" + deviations['host'].astype(str) + "' for peer group " + deviations['peer_group'].astype(str) + "."
+    )
+
+def shard_users(events, user_to_group, num_shards):
+    """
+    Splits users into ``num_shards`` groups of roughly equal event counts,
+    ordered by peer group and then by user so that a group's users stay
+    together wherever the sizes allow. Returns one list of user_ids per
+    non-empty shard.
+    """
+    counts = events['user_id'].value_counts(sort=False)
+    order = pd.DataFrame({
+        'peer_group': counts.index.map(lambda u: user_to_group.get(u, -1)),
+        'user_id': counts.index,
+        'events': counts.to_numpy(),
+    }).sort_values(['peer_group', 'user_id'])
+    shard = (order['events'].cumsum() - 1) * num_shards // len(events)
+    return [group.tolist() for _, group in order['user_id'].groupby(shard.to_numpy())]
+
+def evaluate_rules(df, profiles, user_to_group, workers=1, sketch=None, group_sketches=None, on_alerts=None):
+    """
+    Applies the New IP, New Host, Peer Group Deviation and Suspicious Sequence
+    rules to time-ordered events with column operations instead of a per-event
+    loop. Updates ``profiles`` in place (known IPs/hosts, risk score, last seen)
+    and returns the alerts in the order the events produced them.
+
+    With ``workers`` > 1 the per-user rules run on user shards in a process
+    pool. The peer-group rule is the only one with state shared across users,
+    so it runs once over all events here. Results do not depend on the number
+    of workers.
+
+    ``sketch`` (e.g. DEFAULT_SKETCH) swaps the exact known_* lists for capped
+    scalable Bloom filters and the per-call peer-group host sets for count-min
+    sketches in ``group_sketches``, which persist between calls; see
+    compare_baselines.py for how the outcomes and sizes differ.
+
+    ``on_alerts`` is called with the alert records of the peer-group rule and
+    of each shard as soon as they are ready, so a sink can take them while
+    other shards still run.
+    """
+    # Only the columns the rules read; filtering wide event rows is the expensive part.
+    events = df.reindex(columns=RULE_COLUMNS)
+    events = events[events['user_id'].notna()].reset_index(drop=True)
+    events['pos'] = np.arange(len(events))
+    for user_id in pd.unique(events['user_id']):
+        get_or_create_profile(profiles, user_id)
+
+    def emit(frame):
+        if on_alerts is not None and len(frame):
+            on_alerts(_alert_records(frame.sort_values(['pos', 'rule'], kind='stable')))
+
+    known_keys = [known_key + ('_bloom' if sketch else '') for _, _, known_key, _ in KNOWN_ENTITY_RULES]
+    shards = shard_users(events, user_to_group, workers) if workers > 1 and len(events) else [None]
+    if len(shards) > 1:
+        shard_events = [events[events['user_id'].isin(users)] for users in shards]
+        shard_known = [{u: {key: profiles[u].get(key) for key in known_keys} for u in users} for users in shards]
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            futures = [pool.submit(user_rule_alerts, shard, known, sketch=sketch)
+                       for shard, known in zip(shard_events, shard_known)]
+            # The peer-group rule runs here while the shards do.
+            group_frame = peer_group_alerts(events, user_to_group, sketch, group_sketches)
+            emit(group_frame)
+            for future in as_completed(futures):
+                emit(future.result()[0])
+            results = [future.result() for future in futures]
+    else:
+        group_frame = peer_group_alerts(events, user_to_group, sketch, group_sketches)
+        emit(group_frame)
+        results = [user_rule_alerts(events, profiles, sketch=sketch)]
+        emit(results[0][0])
+
+    alert_frames = [group_frame]
+    for frame, learned in results:
+        alert_frames.append(frame)
+        for known_key, by_user in learned.items():
+            for user_id, values in by_user.items():
+                if sketch:
+                    profiles[user_id][known_key] = values
+                else:
+                    profiles[user_id][known_key].extend(values)
+
+    alerts_df = pd.concat(alert_frames, ignore_index=True).sort_values(['pos', 'rule'], kind='stable')
+    risk = alerts_df['alert_type'].map(ALERT_WEIGHTS).groupby(alerts_df['user_id']).sum()
+    for user_id, added in risk.items():
+        profiles[user_id]['risk_score'] += int(added)
+
+    for user_id, last_seen in events.groupby('user_id', sort=False)['timestamp'].last().items():
+        profiles[user_id]['last_seen'] = last_seen.isoformat()
+
+    return _alert_records(alerts_df)
+
+def run_analysis(profile_store='json', workers=1, alert_sink='json', sketch=None, events=None, user_to_group=None):
+    """
+    Runs the detection rules over the sessionized events, updates the stored
+    profiles and writes the alerts to ``alert_sink`` (None to only return
+    them). ``events`` and ``user_to_group`` are already loaded inputs to use
+    instead of the files; the event table is not modified.
+    """
     print("Loading and preparing sessionized data...")
-    try:
-        df = pd.read_json('data/normalized/events_sessionized.jsonl', lines=True)
-        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-        df.dropna(subset=['timestamp'], inplace=True)
-        df = df.sort_values(by='timestamp')
-    except FileNotFoundError:
-        print("Error: 'data/normalized/events_sessionized.jsonl' not found. Please run sessionize_events.py first.")
-        return
+    if events is not None:
+        df = events[events['timestamp'].notna()].sort_values(by='timestamp')
+    else:
+        try:
+            df = pd.read_json('data/normalized/events_sessionized.jsonl', lines=True)
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            df.dropna(subset=['timestamp'], inplace=True)
+            df = df.sort_values(by='timestamp')
+        except FileNotFoundError:
+            print("Error: 'data/normalized/events_sessionized.jsonl' not found. Please run sessionize_events.py first.")
+            return
 
     print("Loading profiles and peer group data...")
-    profiles = load_profiles()
-    try:
-        with open('user_to_peer_group.json', 'r') as f:
-            user_to_group = json.load(f)
-    except FileNotFoundError:
-        print("Warning: 'user_to_peer_group.json' not found. Skipping peer group analysis.")
-        user_to_group = {}
+    if profile_store == 'sqlite':
+        profiles = SQLiteProfileStore(PROFILE_SQLITE_DB)
+        if len(profiles) == 0:
+            imported = profiles.import_json(PROFILE_DB)
+            if imported:
+                print(f"Imported {imported} profiles from '{PROFILE_DB}' into '{PROFILE_SQLITE_DB}'.")
+        # Decay every stored score in one statement, then read only the users in this batch.
+        profiles.decay_risk_scores(0.99)
+        profiles.load_many(pd.unique(df['user_id'].dropna()))
+    else:
+        profiles = load_profiles()
+        for user_id, profile in profiles.items():
+            profile['risk_score'] = round(profile.get('risk_score', 0) * 0.99)
+    if user_to_group is None:
+        try:
+            with open('user_to_peer_group.json', 'r') as f:
+                user_to_group = json.load(f)
+        except FileNotFoundError:
+            print("Warning: 'user_to_peer_group.json' not found. Skipping peer group analysis.")
+            user_to_group = {}
 
-    for user_id, profile in profiles.items():
-        profile['risk_score'] = round(profile.get('risk_score', 0) * 0.99)
+    group_sketches = None
+    if sketch:
+        group_sketches = profiles.load_group_sketches() if profile_store == 'sqlite' else load_group_sketches()
 
-    alerts = []
-    group_profiles = {i: {'known_hosts': set()} for i in set(user_to_group.values())}
-    
-    session_tracker = {}
+    # Append-only sinks take each shard's alerts as soon as it finishes.
+    sink = open_alert_sink(alert_sink) if alert_sink not in (None, 'json') else None
+
+    def append_alerts(records):
+        sink.append(records)
+        sink.flush()
 
     print("\nProcessing events and applying all detection logic...")
-    for index, event in df.iterrows():
-        user_id = event.get('user_id')
-        if pd.isna(user_id):
-            continue
-
-        profile = get_or_create_profile(profiles, user_id)
-        
-        # Rule 1: New IP
-        event_ip = event.get('src_ip')
-        if pd.notna(event_ip) and event_ip not in profile['known_ips']:
-            alerts.append({"alert_type": "New IP", "user_id": user_id, "details": f"New IP {event_ip}"})
-            profile['risk_score'] += alert_weights["New IP"] # Add to risk score
-            profile['known_ips'].append(event_ip)
-
-        # Rule 2: New Host
-        event_host = event.get('host')
-        if pd.notna(event_host) and event_host not in profile['known_hosts']:
-            alerts.append({"alert_type": "New Host", "user_id": user_id, "details": f"Accessed new host {event_host}"})
-            profile['risk_score'] += alert_weights["New Host"] # Add to risk score
-            profile['known_hosts'].append(event_host)
-            
-        # Rule 3: Peer Group Deviation
-        peer_group_id = user_to_group.get(user_id)
-        if peer_group_id is not None and pd.notna(event_host):
-            group_known_hosts = group_profiles[peer_group_id]['known_hosts']
-            if event_host not in group_known_hosts and len(group_known_hosts) > 5:
-                alerts.append({"alert_type": "Peer Group Deviation", "user_id": user_id, "details": f"Accessed unusual host '{event_host}' for peer group {peer_group_id}."})
-                profile['risk_score'] += alert_weights["Peer Group Deviation"] # Add to risk score
-            group_known_hosts.add(event_host)
-            
-        # Rule 4: Suspicious Sequence
-        session_id = event.get('session_id')
-        action = event.get('action')
-        status = event.get('status')
-        if pd.notna(session_id) and pd.notna(action):
-            last_action_status = session_tracker.get(session_id)
-            if last_action_status == 'login_failure' and action == 'login' and status == 'success':
-                alerts.append({"alert_type": "Suspicious Sequence", "user_id": user_id, "details": "Successful login followed a failed login in the same session."})
-                profile['risk_score'] += alert_weights["Suspicious Sequence"] # Add to risk score
-            session_tracker[session_id] = f"{action}_{status}"
-
-        if pd.notna(event['timestamp']):
-            profile['last_seen'] = event['timestamp'].isoformat()
+    try:
+        alerts = evaluate_rules(df, profiles, user_to_group, workers=workers, sketch=sketch,
+                                group_sketches=group_sketches, on_alerts=append_alerts if sink else None)
+    finally:
+        if sink is not None:
+            sink.close()
 
     print("\nSaving updated user profiles with new risk scores...")
-    save_profiles(profiles)
+    if profile_store == 'sqlite':
+        print(f"Upserted {profiles.flush()} changed profiles into '{PROFILE_SQLITE_DB}'.")
+        if group_sketches is not None:
+            profiles.save_group_sketches(group_sketches)
+        profiles.close()
+    else:
+        save_profiles(profiles)
+        if group_sketches is not None:
+            save_group_sketches(group_sketches)
     print(f"\nGenerated {len(alerts)} alerts.")
-    with open('alerts.json', 'w') as f:
-        json.dump(alerts, f, indent=2, cls=CustomEncoder)
-    print("New alerts saved to alerts.json")
+    if alert_sink == 'json':
+        with open('alerts.json', 'w') as f:
+            json.dump(alerts, f, indent=2, cls=CustomEncoder)
+        print("New alerts saved to alerts.json")
+    elif alert_sink is not None:
+        print(f"New alerts appended to {ALERT_SINK_PATHS[alert_sink]}")
+    return alerts
 
 if __name__ == "__main__":
-    run_analysis()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rule-based detection over the sessionized events.")
+    parser.add_argument("--profile-store", choices=["json", "sqlite"], default="json",
+                        help=f"Keep user profiles in '{PROFILE_DB}' or the indexed '{PROFILE_SQLITE_DB}'.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the per-user rules, sharded by peer group and user.")
+    parser.add_argument("--alert-sink", choices=["json", *ALERT_SINK_TYPES], default="json",
+                        help="Rewrite alerts.json, or append to alerts.jsonl / the indexed alerts.db.")
+    parser.add_argument("--baseline", choices=["exact", "sketch"], default="exact",
+                        help="Exact known IP/host lists and peer-group host sets, or Bloom filters and count-min sketches.")
+    parser.add_argument("--sketch-capacity", type=int, default=DEFAULT_SKETCH['capacity'], help="Distinct IPs/hosts per user the first Bloom filter layer holds in sketch mode.")
+    parser.add_argument("--sketch-max-capacity", type=int, default=DEFAULT_SKETCH['max_capacity'], help="Distinct IPs/hosts per user past which a Bloom filter stops growing in sketch mode.")
+    parser.add_argument("--group-sketch-capacity", type=int, default=DEFAULT_SKETCH['group_capacity'], help="Expected distinct hosts per peer group in sketch mode.")
+    parser.add_argument("--group-rare-count", type=int, default=DEFAULT_SKETCH['group_rare_count'], help="In sketch mode, a host is unusual for a peer group until it has had this many visits.")
+    parser.add_argument("--fp-rate", type=float, default=DEFAULT_SKETCH['fp_rate'], help="Target false-positive rate of the sketches.")
+    args = parser.parse_args()
+    sketch = None
+    if args.baseline == 'sketch':
+        sketch = {'capacity': args.sketch_capacity, 'max_capacity': args.sketch_max_capacity, 'group_capacity': args.group_sketch_capacity,
+                  'group_rare_count': args.group_rare_count, 'fp_rate': args.fp_rate}
+    run_analysis(profile_store=args.profile_store, workers=args.workers, alert_sink=args.alert_sink, sketch=sketch)
\ No newline at end of file
@@ -3,6 +3,9 @@ import pandas as pd
 import json
 import plotly.graph_objects as go
 import numpy as np
+import os
+from analysis_pipeline import ALERT_WEIGHTS
+from som_model import SOM_MODEL_PATH, load_som_model
 
 # --- Helper Functions for Data Loading and Styling ---
 
@@ -35,86 +38,180 @@ def load_mitre_report(file_content):
         st.error(f"Error loading MITRE report data: {str(e)}")
         return [], pd.DataFrame()
 
-# NEW: Function to load data from the provided risk table image (Task 1)
+# --- Pipeline Artifacts ---
+# Each loader takes the file's mtime as part of its cache key, so a pipeline
+# run that rewrites the file is picked up on the next rerun and an unchanged
+# file is never parsed twice. A missing file has an mtime of None.
+
+ALERTS_PATH = 'alerts.json'
+SEQUENCE_SCORES_PATH = 'sequence_anomalies_2nd_order.jsonl'
+SOM_RESULTS_PATH = 'som_results.json'
+USER_PROFILES_PATH = 'user_profiles.json'
+PEER_GROUPS_PATH = 'user_to_peer_group.json'
+SEQUENCE_ALERT_PERCENTILE = 99
+
+def artifact_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def _read_json(path, mtime, default):
+    if mtime is None:
+        return default
+    with open(path, 'r') as f:
+        return json.load(f)
+
 @st.cache_data
-def load_top_risky_users_data():
+def load_alerts(path, mtime):
+    alerts = pd.DataFrame(_read_json(path, mtime, []), columns=['alert_type', 'user_id', 'details', 'timestamp'])
+    alerts['alert_id'] = [f"alert_{i + 1}" for i in range(len(alerts))]
+    return alerts
+
+@st.cache_data
+def load_user_profiles(path, mtime):
+    profiles = _read_json(path, mtime, {})
+    return pd.DataFrame(
+        [{'user_id': user_id, 'risk_score': p.get('risk_score', 0), 'last_seen': p.get('last_seen')} for user_id, p in profiles.items()],
+        columns=['user_id', 'risk_score', 'last_seen'],
+    )
+
+@st.cache_data
+def load_peer_groups(path, mtime):
+    return _read_json(path, mtime, {})
+
+@st.cache_data
+def load_som_results(path, mtime):
+    return pd.DataFrame(_read_json(path, mtime, []),
+                        columns=['user_id', 'flagged_epochs', 'total_epochs', 'attack_score', 'benign_score'])
+
+@st.cache_data
+def load_sequence_summary(path, mtime, percentile=SEQUENCE_ALERT_PERCENTILE):
     """
-    Load the actual Top 10 High Risk User data from the provided image/table.
-    This data replaces the mock unified risk data.
+    Per-user Markov summary from the session scores: the highest score and
+    the number of sessions at or above the ``percentile`` of all scores.
+    Streams the file and keeps only (user, score), never the sequences.
     """
-    data = [
-        {"Rank": 1, "User ID": "dudleynicholas", "Composite Risk Score": 68.4, "Risk Level": "HIGH", "Markov Risk": 72.1, "SOM Risk": 62.5, "Suspicious Occurrences": 89, "Max Anomaly Score": 3.78},
-        {"Rank": 2, "User ID": "jacqueline19", "Composite Risk Score": 66.8, "Risk Level": "HIGH", "Markov Risk": 69.3, "SOM Risk": 62.5, "Suspicious Occurrences": 84, "Max Anomaly Score": 3.74},
-        {"Rank": 3, "User ID": "mitchellclark", "Composite Risk Score": 64.2, "Risk Level": "HIGH", "Markov Risk": 67.8, "SOM Risk": 58.4, "Suspicious Occurrences": 78, "Max Anomaly Score": 3.42},
-        {"Rank": 4, "User ID": "xreid", "Composite Risk Score": 63.1, "Risk Level": "HIGH", "Markov Risk": 66.4, "SOM Risk": 57.6, "Suspicious Occurrences": 76, "Max Anomaly Score": 3.74},
-        {"Rank": 5, "User ID": "hoffmanjennifer", "Composite Risk Score": 58.9, "Risk Level": "HIGH", "Markov Risk": 62.1, "SOM Risk": 53.2, "Suspicious Occurrences": 71, "Max Anomaly Score": 3.64},
-        {"Rank": 6, "User ID": "susanrogers", "Composite Risk Score": 57.3, "Risk Level": "HIGH", "Markov Risk": 60.8, "SOM Risk": 51.0, "Suspicious Occurrences": 68, "Max Anomaly Score": 3.41},
-        {"Rank": 7, "User ID": "robinsonwilliam", "Composite Risk Score": 56.7, "Risk Level": "HIGH", "Markov Risk": 59.5, "SOM Risk": 51.6, "Suspicious Occurrences": 66, "Max Anomaly Score": 3.17},
-        {"Rank": 8, "User ID": "kendragalloway", "Composite Risk Score": 55.4, "Risk Level": "HIGH", "Markov Risk": 58.9, "SOM Risk": 49.2, "Suspicious Occurrences": 64, "Max Anomaly Score": 3.41},
-        {"Rank": 9, "User ID": "test_attacker", "Composite Risk Score": 50.0, "Risk Level": "HIGH", "Markov Risk": 0.0, "SOM Risk": 125.0, "Suspicious Occurrences": 0, "Max Anomaly Score": np.nan},
-        {"Rank": 10, "User ID": "jamesmichael", "Composite Risk Score": 54.1, "Risk Level": "HIGH", "Markov Risk": 57.2, "SOM Risk": 48.8, "Suspicious Occurrences": 62, "Max Anomaly Score": 3.22},
-    ]
+    columns = ['user_id', 'max_score', 'suspicious_sessions']
+    if mtime is None:
+        return pd.DataFrame(columns=columns), None
+    users, scores = [], []
+    with open(path, 'r') as f:
+        for line in f:
+            row = json.loads(line)
+            users.append(row['user_id'])
+            scores.append(row['score'])
+    if not scores:
+        return pd.DataFrame(columns=columns), None
+    sessions = pd.DataFrame({'user_id': users, 'score': scores})
+    threshold = float(np.percentile(sessions['score'], percentile))
+    summary = sessions.groupby('user_id')['score'].agg(
+        max_score='max', suspicious_sessions=lambda s: int((s >= threshold).sum())
+    ).reset_index()
+    return summary, threshold
 
-    df = pd.DataFrame(data)
-    # The image data is already sorted by Composite Risk Score descending.
-    
-    # Simulate the alerts structure from the old mock data for 'Deep Dive' section compatibility
-    # This is a simplification since the image data doesn't provide granular alerts.
-    df['contributing_alerts'] = df.apply(
-        lambda row: [
-            {"alert_id": f"alert_{row['Rank']}_M", "type": "Markov Deviation", "severity": "high"},
-            {"alert_id": f"alert_{row['Rank']}_S", "type": "SOM Anomaly", "severity": "critical"}
-        ], axis=1
-    )
-    # Simulate a 'peer_group' for compatibility with the Deep Dive section
-    df['peer_group'] = df.apply(
-        lambda row: "admin_users" if row['Rank'] in [1, 3, 5] else "regular_users", axis=1
-    )
-    
-    # Rename columns to match internal keys for downstream logic (like user selection)
-    df = df.rename(columns={
-        'User ID': 'user_id',
-        'Composite Risk Score': 'unified_risk_score',
-        'SOM Risk': 'som_score',
-    })
-    
-    return df
+@st.cache_data
+def load_user_sequences(path, mtime, user_id):
+    """One user's scored sessions, highest first. Older score files have no session_id; it is left empty."""
+    rows = []
+    if mtime is not None:
+        with open(path, 'r') as f:
+            for line in f:
+                # Cheap substring test before parsing; most lines belong to other users.
+                if user_id in line:
+                    row = json.loads(line)
+                    if row['user_id'] == user_id:
+                        rows.append({k: row.get(k) for k in ('session_id', 'user_id', 'score', 'sequence')})
+    return pd.DataFrame(rows, columns=['session_id', 'user_id', 'score', 'sequence']).sort_values('score', ascending=False)
+
+def alert_severity(alert_type):
+    weight = ALERT_WEIGHTS.get(alert_type, 0)
+    if weight >= 50:
+        return "critical"
+    if weight >= 25:
+        return "high"
+    return "medium" if weight >= 10 else "low"
+
+def _percentile_rank(values):
+    """0-100 rank of each value among all users (ties share the average rank)."""
+    return values.rank(pct=True) * 100 if len(values) else values
 
 @st.cache_data
+def build_risk_table(artifacts, top_n=10):
+    """
+    The top ``top_n`` users by composite risk, the mean of three 0-100 scores:
+    Markov risk (percentile of the user's worst session score), SOM risk
+    (share of epochs the user was flagged as an outlier) and rule risk
+    (percentile of the alert-driven profile risk score). ``artifacts`` maps
+    each artifact name to its (path, mtime), which keys the cache.
+    """
+    profiles = load_user_profiles(*artifacts['profiles'])
+    som = load_som_results(*artifacts['som'])
+    sequences, _ = load_sequence_summary(*artifacts['sequences'])
+    alerts = load_alerts(*artifacts['alerts'])
+    peer_groups = load_peer_groups(*artifacts['peer_groups'])
+
+    users = pd.DataFrame({'user_id': sorted(set(profiles['user_id']) | set(som['user_id']) | set(sequences['user_id']))})
+    if users.empty:
+        return pd.DataFrame(columns=['Rank', 'user_id', 'unified_risk_score', 'Risk Level', 'Markov Risk', 'som_score',
+                                     'Suspicious Occurrences', 'Max Anomaly Score', 'contributing_alerts', 'peer_group'])
+    df = (users.merge(profiles[['user_id', 'risk_score']], on='user_id', how='left')
+               .merge(som[['user_id', 'flagged_epochs', 'total_epochs']], on='user_id', how='left')
+               .merge(sequences, on='user_id', how='left'))
+    df['Markov Risk'] = _percentile_rank(df['max_score']).fillna(0.0).round(1)
+    df['som_score'] = (100 * df['flagged_epochs'] / df['total_epochs']).fillna(0.0).round(1)
+    rule_risk = _percentile_rank(df['risk_score'].fillna(0)).fillna(0.0)
+    df['unified_risk_score'] = ((df['Markov Risk'] + df['som_score'] + rule_risk) / 3).round(1)
+    df['Risk Level'] = np.select([df['unified_risk_score'] >= 60.0, df['unified_risk_score'] >= 50.0],
+                                 ['HIGH', 'MEDIUM'], default='LOW')
+    df['Suspicious Occurrences'] = df['suspicious_sessions'].fillna(0).astype(int)
+    df['Max Anomaly Score'] = df['max_score'].round(2)
+
+    df = df.sort_values('unified_risk_score', ascending=False).head(top_n).reset_index(drop=True)
+    df.insert(0, 'Rank', range(1, len(df) + 1))
+    user_alerts = alerts[alerts['user_id'].isin(df['user_id'])].groupby('user_id')
+    alerts_by_user = {
+        user_id: [{"alert_id": a.alert_id, "type": a.alert_type, "severity": alert_severity(a.alert_type)} for a in group.itertuples()]
+        for user_id, group in user_alerts
+    }
+    df['contributing_alerts'] = df['user_id'].map(lambda u: alerts_by_user.get(u, []))
+    df['peer_group'] = df['user_id'].map(lambda u: f"group_{peer_groups[u]}" if u in peer_groups else "unassigned")
+    return df[['Rank', 'user_id', 'unified_risk_score', 'Risk Level', 'Markov Risk', 'som_score',
+               'Suspicious Occurrences', 'Max Anomaly Score', 'contributing_alerts', 'peer_group']]
+
+def pipeline_artifacts():
+    paths = {'profiles': USER_PROFILES_PATH, 'som': SOM_RESULTS_PATH, 'sequences': SEQUENCE_SCORES_PATH,
+             'alerts': ALERTS_PATH, 'peer_groups': PEER_GROUPS_PATH}
+    return {name: (path, artifact_mtime(path)) for name, path in paths.items()}
+
+def load_top_risky_users_data():
+    """The Top 10 High Risk User table built from the latest pipeline outputs."""
+    return build_risk_table(pipeline_artifacts())
+
 def load_unified_risk_data():
-    """Load the new actual unified risk data."""
-    # This function is replaced to load the actual data from the image/table (Task 1)
+    """Load the unified risk data."""
     return load_top_risky_users_data()
 
-@st.cache_data
-def load_sequence_alerts_data():
-    """Load mock sequence alerts data."""
-    # Data is kept as mock since actual sequence data is not in the image/table
-    mock_sequence_alerts = [
-        {"session_id": "session_001", "user_id": "dudleynicholas", "score": 0.92, "sequence": ["login", "privilege_change", "data_access", "logout"]},
-        {"session_id": "session_002", "user_id": "jacqueline19", "score": 0.85, "sequence": ["login", "data_download", "upload", "suspicious_activity"]},
-        {"session_id": "session_003", "user_id": "mitchellclark", "score": 0.80, "sequence": ["login", "data_exfiltration"]},
-        {"session_id": "session_004", "user_id": "jamesmichael", "score": 0.70, "sequence": ["login", "unusual_access"]},
-    ]
-    return pd.DataFrame(mock_sequence_alerts)
+def load_sequence_alerts_data(user_id):
+    """Scored Markov sessions for one user, read on demand from the sequence scores."""
+    return load_user_sequences(SEQUENCE_SCORES_PATH, artifact_mtime(SEQUENCE_SCORES_PATH), user_id)
 
-@st.cache_data
 def load_anomaly_patterns_data():
-    """Load mock anomaly patterns data."""
-    # Data is adapted from the image data for SOM Anomaly Score compatibility
-    anomaly_patterns_data = [
-        {"user_id": "dudleynicholas", "som_anomaly_score": 0.625}, # 62.5 / 100
-        {"user_id": "jacqueline19", "som_anomaly_score": 0.625},
-        {"user_id": "mitchellclark", "som_anomaly_score": 0.584},
-        {"user_id": "xreid", "som_anomaly_score": 0.576},
-        {"user_id": "hoffmanjennifer", "som_anomaly_score": 0.532},
-        {"user_id": "susanrogers", "som_anomaly_score": 0.510},
-        {"user_id": "robinsonwilliam", "som_anomaly_score": 0.516},
-        {"user_id": "kendragalloway", "som_anomaly_score": 0.492},
-        {"user_id": "test_attacker", "som_anomaly_score": 1.25}, # 125.0 / 100
-        {"user_id": "jamesmichael", "som_anomaly_score": 0.488},
-    ]
-    return pd.DataFrame(anomaly_patterns_data)
+    """SOM anomaly score per user: the share of epochs the user was flagged in."""
+    som = load_som_results(SOM_RESULTS_PATH, artifact_mtime(SOM_RESULTS_PATH))
+    return pd.DataFrame({'user_id': som['user_id'], 'som_anomaly_score': som['flagged_epochs'] / som['total_epochs']})
+
+@st.cache_data
+def load_som_map(path, mtime):
+    """
+    Load the persisted SOM (U-matrix plus each user's BMU) written by som_analysis.py.
+    ``mtime`` is only part of the cache key so a new pipeline run is picked up.
+    """
+    model = load_som_model(path)
+    users = pd.DataFrame({
+        'user_id': model['user_ids'],
+        'bmu_x': model['bmu'][:, 0],
+        'bmu_y': model['bmu'][:, 1],
+        'q_error': model['q_error'],
+    })
+    return model['u_matrix'], users
 
 # MODIFIED: Highlight function to use session state for visual highlight (Task 3)
 def highlight_selected_user(row):
@@ -302,8 +399,12 @@ st.markdown("""
 
 def create_interactive_map_simulated(selected_user, mitre_users_list):
     """
-    Creates an interactive Plotly figure with simulated SOM data.
+    Creates an interactive Plotly figure of the SOM. Uses the map persisted by
+    som_analysis.py when available, otherwise falls back to simulated data.
     """
+    if os.path.exists(SOM_MODEL_PATH):
+        return create_interactive_map_from_model(selected_user, mitre_users_list)
+
     # Simulated data for a 10x10 map
     u_matrix = [[(i + j) / 20 for i in range(10)] for j in range(10)]
     
@@ -382,6 +483,51 @@ def create_interactive_map_simulated(selected_user, mitre_users_list):
     # Return figure and user data for Streamlit to handle the click event
     return fig, users
 
+def create_interactive_map_from_model(selected_user, mitre_users_list):
+    """
+    Creates the SOM figure from the persisted U-matrix and each user's BMU.
+    """
+    u_matrix, som_users = load_som_map(SOM_MODEL_PATH, os.path.getmtime(SOM_MODEL_PATH))
+    som_users = som_users[som_users['user_id'].isin(mitre_users_list)]
+
+    # Spread users that share a neuron around its centre (deterministic per user).
+    jitter = np.random.RandomState(42).uniform(-0.3, 0.3, size=(len(som_users), 2))
+    users = [
+        {'user_id': row.user_id, 'x': row.bmu_x + jx, 'y': row.bmu_y + jy, 'q_error': row.q_error}
+        for row, (jx, jy) in zip(som_users.itertuples(index=False), jitter)
+    ]
+
+    heatmap = go.Heatmap(z=u_matrix.T, colorscale='Viridis', showscale=False)
+    user_points = go.Scatter(
+        x=[u['x'] for u in users],
+        y=[u['y'] for u in users],
+        mode='markers',
+        hoverinfo='text',
+        text=[f"User: {u['user_id']}<br>Quantization Error: {u['q_error']:.3f}" for u in users],
+        customdata=[u['user_id'] for u in users],
+        marker=dict(
+            size=10,
+            color=['#FFD700' if u['user_id'] == selected_user else '#FFFFFF' for u in users],
+            symbol='circle',
+            line=dict(color=['#000000' for u in users], width=1)
+        )
+    )
+
+    map_x, map_y = u_matrix.shape
+    layout = go.Layout(
+        title={'text': 'Strategic Anomaly Map (SOM)', 'x': 0.5},
+        xaxis={'title': 'SOM X-Coordinate', 'showgrid': False, 'zeroline': False, 'range': [-0.5, map_x - 0.5]},
+        yaxis={'title': 'SOM Y-Coordinate', 'showgrid': False, 'zeroline': False, 'range': [-0.5, map_y - 0.5]},
+        autosize=True,
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
+        showlegend=False
+    )
+
+    fig = go.Figure(data=[heatmap, user_points], layout=layout)
+    fig.update_layout(height=500)
+    return fig, users
+
 # NEW: Plotly Click Handler (Task 3)
 def handle_plot_click(click_data, df):
     """
@@ -424,9 +570,8 @@ def main():
     mitre_report_content = st.session_state.get('mitre_detection_report.json', '[]')
     mitre_raw_data, mitre_alerts_df = load_mitre_report(mitre_report_content)
 
-    # Load mock data
+    # Load the pipeline outputs; session sequences are only read in the user deep dive
     unified_risk_df_internal = load_unified_risk_data() # Internal dataframe with standardized keys
-    sequence_alerts_df = load_sequence_alerts_data()
     anomaly_patterns_df = load_anomaly_patterns_data()
     
     # Project Drishti Header
@@ -690,12 +835,13 @@ def main():
         
         with col2:
             with st.expander("Full Sequence Alert Details (Markov Model)"):
-                user_sequences = sequence_alerts_df[sequence_alerts_df['user_id'] == selected_user]
-                
-                if not user_sequences.empty:
+                # Expander bodies always run, so the scan of the scores file waits for this checkbox.
+                if not st.checkbox("Load scored sessions", key=f"load_sequences_{selected_user}"):
+                    st.caption("Reads this user's sessions from the sequence scores file.")
+                elif not (user_sequences := load_sequence_alerts_data(selected_user)).empty:
                     sequence_display = user_sequences.copy()
-                    sequence_display['score'] = (sequence_display['score'] * 100).round(0).astype(int)
-                    sequence_display['sequence'] = sequence_display['sequence'].apply(lambda x: " → ".join(x))
+                    sequence_display['score'] = sequence_display['score'].round(2)
+                    sequence_display['sequence'] = sequence_display['sequence'].str.replace(" -> ", " → ", regex=False)
                     sequence_display.columns = ['Session ID', 'User ID', 'Score', 'Behavioral Sequence']
                     
                     st.dataframe(
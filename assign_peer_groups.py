@@ -3,14 +3,22 @@ from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 import json
 
-def create_peer_groups(num_clusters=4):
-
-    print("Loading user features...")
-    try:
-        df = pd.read_csv('user_features.csv')
-    except FileNotFoundError:
-        print("Error: 'user_features.csv' not found. Please run 'build_features.py' first.")
-        return
+def create_peer_groups(num_clusters=4, features=None, output_path='user_to_peer_group.json'):
+    """
+    Clusters users into peer groups. ``features`` is a feature matrix indexed
+    by user_id (as returned by build_features) to use instead of reading
+    user_features.csv. With ``output_path=None`` nothing is written.
+    Returns {user_id: peer_group}.
+    """
+    if features is not None:
+        df = features.reset_index()
+    else:
+        print("Loading user features...")
+        try:
+            df = pd.read_csv('user_features.csv')
+        except FileNotFoundError:
+            print("Error: 'user_features.csv' not found. Please run 'build_features.py' first.")
+            return
         
     user_ids = df['user_id']
     features = df.drop('user_id', axis=1)
@@ -26,13 +34,13 @@ def create_peer_groups(num_clusters=4):
 
     user_to_group = pd.Series(df.peer_group.values, index=df.user_id).to_dict()
     
-    output_path = 'user_to_peer_group.json'
-    with open(output_path, 'w') as f:
-        json.dump(user_to_group, f, indent=2)
-    
-    print(f"Peer group assignments saved to {output_path}")
+    if output_path is not None:
+        with open(output_path, 'w') as f:
+            json.dump(user_to_group, f, indent=2)
+        print(f"Peer group assignments saved to {output_path}")
     print("\nExample assignments:")
     print(df[['user_id', 'peer_group']].head())
+    return user_to_group
 
 
 if __name__ == "__main__":
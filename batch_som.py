@@ -0,0 +1,139 @@
+import numpy as np
+
+# Offsets of the 8 neighbours used for the rectangular U-matrix, in the same
+# order MiniSom uses.
+NEIGHBOR_OFFSETS = [(0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1)]
+
+
+BMU_INDEX_TYPES = ('kdtree', 'balltree')
+
+# Upper bound on the (rows x neurons) distance block held in memory at once.
+MAX_BLOCK_CELLS = 1 << 21
+
+
+def build_bmu_index(codebook, kind=None):
+    """
+    Optional spatial index over the (flattened) codebook for BMU lookups.
+    Returns None for brute force. Ties between equally close neurons may be
+    broken differently than brute force, but the distances are the same.
+    """
+    if kind is None:
+        return None
+    from sklearn.neighbors import BallTree, KDTree
+    return {'kdtree': KDTree, 'balltree': BallTree}[kind](codebook)
+
+
+def bmu_indices(data, codebook, batch_size=2048, index=None):
+    """
+    Flat index of the best-matching unit for every row of ``data``. Distances
+    are computed for a block of rows at a time with one matrix product, using
+    the same expansion as MiniSom (|x|^2 - 2 x.w + |w|^2). The |x|^2 term is
+    constant per row, so it is left out of the argmin. Small blocks keep the
+    (rows x neurons) temporary in cache, and the block shrinks as the map
+    grows so memory stays bounded. With an ``index`` from build_bmu_index the
+    blocks are queried against the tree instead.
+    """
+    bmus = np.empty(len(data), dtype=np.int64)
+    batch_size = max(1, min(batch_size, MAX_BLOCK_CELLS // max(1, len(codebook))))
+    if index is not None:
+        for start in range(0, len(data), batch_size):
+            bmus[start:start + batch_size] = index.query(data[start:start + batch_size], k=1)[1][:, 0]
+        return bmus
+    weights_sq = np.einsum('ij,ij->i', codebook, codebook)
+    scaled = -2 * codebook.T
+    for start in range(0, len(data), batch_size):
+        dists = data[start:start + batch_size] @ scaled
+        dists += weights_sq
+        bmus[start:start + batch_size] = dists.argmin(axis=1)
+    return bmus
+
+
+def quantization_errors(data, codebook, batch_size=2048, index=None):
+    """
+    Distance from every row of ``data`` to its BMU, computed block by block so
+    memory stays bounded by ``batch_size`` rows regardless of the user count.
+    """
+    errors = np.empty(len(data))
+    for start in range(0, len(data), batch_size):
+        block = data[start:start + batch_size]
+        if index is not None:
+            errors[start:start + batch_size] = index.query(block, k=1)[0][:, 0]
+        else:
+            bmus = bmu_indices(block, codebook, batch_size)
+            errors[start:start + batch_size] = np.linalg.norm(codebook[bmus] - block, axis=1)
+    return errors
+
+
+def u_matrix(weights):
+    """Vectorized equivalent of MiniSom.distance_map(scaling='sum') for rectangular maps."""
+    x, y, _ = weights.shape
+    um = np.zeros((x, y))
+    for dx, dy in NEIGHBOR_OFFSETS:
+        # Pair every neuron (i, j) with (i + dx, j + dy) where both are on the map.
+        src = weights[max(0, -dx):x - max(0, dx), max(0, -dy):y - max(0, dy)]
+        dst = weights[max(0, dx):x - max(0, -dx), max(0, dy):y - max(0, -dy)]
+        um[max(0, -dx):x - max(0, dx), max(0, -dy):y - max(0, dy)] += np.linalg.norm(src - dst, axis=2)
+    return um / um.max()
+
+
+class BatchSOM:
+    """
+    Batch-mode SOM with the parts of the MiniSom interface that
+    som_analysis uses.
+
+    Every iteration assigns BMUs for the whole dataset (or a random
+    minibatch), accumulates per-neuron sums, and sets each neuron to the
+    neighbourhood-weighted mean of those sums. That last step is a single
+    (neurons x neurons) @ (neurons x features) product.
+    """
+
+    def __init__(self, x, y, input_len, sigma=1.5, random_seed=None, bmu_index=None):
+        self.x, self.y = x, y
+        self.sigma = sigma
+        self.bmu_index = bmu_index
+        self._random_generator = np.random.RandomState(random_seed)
+        # Random unit-vector start, drawn exactly like MiniSom so that both
+        # trainers see the same random stream for a given seed.
+        self._weights = self._random_generator.rand(x, y, input_len) * 2 - 1
+        self._weights /= np.linalg.norm(self._weights, axis=-1, keepdims=True)
+        grid = np.indices((x, y)).reshape(2, -1).T
+        self._grid_sq = ((grid[:, None, :] - grid[None, :, :]) ** 2).sum(axis=2)
+
+    def random_weights_init(self, data):
+        # Same draws as MiniSom.random_weights_init for a given seed.
+        picks = self._random_generator.randint(len(data), size=self.x * self.y)
+        self._weights = data[picks].reshape(self.x, self.y, -1).astype(float)
+
+    def neighborhood(self, sigma):
+        return np.exp(-self._grid_sq / (2 * sigma * sigma))
+
+    def train_batch(self, data, num_iteration, batch_size=None):
+        codebook = self._weights.reshape(-1, self._weights.shape[2])
+        num_neurons = len(codebook)
+        for t in range(num_iteration):
+            if batch_size and batch_size < len(data):
+                batch = data[self._random_generator.randint(len(data), size=batch_size)]
+            else:
+                batch = data
+            bmus = bmu_indices(batch, codebook, index=build_bmu_index(codebook, self.bmu_index))
+            counts = np.bincount(bmus, minlength=num_neurons).astype(float)
+            sums = np.zeros_like(codebook)
+            np.add.at(sums, bmus, batch)
+
+            # Same asymptotic decay MiniSom applies to sigma.
+            h = self.neighborhood(self.sigma / (1 + t / (num_iteration / 2)))
+            numerator = h @ sums
+            denominator = h @ counts
+            updated = denominator > 1e-12
+            codebook[updated] = numerator[updated] / denominator[updated, None]
+        self._weights = codebook.reshape(self._weights.shape)
+
+    def get_weights(self):
+        return self._weights
+
+    def quantization(self, data):
+        codebook = self._weights.reshape(-1, self._weights.shape[2])
+        return codebook[bmu_indices(data, codebook, index=build_bmu_index(codebook, self.bmu_index))]
+
+    def distance_map(self):
+        return u_matrix(self._weights)
@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+BASELINE_FILE = 'benchmark_baseline.json'
+RESULTS_FILE = 'benchmark_results.json'
+DEFAULT_EVENTS = [10_000, 100_000, 1_000_000, 10_000_000]
+# generate_logs --count is in activity bursts; one burst averages about this many events.
+EVENTS_PER_BURST = 1.25
+DEFAULT_USERS = [200, 2000]
+DEFAULT_SEED = 1234
+
+
+def environment():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def prepare_workdir(workdir):
+    """Copies the pipeline scripts (not their data or outputs) into a scratch tree."""
+    (workdir / 'markov-model').mkdir(parents=True)
+    for path in ROOT.glob('*.py'):
+        shutil.copy2(path, workdir / path.name)
+    for path in (ROOT / 'markov-model').glob('*.py'):
+        shutil.copy2(path, workdir / 'markov-model' / path.name)
+
+
+def bursts_for(events):
+    """The generate_logs --count that yields roughly ``events`` events."""
+    return max(1, round(events / EVENTS_PER_BURST))
+
+
+def run_point(target_events, users, seed, order, som_epochs, workers, keep_workdir=False):
+    """
+    Runs every stage of the DAG pipeline on one freshly generated dataset of
+    about ``target_events`` events in its own scratch tree and returns the
+    per-stage measurements with the number of events actually generated, or
+    None if the pipeline did not complete.
+    """
+    bursts = bursts_for(target_events)
+    workdir = Path(tempfile.mkdtemp(prefix=f'ueba_bench_{bursts}_{users}_'))
+    try:
+        prepare_workdir(workdir)
+        command = [sys.executable, 'run_pipeline.py', '--count', str(bursts), '--users', str(users),
+                   '--seed', str(seed), '--order', str(order), '--som-epochs', str(som_epochs),
+                   '--workers', str(workers), '--report', 'run_report.json']
+        proc = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+        report_path = workdir / 'run_report.json'
+        if proc.returncode != 0 or not report_path.exists():
+            print(f"  Error: the pipeline exited with code {proc.returncode}.")
+            print('\n'.join('    ' + line for line in proc.stderr.strip().splitlines()[-10:]))
+            return None
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    finally:
+        if keep_workdir:
+            print(f"  Kept scratch tree '{workdir}'")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {
+        record['stage']: {key: record.get(key) for key in
+                          ('status', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'rows_per_sec')}
+        for record in report['stages']
+    }
+    failed = [name for name, stage in stages.items() if stage['status'] != 'ran']
+    if failed:
+        print(f"  Error: stage(s) {', '.join(failed)} did not run.")
+        return None
+    return {'target_events': target_events, 'bursts': bursts, 'events': stages['generate_logs']['rows_out'],
+            'users': users, 'seed': seed, 'total_wall_s': report['total_wall_s'], 'stages': stages}
+
+
+def point_key(point):
+    # Points from baselines swept by burst count have no target and match nothing.
+    return f"{point.get('target_events')}x{point['users']}"
+
+
+# --- Baseline Comparison ---
+
+def compare(results, baseline, max_slowdown, max_memory_growth, min_wall):
+    """
+    Regressions of ``results`` against ``baseline``: stages whose throughput
+    fell by more than ``max_slowdown`` or whose peak memory grew by more than
+    ``max_memory_growth`` (both fractions). Stages that took under
+    ``min_wall`` seconds in the baseline are too noisy for the throughput check.
+    """
+    baseline_points = {point_key(point): point for point in baseline['points']}
+    regressions = []
+    for point in results['points']:
+        base_point = baseline_points.get(point_key(point))
+        if base_point is None:
+            continue
+        for name, stage in point['stages'].items():
+            base = base_point['stages'].get(name)
+            if base is None:
+                continue
+            if base['wall_s'] >= min_wall and base['rows_per_sec'] and stage['rows_per_sec'] is not None:
+                change = stage['rows_per_sec'] / base['rows_per_sec'] - 1
+                if change < -max_slowdown:
+                    regressions.append(f"{point_key(point)} {name}: throughput {change:+.0%} "
+                                       f"({base['rows_per_sec']:,.0f} -> {stage['rows_per_sec']:,.0f} rows/s)")
+            if base['peak_rss_mb'] and stage['peak_rss_mb'] is not None:
+                change = stage['peak_rss_mb'] / base['peak_rss_mb'] - 1
+                if change > max_memory_growth:
+                    regressions.append(f"{point_key(point)} {name}: peak memory {change:+.0%} "
+                                       f"({base['peak_rss_mb']:.0f} -> {stage['peak_rss_mb']:.0f} MB)")
+    return regressions
+
+
+def print_point(point, base_point=None):
+    events = point['events']
+    size = f"{events:,} events, {events / point['total_wall_s']:,.0f}/s end to end" if events else "events not counted"
+    print(f"\n--- ~{point['target_events']:,} events ({point['bursts']:,} bursts), {point['users']:,} users ({point['total_wall_s']:.1f}s; {size}) ---")
+    print(f"{'stage':<22}{'wall s':>9}{'rows in':>12}{'rows/s':>12}{'vs base':>9}{'peak MB':>9}{'vs base':>9}")
+    for name, stage in point['stages'].items():
+        base = (base_point or {}).get('stages', {}).get(name)
+
+        def delta(key):
+            if not base or not base.get(key) or stage.get(key) is None:
+                return '-'
+            return f"{stage[key] / base[key] - 1:+.0%}"
+
+        rows_in = f"{stage['rows_in']:,}" if stage['rows_in'] is not None else '-'
+        rate = f"{stage['rows_per_sec']:,.0f}" if stage['rows_per_sec'] is not None else '-'
+        print(f"{name:<22}{stage['wall_s']:>9.2f}{rows_in:>12}{rate:>12}{delta('rows_per_sec'):>9}"
+              f"{stage['peak_rss_mb']:>9.0f}{delta('peak_rss_mb'):>9}")
+
+
+def main(events=DEFAULT_EVENTS, users=DEFAULT_USERS, seed=DEFAULT_SEED, order=2, som_epochs=10, workers=1,
+         baseline_path=BASELINE_FILE, results_path=RESULTS_FILE, save_baseline=False,
+         max_slowdown=0.25, max_memory_growth=0.25, min_wall=0.5, keep_workdirs=False):
+    """Runs the sweep and returns the process exit code: 1 on failed points or regressions."""
+    os.chdir(ROOT)
+    baseline = None
+    if not save_baseline and os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != environment():
+            print(f"Warning: '{baseline_path}' was recorded on a different environment; comparisons may not be meaningful.")
+    baseline_points = {point_key(point): point for point in (baseline or {}).get('points', [])}
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(),
+        'settings': {'seed': seed, 'order': order, 'som_epochs': som_epochs, 'workers': workers},
+        'points': [],
+    }
+    failed = []
+    for num_events in events:
+        for num_users in users:
+            print(f"Benchmarking ~{num_events:,} events ({bursts_for(num_events):,} bursts) for {num_users:,} users (seed {seed})...")
+            point = run_point(num_events, num_users, seed, order, som_epochs, workers, keep_workdirs)
+            if point is None:
+                failed.append(f"{num_events}x{num_users}")
+                continue
+            results['points'].append(point)
+            print_point(point, baseline_points.get(point_key(point)))
+
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to '{results_path}'")
+
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved as the new baseline in '{baseline_path}'")
+    elif baseline is None:
+        print(f"No baseline at '{baseline_path}'; run with --save-baseline to record one.")
+
+    regressions = compare(results, baseline, max_slowdown, max_memory_growth, min_wall) if baseline else []
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond the thresholds:")
+        for regression in regressions:
+            print(f"  - {regression}")
+    if failed:
+        print(f"\nFailed points: {', '.join(failed)}")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the pipeline over dataset sizes and compare against a stored baseline.")
+    parser.add_argument("--events", type=int, nargs='+', default=DEFAULT_EVENTS,
+                        help=f"Target event counts to sweep; each becomes generate_logs bursts at ~{EVENTS_PER_BURST} events per burst.")
+    parser.add_argument("--users", type=int, nargs='+', default=DEFAULT_USERS, help="User counts to sweep.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed for every generated dataset.")
+    parser.add_argument("--order", type=int, default=2, help="Markov model order.")
+    parser.add_argument("--som-epochs", type=int, default=10, help="SOM training epochs.")
+    parser.add_argument("--workers", type=int, default=1, help="Stages run concurrently; 1 keeps per-stage numbers undisturbed.")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline results to compare against.")
+    parser.add_argument("--results", default=RESULTS_FILE, help="Where to write this run's results.")
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the baseline instead of comparing.")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed drop in per-stage throughput (fraction).")
+    parser.add_argument("--max-memory-growth", type=float, default=0.25, help="Allowed growth in per-stage peak RSS (fraction).")
+    parser.add_argument("--min-wall", type=float, default=0.5, help="Skip the throughput check for stages faster than this in the baseline (seconds).")
+    parser.add_argument("--keep-workdirs", action="store_true", help="Keep each point's scratch tree for inspection.")
+    args = parser.parse_args()
+    sys.exit(main(args.events, args.users, args.seed, args.order, args.som_epochs, args.workers,
+                  args.baseline, args.results, args.save_baseline, args.max_slowdown,
+                  args.max_memory_growth, args.min_wall, args.keep_workdirs))
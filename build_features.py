@@ -2,25 +2,34 @@ import pandas as pd
 import json
 from pathlib import Path
 
-def generate_hackathon_features(sessionized_events_path='data/normalized/events_sessionized.jsonl', output_path='user_features.csv'):
+def generate_hackathon_features(sessionized_events_path='data/normalized/events_sessionized.jsonl', output_path='user_features.csv', events=None):
     """
     Reads enhanced sessionized data and applies a mix of high-impact and benign 
     anomaly detection rules to create a realistic feature matrix.
-    """
-    print(f"Starting HACKATHON feature generation from '{sessionized_events_path}'...")
-    
-    input_file = Path(sessionized_events_path)
-    if not input_file.exists():
-        print(f"Error: Input file not found at '{sessionized_events_path}'")
-        return
 
-    df = pd.read_json(input_file, lines=True, dtype=False)
+    ``events`` is an already loaded sessionized event table to use instead of
+    the file; it is not modified. With ``output_path=None`` nothing is
+    written. Returns the feature matrix.
+    """
+    if events is not None:
+        print("Starting HACKATHON feature generation from the in-memory event table...")
+        # Shallow copy: new columns and the fillna below never touch the caller's table.
+        df = events.copy(deep=False)
+    else:
+        print(f"Starting HACKATHON feature generation from '{sessionized_events_path}'...")
+
+        input_file = Path(sessionized_events_path)
+        if not input_file.exists():
+            print(f"Error: Input file not found at '{sessionized_events_path}'")
+            return
+
+        df = pd.read_json(input_file, lines=True, dtype=False)
     
     df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-    df.fillna({
+    df = df.fillna({
         'process': '', 'resource': '', 'status': '', 'host': '',
         'user_agent': '', 'dst_hostname': '', 'bytes_out': 0, 'src_ip': ''
-    }, inplace=True)
+    })
     
     print(f"Loaded {len(df)} sessionized events.")
 
@@ -97,14 +106,18 @@ def generate_hackathon_features(sessionized_events_path='data/normalized/events_
     # Sort by attack score first, then by benign score
     feature_matrix = feature_matrix.sort_values(by=['attack_score', 'benign_score'], ascending=False)
     
-    feature_matrix.to_csv(output_path, index_label='user_id')
+    feature_matrix.index.name = 'user_id'
+    if output_path is not None:
+        feature_matrix.to_csv(output_path, index_label='user_id')
 
     print("-" * 50)
-    print(f"✅ HACKATHON feature matrix saved to '{output_path}'")
+    if output_path is not None:
+        print(f"✅ HACKATHON feature matrix saved to '{output_path}'")
     print(f"Matrix dimensions: {feature_matrix.shape[0]} users, {feature_matrix.shape[1]} features.")
     print("\nSample of the final, realistic data (top users by score):")
     print(feature_matrix.head(15))
     print("-" * 50)
+    return feature_matrix
 
 if __name__ == "__main__":
     generate_hackathon_features()
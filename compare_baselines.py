@@ -0,0 +1,102 @@
+import argparse
+import json
+import sys
+from collections import Counter
+
+import pandas as pd
+
+from analysis_pipeline import DEFAULT_SKETCH, evaluate_rules
+
+
+def baseline_bytes(profiles, keys):
+    """Rough in-memory size of the per-user baselines stored under ``keys``."""
+    total = 0
+    for profile in profiles.values():
+        for key in keys:
+            value = profile.get(key)
+            if isinstance(value, list):
+                total += sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+            elif isinstance(value, dict):
+                # Bloom filter bits are base64 in the profile; count the raw bytes.
+                total += sum(len(layer['bits']) * 3 // 4 for layer in value['layers'])
+    return total
+
+
+def group_sketch_bytes(group_sketches):
+    """Raw size of the peer-group count-min sketches (base64 in storage)."""
+    return sum(len(group['cms']['table']) * 3 // 4 for group in group_sketches.values())
+
+
+def run_mode(history, current, user_to_group, sketch):
+    """
+    Builds baselines from ``history`` and returns the alerts raised on
+    ``current``, the profiles and the peer-group sketches. The exact
+    peer-group host sets only cover one call, so the group sketches also
+    start empty for ``current`` to compare the two on the same events.
+    """
+    profiles, group_sketches = {}, {}
+    if len(history):
+        evaluate_rules(history, profiles, user_to_group, sketch=sketch, group_sketches={})
+    alerts = evaluate_rules(current, profiles, user_to_group, sketch=sketch, group_sketches=group_sketches)
+    return alerts, profiles, group_sketches
+
+
+def main(fp_rates=(0.01, 0.001), capacity=DEFAULT_SKETCH['capacity'], max_capacity=DEFAULT_SKETCH['max_capacity'],
+         group_capacity=DEFAULT_SKETCH['group_capacity'], group_rare_count=DEFAULT_SKETCH['group_rare_count'],
+         history_fraction=0.5):
+    print("Loading sessionized events...")
+    try:
+        df = pd.read_json('data/normalized/events_sessionized.jsonl', lines=True)
+    except FileNotFoundError:
+        print("Error: 'data/normalized/events_sessionized.jsonl' not found. Please run sessionize_events.py first.")
+        return
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    df = df.dropna(subset=['timestamp']).sort_values(by='timestamp')
+    try:
+        with open('user_to_peer_group.json', 'r') as f:
+            user_to_group = json.load(f)
+    except FileNotFoundError:
+        user_to_group = {}
+
+    # Earlier events build the baselines; the rules are compared on the rest.
+    split = int(len(df) * history_fraction)
+    history, current = df.iloc[:split], df.iloc[split:]
+    print(f"Baselines from {len(history)} events, comparing rule outcomes on {len(current)} events.")
+
+    exact_alerts, exact_profiles, _ = run_mode(history, current, user_to_group, None)
+    exact = Counter((a['alert_type'], a['user_id'], a['details']) for a in exact_alerts)
+    exact_size = baseline_bytes(exact_profiles, ['known_ips', 'known_hosts'])
+
+    print(f"\n{'mode':<14}{'alert type':<24}{'alerts':>8}{'missed':>8}{'extra':>8}{'baseline KB':>13}{'group KB':>10}")
+    for alert_type, count in sorted(Counter(k[0] for k in exact.elements()).items()):
+        print(f"{'exact':<14}{alert_type:<24}{count:>8}{0:>8}{0:>8}{exact_size / 1024:>13.1f}{'-':>10}")
+
+    for fp_rate in fp_rates:
+        sketch = {'capacity': capacity, 'max_capacity': max_capacity, 'group_capacity': group_capacity,
+                  'group_rare_count': group_rare_count, 'fp_rate': fp_rate}
+        sketch_alerts, sketch_profiles, group_sketches = run_mode(history, current, user_to_group, sketch)
+        approx = Counter((a['alert_type'], a['user_id'], a['details']) for a in sketch_alerts)
+        size = baseline_bytes(sketch_profiles, ['known_ips_bloom', 'known_hosts_bloom'])
+        group_size = group_sketch_bytes(group_sketches)
+        # Sketches only err towards "seen before", so misses are the cost of the FP rate.
+        missed, extra = exact - approx, approx - exact
+        for alert_type in sorted({k[0] for k in exact} | {k[0] for k in approx}):
+            print(f"{f'sketch {fp_rate:g}':<14}{alert_type:<24}"
+                  f"{sum(n for k, n in approx.items() if k[0] == alert_type):>8}"
+                  f"{sum(n for k, n in missed.items() if k[0] == alert_type):>8}"
+                  f"{sum(n for k, n in extra.items() if k[0] == alert_type):>8}"
+                  f"{size / 1024:>13.1f}{group_size / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare rule outcomes with exact and sketch-backed baselines.")
+    parser.add_argument("--fp-rates", type=float, nargs='+', default=[0.01, 0.001], help="False-positive rates to try.")
+    parser.add_argument("--sketch-capacity", type=int, default=DEFAULT_SKETCH['capacity'], help="Distinct IPs/hosts per user the first Bloom filter layer holds.")
+    parser.add_argument("--sketch-max-capacity", type=int, default=DEFAULT_SKETCH['max_capacity'], help="Distinct IPs/hosts per user past which a Bloom filter stops growing.")
+    parser.add_argument("--group-sketch-capacity", type=int, default=DEFAULT_SKETCH['group_capacity'], help="Expected distinct hosts per peer group.")
+    parser.add_argument("--group-rare-count", type=int, default=DEFAULT_SKETCH['group_rare_count'], help="Visits below which a host is unusual for a peer group.")
+    parser.add_argument("--history-fraction", type=float, default=0.5, help="Share of events used to build baselines before comparing.")
+    args = parser.parse_args()
+    main(fp_rates=args.fp_rates, capacity=args.sketch_capacity, max_capacity=args.sketch_max_capacity,
+         group_capacity=args.group_sketch_capacity, group_rare_count=args.group_rare_count,
+         history_fraction=args.history_fraction)
@@ -3,8 +3,14 @@ import random
 import os
 import json
 import csv
+import heapq
+import itertools
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from faker import Faker
+from faker.exceptions import UniquenessException
 from datetime import datetime, timedelta
+from normalize import SOURCE_PARSERS, parse_auth_line
 
 # --- Configuration: Scaled for Hackathon ---
 NUM_DEVELOPERS = 80
@@ -31,12 +37,42 @@ RARE_C2_DOMAIN = "upd.security-analytics.net" # Attacker Command & Control
 
 fake = Faker()
 
+# Seeded runs cover a fixed 30-day window so a seed gives the same logs on any day.
+SEEDED_START = datetime(2024, 1, 1)
+
+def window_start(seed=None, start=None):
+    """Start of the 30-day window: ``start`` if given, SEEDED_START for seeded runs, otherwise 30 days ago."""
+    if start is not None:
+        return datetime.fromisoformat(start) if isinstance(start, str) else start
+    if seed is not None:
+        return SEEDED_START
+    return datetime.utcnow() - timedelta(days=30)
+
+# --- Precomputed Pools ---
+# Faker calls dominate generation time, so the sharded generator draws
+# resolved IPs and user agents from fixed pools instead of per event.
+
+IPS_PER_DOMAIN = 8
+USER_AGENT_POOL_SIZE = 256
+
+def build_pools():
+    domains = [d for ds in COMMON_DOMAINS.values() for d in ds] + [RARE_C2_DOMAIN]
+    return {
+        'domain_ips': {domain: [fake.ipv4_public() for _ in range(IPS_PER_DOMAIN)] for domain in domains},
+        'user_agents': [fake.chrome() for _ in range(USER_AGENT_POOL_SIZE)],
+    }
+
+def resolve_ip(domain, rng=random, pools=None):
+    if pools is None:
+        return fake.ipv4_public()
+    return rng.choice(pools['domain_ips'][domain])
+
 # --- Log Formatting Functions (Includes NEW web_proxy_log) ---
 
-def make_auth_line(ts, host, user, src_ip, success=True):
-    pid = random.randint(1000, 99999)
+def make_auth_line(ts, host, user, src_ip, success=True, rng=random):
+    pid = rng.randint(1000, 99999)
     res = "Accepted" if success else "Failed"
-    port = random.randint(1024, 65000)
+    port = rng.randint(1024, 65000)
     return f"{ts.strftime('%b %d %H:%M:%S')} {host} sshd[{pid}]: {res} password for {user} from {src_ip} port {port} ssh2\n"
 
 def make_file_audit_row(ts, user, path, action, bytes_):
@@ -48,9 +84,10 @@ def make_endpoint_proc(ts, user, host, process, cmdline):
         "process": process, "cmdline": cmdline, "event_type": "process_start"
     }) + "\n"
 
-def make_web_proxy_log(ts, user, host, src_ip, dst_hostname, http_method, bytes_out, user_agent, url_category, status_code=200):
+def make_web_proxy_log(ts, user, host, src_ip, dst_hostname, http_method, bytes_out, user_agent, url_category, status_code=200,
+                       rng=random, pools=None):
     # This is the NEW function to generate web traffic logs
-    dst_ip = fake.ipv4_public() # Simulate resolving the hostname
+    dst_ip = resolve_ip(dst_hostname, rng, pools) # Simulate resolving the hostname
     return json.dumps({
         "timestamp": ts.isoformat() + "Z",
         "event_type": "web",
@@ -61,7 +98,7 @@ def make_web_proxy_log(ts, user, host, src_ip, dst_hostname, http_method, bytes_
         "dst_hostname": dst_hostname,
         "http_method": http_method,
         "bytes_out": bytes_out,
-        "bytes_in": random.randint(100, 5000),
+        "bytes_in": rng.randint(100, 5000),
         "user_agent": user_agent,
         "url_category": url_category,
         "status_code": status_code
@@ -69,19 +106,45 @@ def make_web_proxy_log(ts, user, host, src_ip, dst_hostname, http_method, bytes_
 
 # --- Persona and Behavior Generation ---
 
-def generate_personas():
+def generate_personas(total_users=TOTAL_USERS):
+    """Personas in the default role mix, scaled to ``total_users`` (including the attacker)."""
+    scale = (total_users - 1) / (TOTAL_USERS - 1)
+    num_developers, num_sales = round(NUM_DEVELOPERS * scale), round(NUM_SALES * scale)
+    num_admins = max(total_users - 1 - num_developers - num_sales, 0)
+    fake.unique.clear()
     personas = []
+    taken = {'test_attacker'}
+    exhausted = False
+
+    def unique_user_name():
+        # Faker runs out of unique user names in the tens of thousands; after that,
+        # suffix a (seeded) name with the persona's index so runs stay reproducible.
+        nonlocal exhausted
+        if not exhausted:
+            try:
+                user = fake.unique.user_name()
+                if user not in taken:
+                    taken.add(user)
+                    return user
+            except UniquenessException:
+                exhausted = True
+        name, suffix = fake.user_name(), len(personas)
+        while f"{name}{suffix}" in taken:
+            suffix += total_users
+        taken.add(f"{name}{suffix}")
+        return f"{name}{suffix}"
+
     # Developers
-    for i in range(NUM_DEVELOPERS):
-        user = fake.user_name()
+    for i in range(num_developers):
+        user = unique_user_name()
         personas.append({'user_id': user, 'role': 'developer', 'home_ip': fake.ipv4_public(), 'home_host': random.choice(DEVELOPER_HOSTS)})
     # Sales
-    for i in range(NUM_SALES):
-        user = fake.user_name()
+    for i in range(num_sales):
+        user = unique_user_name()
         personas.append({'user_id': user, 'role': 'sales', 'home_ip': fake.ipv4_public(), 'home_host': random.choice(SALES_HOSTS)})
     # Admins
-    for i in range(NUM_ADMINS):
-        user = fake.user_name()
+    for i in range(num_admins):
+        user = unique_user_name()
         personas.append({'user_id': user, 'role': 'admin', 'home_ip': fake.ipv4_public(), 'home_host': 'host-1'})
     
     # Add our specific attacker
@@ -89,62 +152,278 @@ def generate_personas():
     
     return personas
 
-def generate_normal_activity(writers, persona, base_time):
+def generate_normal_activity(writers, persona, base_time, rng=random, pools=None):
     user = persona['user_id']
     role = persona['role']
     home_host = persona['home_host']
     home_ip = persona['home_ip']
-    user_agent = fake.chrome()
+    user_agent = rng.choice(pools['user_agents']) if pools else fake.chrome()
 
     # Generic activity for all roles
-    if random.random() < 0.5:
-        writers['auth'].write(make_auth_line(base_time, home_host, user, home_ip, success=random.random() > 0.1))
-    if random.random() < 0.8:
-        category, domains = random.choice(list(COMMON_DOMAINS.items()))
+    if rng.random() < 0.5:
+        writers['auth'].write(make_auth_line(base_time, home_host, user, home_ip, success=rng.random() > 0.1, rng=rng))
+    if rng.random() < 0.8:
+        category, domains = rng.choice(list(COMMON_DOMAINS.items()))
         if role == 'developer' and category not in ["Developer Tools", "Search", "Cloud Services"]: return # Developers stick to their tools
-        writers['web'].write(make_web_proxy_log(base_time, user, home_host, home_ip, random.choice(domains), 'GET', random.randint(100, 1000), user_agent, category))
+        writers['web'].write(make_web_proxy_log(base_time, user, home_host, home_ip, rng.choice(domains), 'GET', rng.randint(100, 1000), user_agent, category, rng=rng, pools=pools))
 
     # Role-specific activity
     if role == 'developer':
-        if random.random() < 0.3:
+        if rng.random() < 0.3:
             writers['proc'].write(make_endpoint_proc(base_time, user, home_host, 'git', 'git pull origin main'))
-        if random.random() < 0.1: # Pushing code
-             writers['web'].write(make_web_proxy_log(base_time, user, home_host, home_ip, 'github.com', 'POST', random.randint(50000, 200000), user_agent, "Developer Tools"))
+        if rng.random() < 0.1: # Pushing code
+             writers['web'].write(make_web_proxy_log(base_time, user, home_host, home_ip, 'github.com', 'POST', rng.randint(50000, 200000), user_agent, "Developer Tools", rng=rng, pools=pools))
 
     elif role == 'admin':
-         if random.random() < 0.4: # Admins log into many different servers
-             target_host = random.choice(ADMIN_HOSTS)
-             writers['auth'].write(make_auth_line(base_time, target_host, user, home_ip, success=True))
+         if rng.random() < 0.4: # Admins log into many different servers
+             target_host = rng.choice(ADMIN_HOSTS)
+             writers['auth'].write(make_auth_line(base_time, target_host, user, home_ip, success=True, rng=rng))
 
-def generate_scripted_attack_chain(writers, persona, base_time):
-    """Simulates a specific, multi-stage attack for the 'test_attacker' persona."""
-    user = persona['user_id']
-    host = persona['home_host']
-    attacker_ip_impossible_travel = '5.188.10.225' # A known suspicious IP from another country
+# --- Scripted Attack Chain ---
+# One function per stage so callers can inject the stages at different times.
 
-    print(f"Injecting ATTACK CHAIN for user '{user}' at {base_time}")
+ATTACKER_IP = '5.188.10.225' # A known suspicious IP from another country
+ATTACK_STAGE_GAP = timedelta(minutes=5)
 
-    # STAGE 1: Impossible Travel Login (Compromised Credential)
-    ts_stage1 = base_time
-    writers['auth'].write(make_auth_line(ts_stage1, host, user, attacker_ip_impossible_travel, success=True))
+def attack_login(writers, persona, ts, rng=random, pools=None):
+    """STAGE 1: Impossible Travel Login (Compromised Credential)"""
+    writers['auth'].write(make_auth_line(ts, persona['home_host'], persona['user_id'], ATTACKER_IP, success=True, rng=rng))
 
-    # STAGE 2: Internal Discovery & Sensitive File Access
-    ts_stage2 = base_time + timedelta(minutes=5)
-    writers['proc'].write(make_endpoint_proc(ts_stage2, user, host, 'net.exe', 'net group "Domain Admins" /domain'))
-    writers['file'].writerow(make_file_audit_row(ts_stage2, user, '/shared/research/project_x_blueprints.pdf', 'READ', 2048576))
-    
-    # STAGE 3: Command & Control (C2) Beaconing using PowerShell User-Agent
-    ts_stage3 = base_time + timedelta(minutes=10)
-    powershell_ua = "PowerShell/7.2"
-    writers['web'].write(make_web_proxy_log(ts_stage3, user, host, "192.168.1.101", RARE_C2_DOMAIN, 'GET', 256, powershell_ua, "C2 Beacon"))
-    
-    # STAGE 4: Data Exfiltration via POST to Pastebin
-    ts_stage4 = base_time + timedelta(minutes=15)
-    writers['web'].write(make_web_proxy_log(ts_stage4, user, host, "192.168.1.101", 'pastebin.com', 'POST', 2048576, powershell_ua, "Text & Media Sharing"))
+def attack_discovery(writers, persona, ts, rng=random, pools=None):
+    """STAGE 2: Internal Discovery & Sensitive File Access"""
+    user, host = persona['user_id'], persona['home_host']
+    writers['proc'].write(make_endpoint_proc(ts, user, host, 'net.exe', 'net group "Domain Admins" /domain'))
+    writers['file'].writerow(make_file_audit_row(ts, user, '/shared/research/project_x_blueprints.pdf', 'READ', 2048576))
+
+def attack_c2_beacon(writers, persona, ts, rng=random, pools=None):
+    """STAGE 3: Command & Control (C2) Beaconing using PowerShell User-Agent"""
+    writers['web'].write(make_web_proxy_log(ts, persona['user_id'], persona['home_host'], "192.168.1.101", RARE_C2_DOMAIN,
+                                            'GET', 256, "PowerShell/7.2", "C2 Beacon", rng=rng, pools=pools))
+
+def attack_exfiltration(writers, persona, ts, rng=random, pools=None):
+    """STAGE 4: Data Exfiltration via POST to Pastebin"""
+    writers['web'].write(make_web_proxy_log(ts, persona['user_id'], persona['home_host'], "192.168.1.101", 'pastebin.com',
+                                            'POST', 2048576, "PowerShell/7.2", "Text & Media Sharing", rng=rng, pools=pools))
+
+ATTACK_STAGES = {
+    'login': attack_login,
+    'discovery': attack_discovery,
+    'c2_beacon': attack_c2_beacon,
+    'exfiltration': attack_exfiltration,
+}
+
+def generate_scripted_attack_chain(writers, persona, base_time, rng=random, pools=None):
+    """Simulates a specific, multi-stage attack for the 'test_attacker' persona, one stage every ATTACK_STAGE_GAP."""
+    print(f"Injecting ATTACK CHAIN for user '{persona['user_id']}' at {base_time}")
+    for i, stage in enumerate(ATTACK_STAGES.values()):
+        stage(writers, persona, base_time + i * ATTACK_STAGE_GAP, rng, pools)
+
+
+# --- Sharded Generation ---
+
+RAW_FILES = {'auth': 'auth.log', 'web': 'web_proxy.jsonl', 'proc': 'endpoint_proc.jsonl', 'file': 'file_audit.csv'}
+FILE_AUDIT_HEADER = ["timestamp", "user", "path", "action", "bytes"]
+WINDOW_SECONDS = 30 * 24 * 3600
+BLOCK_LINES = 65536
+
+class BlockWriter:
+    """Collects lines and writes them to ``f`` in blocks of ``block_lines``."""
+
+    def __init__(self, f, block_lines=BLOCK_LINES):
+        self.f = f
+        self.block_lines = block_lines
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.block_lines:
+            self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self.lines))
+        self.lines.clear()
+
+def shard_dir(outdir, shard):
+    return os.path.join(outdir, f"shard-{shard:03d}")
+
+def generate_shard(shard, personas, iterations, start_time, seed, pools, outdir, attack_persona=None, attack_time=None):
+    """
+    Writes one shard's raw logs to its own directory: ``iterations`` bursts
+    of normal activity from ``personas``, plus the attack chain if given. The
+    shard's RNG depends only on the seed and the shard number, so a shard's
+    files are the same whichever process writes them.
+    """
+    rng = random.Random(f"{seed}:{shard}")
+    path = shard_dir(outdir, shard)
+    os.makedirs(path, exist_ok=True)
+    files = {kind: open(os.path.join(path, name), "w", newline='' if kind == 'file' else None, buffering=1 << 20)
+             for kind, name in RAW_FILES.items()}
+    blocks = {kind: BlockWriter(f) for kind, f in files.items()}
+    writers = {'file': csv.writer(blocks['file']), **{k: v for k, v in blocks.items() if k != 'file'}}
+    writers['file'].writerow(FILE_AUDIT_HEADER)
+
+    if attack_persona is not None:
+        generate_scripted_attack_chain(writers, attack_persona, attack_time, rng, pools)
+    for _ in range(iterations):
+        persona = rng.choice(personas)
+        generate_normal_activity(writers, persona, start_time + timedelta(seconds=rng.randint(0, WINDOW_SECONDS)), rng, pools)
+
+    for kind, f in files.items():
+        blocks[kind].flush()
+        f.close()
+    return path
+
+def merge_shards(outdir, shard_paths):
+    """Concatenates the shard files, in shard order, into the standard raw log files and removes the shards."""
+    for kind, name in RAW_FILES.items():
+        with open(os.path.join(outdir, name), "wb") as out:
+            for i, path in enumerate(shard_paths):
+                with open(os.path.join(path, name), "rb") as f:
+                    if kind == 'file' and i > 0:
+                        f.readline() # Only the first shard keeps the CSV header
+                    shutil.copyfileobj(f, out, 1 << 20)
+    for path in shard_paths:
+        shutil.rmtree(path)
+
+def generate_sharded(count=10000, outdir="data/raw", seed=None, users=TOTAL_USERS, shards=8, workers=None, merge=True,
+                     start=None):
+    """
+    Generates ~``count`` bursts of activity with personas split across
+    ``shards`` shards written by a process pool. For a given seed, user count
+    and shard count the output is identical regardless of ``workers``. With
+    ``merge`` the shards are concatenated into the usual four files; otherwise
+    they stay in ``outdir/shard-NNN/`` for per-shard normalization.
+    """
+    # Taken before a seed is drawn, so unseeded runs still end on the current date.
+    start_time = window_start(seed, start)
+    if seed is None:
+        seed = random.randrange(2**32)
+    random.seed(seed)
+    Faker.seed(seed)
+    os.makedirs(outdir, exist_ok=True)
+
+    personas = generate_personas(users)
+    pools = build_pools()
+    attack_time = start_time + timedelta(seconds=random.randint(0, WINDOW_SECONDS))
+    attacker = next(p for p in personas if p['user_id'] == 'test_attacker')
+    normal = [p for p in personas if p['user_id'] != 'test_attacker']
+    shard_personas = [normal[i::shards] for i in range(shards)]
+
+    print(f"Generating ~{count} events for {len(personas)} users in {shards} shards (seed {seed})...")
+    jobs = []
+    for shard, members in enumerate(shard_personas):
+        # The attacker gets no normal traffic, as in the single-process generator.
+        iterations = round(count * len(members) / len(personas)) if members else 0
+        jobs.append((shard, members, iterations, start_time, seed, pools, outdir,
+                     attacker if shard == 0 else None, attack_time if shard == 0 else None))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        shard_paths = list(pool.map(generate_shard, *zip(*jobs)))
+
+    if merge:
+        merge_shards(outdir, shard_paths)
+        print(f"\n✅ Wrote enhanced synthetic logs to '{outdir}'")
+    else:
+        print(f"\n✅ Wrote {shards} log shards to '{outdir}/shard-*'")
+    return seed
+
+# --- Time-Ordered Streaming ---
+
+class RecordSink:
+    """Stands in for a file writer and keeps (kind, record) pairs in write order."""
+
+    def __init__(self, kind, records):
+        self.kind = kind
+        self.records = records
+
+    def write(self, record):
+        if self.kind == 'file':
+            record = dict(zip(FILE_AUDIT_HEADER, record))
+        self.records.append((self.kind, record))
+
+    writerow = write
+
+def stream_raw_events(count=10000, seed=None, users=TOTAL_USERS, start=None):
+    """
+    Yields (timestamp, kind, record) in timestamp order without touching
+    disk. Kinds are the keys of RAW_FILES; records are raw log lines, or dict
+    rows for the file audit CSV. Each normal persona is a Poisson process
+    whose rate gives ~``count`` bursts over the 30-day window, as ``main``
+    does; the streams are merged with a heap, so memory grows with the number
+    of personas rather than events. Timestamps are whole seconds, since the
+    syslog format has no finer resolution.
+    """
+    start_time = window_start(seed, start).replace(microsecond=0)
+    rng = random.Random(seed)
+    if seed is not None:
+        random.seed(seed)
+        Faker.seed(seed)
+    personas = generate_personas(users)
+    pools = build_pools()
+    attack_time = start_time + timedelta(seconds=rng.randint(0, WINDOW_SECONDS))
+    attacker = next(p for p in personas if p['user_id'] == 'test_attacker')
+    normal = [p for p in personas if p['user_id'] != 'test_attacker']
+    rate = count / len(personas) / WINDOW_SECONDS
+
+    records = []
+    writers = {kind: RecordSink(kind, records) for kind in RAW_FILES}
+    generate_scripted_attack_chain(writers, attacker, attack_time, rng, pools)
+    order = itertools.count()
+    # Heap entries: (seconds into the window, tie-breaker, persona or None, raw record or None).
+    heap = [(rng.expovariate(rate), next(order), persona, None) for persona in normal] if rate > 0 else []
+    for kind, record in records:
+        if kind == 'auth':
+            ts = datetime.strptime(record[:15], '%b %d %H:%M:%S').replace(year=attack_time.year)
+        else:
+            ts = datetime.fromisoformat(record['timestamp'] if kind == 'file' else json.loads(record)['timestamp']).replace(tzinfo=None)
+        heap.append(((ts - start_time).total_seconds(), next(order), None, (kind, record)))
+    heapq.heapify(heap)
+    records.clear()
+
+    while heap:
+        offset, _, persona, raw = heapq.heappop(heap)
+        ts = start_time + timedelta(seconds=int(offset))
+        if persona is None:
+            yield (ts, *raw)
+            continue
+        generate_normal_activity(writers, persona, ts, rng, pools)
+        for kind, record in records:
+            yield ts, kind, record
+        records.clear()
+        offset += rng.expovariate(rate)
+        if offset < WINDOW_SECONDS:
+            heapq.heappush(heap, (offset, next(order), persona, None))
+
+def stream_events(count=10000, seed=None, users=TOTAL_USERS, start=None):
+    """Normalized events in timestamp order, straight from the generator through the normalizer's parsers."""
+    for ts, kind, record in stream_raw_events(count, seed, users, start):
+        # Syslog lines carry no year, so auth records take it from the generator's timestamp.
+        if event := parse_auth_line(record, ts.year) if kind == 'auth' else SOURCE_PARSERS[kind](record):
+            yield event
 
+def write_event_stream(path, count=10000, seed=None, users=TOTAL_USERS, start=None):
+    """Writes ``stream_events`` as normalized JSONL, already in the order normalize_all_logs would sort it into."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    written = 0
+    with open(path, "w", buffering=1 << 20) as f:
+        block = []
+        for event in stream_events(count, seed, users, start):
+            block.append(json.dumps(event) + '\n')
+            if len(block) >= BLOCK_LINES:
+                f.write(''.join(block))
+                written += len(block)
+                block.clear()
+        f.write(''.join(block))
+        written += len(block)
+    print(f"\n✅ Streamed {written} normalized events to '{path}'")
+    return written
 
-def main(count=10000, outdir="data/raw"):
+def main(count=10000, outdir="data/raw", seed=None, users=TOTAL_USERS, shards=0, workers=None, start=None):
+    if shards:
+        return generate_sharded(count, outdir, seed, users, shards, workers, start=start)
     os.makedirs(outdir, exist_ok=True)
+    if seed is not None:
+        random.seed(seed)
+        Faker.seed(seed)
     
     files = {
         "auth": open(os.path.join(outdir, "auth.log"), "w"),
@@ -155,8 +434,8 @@ def main(count=10000, outdir="data/raw"):
     writers = {'file': csv.writer(files['file_csv']), **{k: v for k, v in files.items() if k != 'file_csv'}}
     writers['file'].writerow(["timestamp", "user", "path", "action", "bytes"])
     
-    personas = generate_personas()
-    start_time = datetime.utcnow() - timedelta(days=30)
+    personas = generate_personas(users)
+    start_time = window_start(seed, start)
     
     print(f"Generating ~{count} events for {len(personas)} users over a 30-day period...")
 
@@ -182,7 +461,20 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate realistic, scenario-based log data for UEBA.")
     parser.add_argument("--count", type=int, default=20000, help="Approximate number of normal events to generate.")
     parser.add_argument("--outdir", default="data/raw", help="Directory to save the raw log files.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible logs (the 30-day window starts at SEEDED_START unless --start is given).")
+    parser.add_argument("--start", default=None, help="Start date of the 30-day window, YYYY-MM-DD (default: 30 days ago, or SEEDED_START with --seed).")
+    parser.add_argument("--users", type=int, default=TOTAL_USERS, help="Number of users, including the attacker.")
+    parser.add_argument("--shards", type=int, default=0, help="Split personas into this many shards written by a process pool (0: single process).")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for --shards (default: all cores).")
+    parser.add_argument("--no-merge", action="store_true", help="With --shards, keep the per-shard files instead of merging them.")
+    parser.add_argument("--stream", metavar="PATH", default=None, help="Write time-ordered normalized events to PATH instead of raw logs.")
     args = parser.parse_args()
-    main(args.count, args.outdir)
+    if args.stream:
+        write_event_stream(args.stream, args.count, args.seed, args.users, args.start)
+    elif args.shards:
+        generate_sharded(args.count, args.outdir, args.seed, args.users, args.shards, args.workers,
+                         merge=not args.no_merge, start=args.start)
+    else:
+        main(args.count, args.outdir, args.seed, args.users, start=args.start)
 
     
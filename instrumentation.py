@@ -0,0 +1,156 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+RUN_REPORT = 'run_report.json'
+PROFILE_DIR = 'profiles'
+ROW_FILE_SUFFIXES = ('.jsonl', '.log', '.csv')
+
+
+# --- Memory ---
+# On Linux the peak (VmHWM) can be reset between stages that share a process;
+# elsewhere ru_maxrss is the peak over the whole process lifetime.
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# --- Row Counts ---
+
+def count_file_rows(path):
+    """Records in a line-oriented file (JSONL, syslog, CSV without its header), or None for other files."""
+    if not str(path).endswith(ROW_FILE_SUFFIXES) or not os.path.exists(path):
+        return None
+    lines = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b'\n')
+    return max(lines - 1, 0) if str(path).endswith('.csv') else lines
+
+
+def count_rows(value):
+    """
+    Rows in a stage result: the length of a table, dict or list, or of the
+    first element of a tuple result. None when there is nothing countable.
+    """
+    if isinstance(value, tuple):
+        return count_rows(value[0]) if value else None
+    if value is None or isinstance(value, (str, bytes)) or not hasattr(value, '__len__'):
+        return None
+    return len(value)
+
+
+def count_paths_rows(paths):
+    """Total records across the line-oriented files among ``paths``, or None if there are none."""
+    counts = [count_file_rows(path) for path in paths]
+    counts = [c for c in counts if c is not None]
+    return sum(counts) if counts else None
+
+
+# --- Measurement ---
+
+@contextmanager
+def measure(stage, rows_in=None, profile=False, trace_memory=False, profile_dir=PROFILE_DIR):
+    """
+    Measures the enclosed block as one stage and yields its report record.
+    The caller sets ``record['rows_out']`` before leaving the block. With
+    ``profile`` a cProfile dump is written to ``profile_dir`` and the top
+    functions are kept in the record; ``trace_memory`` adds the tracemalloc
+    peak and largest allocation sites (both slow the stage down).
+    """
+    record = {'stage': stage, 'rows_in': rows_in, 'rows_out': None}
+    peak_is_stage = reset_peak_rss()
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start()
+    started_wall, started_cpu = time.perf_counter(), time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+        record['wall_s'] = time.perf_counter() - started_wall
+        record['cpu_s'] = time.process_time() - started_cpu
+        record['peak_rss_mb'] = peak_rss_mb()
+        # Without a reset the peak may belong to an earlier stage in the same process.
+        record['peak_rss_scope'] = 'stage' if peak_is_stage else 'process'
+        rows = record['rows_in'] if record['rows_in'] is not None else record['rows_out']
+        record['rows_per_sec'] = rows / record['wall_s'] if rows is not None and record['wall_s'] > 0 else None
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record['tracemalloc'] = {
+                'peak_mb': traced_peak / (1024 * 1024),
+                'top': [str(stat) for stat in snapshot.statistics('lineno')[:10]],
+            }
+        if profiler:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f'{stage}.prof')
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+            record['profile'] = {'path': path, 'top': out.getvalue().strip().splitlines()}
+
+
+def measured_call(stage, func, *args, rows_in=None, profile=False, trace_memory=False, **kwargs):
+    """Calls ``func`` under ``measure`` and returns (result, record), counting the result as rows out."""
+    with measure(stage, rows_in, profile, trace_memory) as record:
+        result = func(*args, **kwargs)
+        record['rows_out'] = count_rows(result)
+    return result, record
+
+
+# --- Run Report ---
+
+def write_run_report(mode, records, total_wall, path=RUN_REPORT, **details):
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'mode': mode,
+        **details,
+        'total_wall_s': total_wall,
+        'stages': records,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_stage_table(records, status=None):
+    print(f"{'stage':<22}{'status':<10}{'wall s':>9}{'cpu s':>9}{'peak MB':>10}{'rows in':>11}{'rows out':>11}{'rows/s':>11}")
+    for record in records:
+        def cell(key, fmt):
+            value = record.get(key)
+            return format(value, fmt) if value is not None else '-'
+        stage_status = (status or {}).get(record['stage'], 'ran')
+        print(f"{record['stage']:<22}{stage_status:<10}{cell('wall_s', '.2f'):>9}{cell('cpu_s', '.2f'):>9}"
+              f"{cell('peak_rss_mb', '.0f'):>10}{cell('rows_in', 'd'):>11}{cell('rows_out', 'd'):>11}"
+              f"{cell('rows_per_sec', ',.0f'):>11}")
@@ -0,0 +1,95 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+VOCAB_FILE = Path(__file__).resolve().parent / "action_vocab.json"
+
+
+def _as_text(df, column):
+    # Missing values render as 'nan', the same as the old f-string formatting.
+    if column not in df:
+        return pd.Series('nan', index=df.index, dtype=object)
+    values = df[column].astype(object)
+    return values.where(values.notna(), 'nan').astype(str)
+
+
+def derive_actions(df):
+    """
+    Vectorized simple_action derivation: 'process_execute_<process>' for
+    process events that name a process, '<event_type>_<action>' otherwise.
+
+    Returns (codes, labels) where ``labels`` are the distinct action strings
+    and ``codes`` indexes into them per row. Strings are only formatted once
+    per distinct (prefix, suffix) pair rather than once per event.
+    """
+    event_type = _as_text(df, 'event_type')
+    is_process = (event_type == 'process')
+    if 'process' in df:
+        is_process &= df['process'].notna()
+    prefix = event_type.where(~is_process, 'process_execute')
+    suffix = _as_text(df, 'action').where(~is_process, _as_text(df, 'process'))
+
+    codes, pairs = pd.MultiIndex.from_arrays([prefix, suffix]).factorize()
+    labels = [f"{p}_{s}" for p, s in pairs]
+    return codes, labels
+
+
+def simple_actions(df):
+    codes, labels = derive_actions(df)
+    return pd.Series(np.asarray(labels, dtype=object)[codes], index=df.index)
+
+
+def event_action(event):
+    """derive_actions for a single event dict, for per-event (streaming) scoring."""
+    def text(value):
+        return 'nan' if value is None or value != value else str(value)
+    event_type = text(event.get('event_type'))
+    process = event.get('process')
+    if event_type == 'process' and process is not None and process == process:
+        return f"process_execute_{process}"
+    return f"{event_type}_{text(event.get('action'))}"
+
+
+def encode_actions(df, vocab):
+    """
+    Adds 'simple_action' and 'action_code' columns using ``vocab``. Actions
+    missing from the vocabulary get code -1.
+    """
+    codes, labels = derive_actions(df)
+    index = {action: i for i, action in enumerate(vocab)}
+    lookup = np.array([index.get(label, -1) for label in labels], dtype=np.int32)
+    df['simple_action'] = np.asarray(labels, dtype=object)[codes]
+    df['action_code'] = lookup[codes]
+    return df
+
+
+def session_code_lists(df):
+    """Action codes per session; ``df`` must already be sorted by session_id then timestamp."""
+    if df.empty:
+        return []
+    sessions = df['session_id'].to_numpy()
+    starts = np.flatnonzero(sessions[1:] != sessions[:-1]) + 1
+    return [chunk.tolist() for chunk in np.split(df['action_code'].to_numpy(), starts)]
+
+
+# --- Persisted Vocabulary ---
+# Codes are append-only: new actions are added at the end so that existing
+# codes (and anything keyed on them, like user deltas) stay valid.
+
+def load_vocab(path=VOCAB_FILE):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def save_vocab(vocab, path=VOCAB_FILE):
+    with open(path, 'w') as f:
+        json.dump(list(vocab), f, indent=2)
+
+
+def extend_vocab(vocab, actions):
+    known = set(vocab)
+    return list(vocab) + sorted({a for a in actions if a not in known})
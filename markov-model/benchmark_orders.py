@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+import tracemalloc
+import pandas as pd
+from pathlib import Path
+from markov_trie import ContextTrie
+from action_encoding import derive_actions, encode_actions, session_code_lists
+
+def load_group_sessions(data_file, peer_group_file, vocab=None):
+    """
+    Returns ({group_id: [codes, ...]}, vocab) from the sessionized events.
+    Pass the vocab of an existing model to encode actions the way it expects.
+    """
+    df = pd.read_json(data_file, lines=True)
+    with open(peer_group_file, 'r') as f:
+        user_to_group = json.load(f)
+    df['peer_group'] = df['user_id'].map(user_to_group)
+    df.dropna(subset=['peer_group'], inplace=True)
+    if vocab is None:
+        vocab = sorted(derive_actions(df)[1])
+    encode_actions(df, vocab)
+    df.sort_values(by=['session_id', 'timestamp'], inplace=True)
+
+    sessions = {int(group_id): session_code_lists(group_df) for group_id, group_df in df.groupby('peer_group')}
+    return sessions, vocab
+
+def benchmark_order(sessions, vocab_size, order, repeats=3):
+    tracemalloc.start()
+    models = {}
+    for group_id, group_sessions in sessions.items():
+        model = ContextTrie(order, vocab_size)
+        for codes in group_sessions:
+            model.add_sequence(codes)
+        models[group_id] = model
+    model_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    transitions = sum(len(codes) - 1 for group in sessions.values() for codes in group if len(codes) > 1)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for group_id, group_sessions in sessions.items():
+            model = models[group_id]
+            for codes in group_sessions:
+                model.score(codes)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "order": order,
+        "states": sum(m.num_states() for m in models.values()),
+        "memory_kb": round(model_bytes / 1024, 1),
+        "transitions_per_sec": round(transitions * repeats / elapsed),
+    }
+
+def main(max_order=5):
+    SCRIPT_DIR = Path(__file__).resolve().parent
+    PROJECT_ROOT = SCRIPT_DIR.parent
+
+    data_file = PROJECT_ROOT / "data" / "normalized" / "events_sessionized.jsonl"
+    peer_group_file = PROJECT_ROOT / "user_to_peer_group.json"
+
+    print("Loading sessions...")
+    sessions, vocab = load_group_sessions(data_file, peer_group_file)
+    print(f"Loaded {sum(len(s) for s in sessions.values())} sessions, {len(vocab)} distinct actions.\n")
+
+    results = [benchmark_order(sessions, len(vocab), order) for order in range(1, max_order + 1)]
+    print(pd.DataFrame(results).to_string(index=False))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Markov model memory and scoring throughput per order.")
+    parser.add_argument("--max-order", type=int, default=5, help="Highest model order to benchmark.")
+    args = parser.parse_args()
+    main(args.max_order)
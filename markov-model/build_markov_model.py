@@ -1,59 +1,80 @@
-
+import argparse
 import pandas as pd
-from collections import defaultdict
 import json
 from pathlib import Path
+from markov_trie import ContextTrie, order_suffix, save_models
+from user_deltas import UserDeltaStore, build_user_delta, delta_size
+from action_encoding import derive_actions, encode_actions, extend_vocab, load_vocab, save_vocab, session_code_lists
 
-def get_simple_action(event):
-    if event['event_type'] == 'process' and pd.notna(event['process']):
-        return f"process_execute_{event['process']}"
-    return f"{event['event_type']}_{event['action']}"
-
-def main():
+def main(order=2, user_deltas=False, delta_min_count=3, delta_ratio=2.0, events=None, user_to_group=None, save=True):
+    """
+    Builds the peer-group models and returns (models, vocab). ``events`` and
+    ``user_to_group`` are already loaded inputs to use instead of the files;
+    the event table is not modified. With ``save=False`` the model file is
+    not written (the append-only action vocabulary always is).
+    """
     SCRIPT_DIR = Path(__file__).resolve().parent
     PROJECT_ROOT = SCRIPT_DIR.parent
     
     data_file = PROJECT_ROOT / "data" / "normalized" / "events_sessionized.jsonl"
     peer_group_file = PROJECT_ROOT / "user_to_peer_group.json"
-    outfile = SCRIPT_DIR / "markov_models_by_group_2nd_order.json"
+    outfile = SCRIPT_DIR / f"markov_models_by_group_{order_suffix(order)}.json"
+    deltas_file = SCRIPT_DIR / f"markov_user_deltas_{order_suffix(order)}.jsonl"
 
-    df = pd.read_json(data_file, lines=True)
+    if events is not None:
+        df = events.copy(deep=False)
+    else:
+        df = pd.read_json(data_file, lines=True, dtype={'session_id': str})
     
-    with open(peer_group_file, 'r') as f:
-        user_to_group = json.load(f)
+    if user_to_group is None:
+        with open(peer_group_file, 'r') as f:
+            user_to_group = json.load(f)
         
     df['peer_group'] = df['user_id'].map(user_to_group)
     df.dropna(subset=['peer_group'], inplace=True)
     df['peer_group'] = df['peer_group'].astype(int)
     
-    df['simple_action'] = df.apply(get_simple_action, axis=1)
+    _, labels = derive_actions(df)
+    vocab = extend_vocab(load_vocab(), labels)
+    save_vocab(vocab)
+    encode_actions(df, vocab)
+    df.sort_values(by=['session_id', 'timestamp'], inplace=True)
     
     all_models = {}
     
     for group_id, group_df in df.groupby('peer_group'):
-        print(f"Building 2nd-order model for Peer Group {group_id}...")
-        transitions = defaultdict(lambda: defaultdict(int))
-        
-        for _, session in group_df.groupby('session_id'):
-            actions = session.sort_values(by='timestamp')['simple_action'].tolist()
-            if len(actions) < 3:
-                continue
-            for i in range(len(actions) - 2):
-                state = tuple(actions[i:i+2])
-                next_state = actions[i+2]
-                transitions[str(state)][next_state] += 1
+        print(f"Building order-{order} model for Peer Group {group_id}...")
+        model = ContextTrie(order, len(vocab))
         
-        for state, next_states in transitions.items():
-            total = sum(next_states.values())
-            for next_state in next_states:
-                transitions[state][next_state] /= total
+        for codes in session_code_lists(group_df):
+            model.add_sequence(codes)
         
-        all_models[str(group_id)] = transitions
+        print(f"  {model.num_states()} context states")
+        all_models[str(group_id)] = model
 
-    with open(outfile, 'w') as f:
-        json.dump(all_models, f, indent=2)
-        
-    print(f"\nSuccessfully built 2nd-order models and saved to '{outfile}'")
+    if save:
+        save_models(outfile, all_models, vocab, order)
+        print(f"\nSuccessfully built order-{order} models and saved to '{outfile}'")
+
+    if user_deltas:
+        print("\nBuilding per-user deltas against the peer-group models...")
+        store = UserDeltaStore(max_users=len(user_to_group) or 1)
+        overrides = 0
+        for (group_id, user_id), user_df in df.groupby(['peer_group', 'user_id']):
+            delta = build_user_delta(all_models[str(group_id)], session_code_lists(user_df), delta_min_count, delta_ratio)
+            if delta is not None:
+                store.put(user_id, delta, user_df['timestamp'].max().to_pydatetime())
+                overrides += delta_size(delta)
+        store.save(deltas_file, vocab)
+        print(f"Saved deltas for {len(store)} users ({overrides} overridden transitions) to '{deltas_file}'")
+
+    return all_models, vocab
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build variable-order Markov models per peer group.")
+    parser.add_argument("--order", type=int, default=2, help="Maximum context length; lower orders are used for backoff.")
+    parser.add_argument("--user-deltas", action="store_true", help="Also build per-user deltas on top of the peer-group models.")
+    parser.add_argument("--delta-min-count", type=int, default=3, help="Minimum times a user must make a transition for it to be overridden.")
+    parser.add_argument("--delta-ratio", type=float, default=2.0, help="How many times more likely than the group a user transition must be.")
+    args = parser.parse_args()
+    main(args.order, args.user_deltas, args.delta_min_count, args.delta_ratio)
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import math
+from array import array
+from bisect import bisect_left
+
+# --- Trie Layout ---
+# Every node is a plain list [total, next_counts, children] so that large
+# models stay cheap to hold in memory and serialize straight to JSON.
+# Children are keyed by the action that came *before* the node's context,
+# i.e. walking down from the root extends the context further into the past.
+# This means contexts that share their most recent actions share nodes, and
+# the parent of any node is exactly the lower-order context we back off to.
+TOTAL, NEXT, KIDS = 0, 1, 2
+
+ORDINALS = {1: "1st", 2: "2nd", 3: "3rd"}
+
+
+def order_suffix(order):
+    """File name suffix used by the existing outputs, e.g. '2nd_order'."""
+    return f"{ORDINALS.get(order, f'{order}th')}_order"
+
+
+def new_node():
+    return [0, {}, {}]
+
+
+class ContextTrie:
+    """
+    Variable-order Markov model over integer action codes.
+
+    Counts are kept for every context of length 0..order. Probabilities are
+    interpolated from the unigram distribution up to the longest matching
+    context with Witten-Bell smoothing, so unseen transitions back off to
+    lower orders instead of collapsing to a fixed floor.
+    """
+
+    def __init__(self, order=2, vocab_size=0, root=None):
+        self.order = order
+        self.vocab_size = vocab_size
+        self.root = root if root is not None else new_node()
+
+    def add_transition(self, history, action):
+        node = self.root
+        depth = 0
+        while True:
+            node[TOTAL] += 1
+            node[NEXT][action] = node[NEXT].get(action, 0) + 1
+            if depth == len(history):
+                break
+            depth += 1
+            node = node[KIDS].setdefault(history[-depth], new_node())
+
+    def add_sequence(self, codes):
+        for i in range(1, len(codes)):
+            self.add_transition(codes[max(0, i - self.order):i], codes[i])
+
+    def context_path(self, history):
+        """Nodes matching ``history`` from the empty context to the longest known one."""
+        path = [self.root]
+        node = self.root
+        for depth in range(1, len(history) + 1):
+            node = node[KIDS].get(history[-depth])
+            if node is None:
+                break
+            path.append(node)
+        return path
+
+    def probability(self, history, action):
+        # Unknown actions still get mass from the uniform base distribution.
+        prob = 1.0 / (self.vocab_size + 1)
+        for node in self.context_path(history):
+            seen = len(node[NEXT])
+            if node[TOTAL]:
+                prob = (node[NEXT].get(action, 0) + seen * prob) / (node[TOTAL] + seen)
+        return prob
+
+    def cost(self, history, action):
+        return -math.log(self.probability(history, action))
+
+    def score(self, codes):
+        """Average negative log-likelihood per transition, or None for 1-event sessions."""
+        if len(codes) < 2:
+            return None
+        total = 0.0
+        for i in range(1, len(codes)):
+            total += self.cost(codes[max(0, i - self.order):i], codes[i])
+        return total / (len(codes) - 1)
+
+    def num_states(self):
+        return sum(1 for _ in iter_nodes(self.root, KIDS))
+
+    def num_transitions(self):
+        return sum(len(node[NEXT]) for node in iter_nodes(self.root, KIDS))
+
+    # --- Pruning ---
+
+    def prune(self, min_count=1, top_n=None, max_states=None):
+        """
+        Drops rare transitions and contexts in place. The unigram counts at the
+        root are left untouched so every known action keeps a backoff estimate.
+        """
+        stack = list(self.root[KIDS].values())
+        while stack:
+            node = stack.pop()
+            next_counts = {a: c for a, c in node[NEXT].items() if c >= min_count}
+            if top_n is not None and len(next_counts) > top_n:
+                top = sorted(next_counts.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+                next_counts = dict(top)
+            node[NEXT] = next_counts
+            node[TOTAL] = sum(next_counts.values())
+            stack.extend(node[KIDS].values())
+
+        # Remove contexts left without any transitions, deepest first.
+        def drop_empty(node):
+            for key in list(node[KIDS]):
+                child = node[KIDS][key]
+                drop_empty(child)
+                if not child[NEXT] and not child[KIDS]:
+                    del node[KIDS][key]
+        drop_empty(self.root)
+
+        if max_states is not None and self.num_states() > max_states:
+            # Rank each context by the largest total in its subtree, shallower
+            # first on ties, so a context never outranks its backoff parent and
+            # the kept contexts stay connected whatever the counts look like.
+            ranked = []
+
+            def rank(node, depth):
+                best = max([node[TOTAL]] + [rank(child, depth + 1) for child in node[KIDS].values()])
+                ranked.append((-best, depth, id(node)))
+                return best
+            for child in self.root[KIDS].values():
+                rank(child, 1)
+            ranked.sort()
+            keep = {node_id for _, _, node_id in ranked[:max_states - 1]}
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                node[KIDS] = {k: v for k, v in node[KIDS].items() if id(v) in keep}
+                stack.extend(node[KIDS].values())
+
+
+def iter_nodes(root, kids_index):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node[kids_index].values())
+
+
+# --- Quantized Backoff Tables ---
+# A compiled model stores, per context, the full interpolated cost of every
+# seen next action and the cost of backing off to the parent context. Costs
+# are -log probabilities quantized to 8 or 16 bits with one shared step size.
+Q_BACKOFF, Q_CODES, Q_COSTS, Q_KIDS = 0, 1, 2, 3
+QUANT_TYPECODES = {8: 'B', 16: 'H'}
+
+
+def compile_costs(trie):
+    """Converts a count trie into float backoff tables: [backoff, {action: cost}, kids]."""
+    base = 1.0 / (trie.vocab_size + 1)
+
+    def compile_node(node, parent_prob):
+        seen = len(node[NEXT])
+        denom = node[TOTAL] + seen
+        probs = {a: (c + seen * parent_prob(a)) / denom for a, c in node[NEXT].items()} if denom else {}
+        backoff = seen / denom if denom else 1.0
+
+        def prob(action):
+            return probs[action] if action in probs else backoff * parent_prob(action)
+
+        kids = {k: compile_node(child, prob) for k, child in node[KIDS].items()}
+        return [-math.log(backoff), {a: -math.log(p) for a, p in probs.items()}, kids]
+
+    return compile_node(trie.root, lambda action: base)
+
+
+def max_cost(node):
+    costs = [node[0], *node[1].values()]
+    return max([*costs, *(max_cost(child) for child in node[2].values())])
+
+
+class QuantizedTrie:
+    """Read-only model compiled from a ContextTrie with quantized costs."""
+
+    def __init__(self, order, vocab_size, root, bits, scale):
+        self.order = order
+        self.vocab_size = vocab_size
+        self.root = root
+        self.bits = bits
+        self.scale = scale
+        self.base_cost = math.log(vocab_size + 1)
+
+    @classmethod
+    def from_costs(cls, order, vocab_size, cost_root, bits, scale):
+        typecode = QUANT_TYPECODES[bits]
+        limit = 2 ** bits - 1
+
+        def quantize(cost):
+            return min(limit, round(cost / scale))
+
+        def build(node):
+            actions = sorted(node[1])
+            return [
+                quantize(node[0]),
+                array('i', actions),
+                array(typecode, [quantize(node[1][a]) for a in actions]),
+                {k: build(child) for k, child in node[2].items()},
+            ]
+
+        return cls(order, vocab_size, build(cost_root), bits, scale)
+
+    def context_path(self, history):
+        path = [self.root]
+        node = self.root
+        for depth in range(1, len(history) + 1):
+            node = node[Q_KIDS].get(history[-depth])
+            if node is None:
+                break
+            path.append(node)
+        return path
+
+    def cost(self, history, action):
+        units = 0
+        for node in reversed(self.context_path(history)):
+            codes = node[Q_CODES]
+            i = bisect_left(codes, action)
+            if i < len(codes) and codes[i] == action:
+                return (units + node[Q_COSTS][i]) * self.scale
+            units += node[Q_BACKOFF]
+        return units * self.scale + self.base_cost
+
+    def score(self, codes):
+        if len(codes) < 2:
+            return None
+        total = 0.0
+        for i in range(1, len(codes)):
+            total += self.cost(codes[max(0, i - self.order):i], codes[i])
+        return total / (len(codes) - 1)
+
+    def num_states(self):
+        return sum(1 for _ in iter_nodes(self.root, Q_KIDS))
+
+    def num_transitions(self):
+        return sum(len(node[Q_CODES]) for node in iter_nodes(self.root, Q_KIDS))
+
+
+def quantize_models(models, bits):
+    """Compiles every group model with a single step size shared across groups."""
+    compiled = {group: compile_costs(model) for group, model in models.items()}
+    top = max(max_cost(root) for root in compiled.values()) or 1.0
+    scale = top / (2 ** bits - 1)
+    return {
+        group: QuantizedTrie.from_costs(models[group].order, models[group].vocab_size, root, bits, scale)
+        for group, root in compiled.items()
+    }
+
+
+# --- Serialization ---
+
+def node_to_json(node):
+    return [node[TOTAL], node[NEXT], {k: node_to_json(v) for k, v in node[KIDS].items()}]
+
+
+def node_from_json(data):
+    return [
+        data[TOTAL],
+        {int(k): v for k, v in data[NEXT].items()},
+        {int(k): node_from_json(v) for k, v in data[KIDS].items()},
+    ]
+
+
+def qnode_to_json(node):
+    return [node[Q_BACKOFF], node[Q_CODES].tolist(), node[Q_COSTS].tolist(),
+            {k: qnode_to_json(v) for k, v in node[Q_KIDS].items()}]
+
+
+def qnode_from_json(data, typecode):
+    return [
+        data[Q_BACKOFF],
+        array('i', data[Q_CODES]),
+        array(typecode, data[Q_COSTS]),
+        {int(k): qnode_from_json(v, typecode) for k, v in data[Q_KIDS].items()},
+    ]
+
+
+def models_to_payload(models, vocab, order):
+    payload = {"order": order, "vocab": list(vocab)}
+    sample = next(iter(models.values()), None)
+    if isinstance(sample, QuantizedTrie):
+        payload["quantization"] = {"bits": sample.bits, "scale": sample.scale}
+        payload["groups"] = {group: qnode_to_json(model.root) for group, model in models.items()}
+    else:
+        payload["groups"] = {group: node_to_json(model.root) for group, model in models.items()}
+    return payload
+
+
+def models_to_text(models, vocab, order):
+    return json.dumps(models_to_payload(models, vocab, order), separators=(',', ':'))
+
+
+def save_models(path, models, vocab, order):
+    with open(path, 'w') as f:
+        f.write(models_to_text(models, vocab, order))
+
+
+def models_version(models, vocab, order):
+    """model_version of the file save_models would write, without writing it."""
+    return hashlib.sha256(models_to_text(models, vocab, order).encode()).hexdigest()[:16]
+
+
+def model_version(path):
+    """Content hash of a model file; changes whenever the model is rebuilt or pruned."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def load_models(path):
+    """Returns ({group_id: ContextTrie or QuantizedTrie}, vocab, order)."""
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if "groups" not in data:
+        raise ValueError(f"'{path}' uses the old fixed-order format. Please re-run build_markov_model.py.")
+    order, vocab = data["order"], data["vocab"]
+    quant = data.get("quantization")
+    if quant:
+        typecode = QUANT_TYPECODES[quant["bits"]]
+        models = {
+            group: QuantizedTrie(order, len(vocab), qnode_from_json(root, typecode), quant["bits"], quant["scale"])
+            for group, root in data["groups"].items()
+        }
+    else:
+        models = {
+            group: ContextTrie(order, len(vocab), node_from_json(root))
+            for group, root in data["groups"].items()
+        }
+    return models, vocab, order
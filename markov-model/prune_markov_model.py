@@ -0,0 +1,87 @@
+import argparse
+import json
+import time
+import pandas as pd
+from pathlib import Path
+from markov_trie import load_models, models_to_payload, order_suffix, quantize_models, save_models
+from benchmark_orders import load_group_sessions
+
+def model_report(models, vocab, order, sessions):
+    """Size and scoring throughput of a set of group models, plus every session's score."""
+    scores = []
+    transitions = 0
+    start = time.perf_counter()
+    for group_id, group_sessions in sessions.items():
+        model = models.get(str(group_id))
+        if model is None:
+            continue
+        for codes in group_sessions:
+            score = model.score(codes)
+            if score is not None:
+                scores.append(score)
+                transitions += len(codes) - 1
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "states": sum(m.num_states() for m in models.values()),
+        "transitions": sum(m.num_transitions() for m in models.values()),
+        "file_kb": round(len(json.dumps(models_to_payload(models, vocab, order), separators=(',', ':'))) / 1024, 1),
+        "transitions_per_sec": round(transitions / elapsed) if elapsed else 0,
+    }
+    return report, pd.Series(scores)
+
+def top_k_overlap(before, after, k):
+    top_before = set(before.nlargest(k).index)
+    top_after = set(after.nlargest(k).index)
+    return len(top_before & top_after) / max(1, len(top_before))
+
+def main(order=2, min_count=2, top_n=None, max_states=None, quantize_bits=None, top_k=100):
+    SCRIPT_DIR = Path(__file__).resolve().parent
+    PROJECT_ROOT = SCRIPT_DIR.parent
+
+    data_file = PROJECT_ROOT / "data" / "normalized" / "events_sessionized.jsonl"
+    peer_group_file = PROJECT_ROOT / "user_to_peer_group.json"
+    models_file = SCRIPT_DIR / f"markov_models_by_group_{order_suffix(order)}.json"
+
+    try:
+        models, vocab, order = load_models(models_file)
+    except FileNotFoundError:
+        print(f"Error: '{models_file.name}' not found. Please run build_markov_model.py first.")
+        return
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if any(not hasattr(model, 'prune') for model in models.values()):
+        print(f"Error: '{models_file}' is already quantized. Please re-run build_markov_model.py first.")
+        return
+
+    print("Loading sessions for before/after comparison...")
+    sessions, _ = load_group_sessions(data_file, peer_group_file, vocab)
+    before, before_scores = model_report(models, vocab, order, sessions)
+
+    print(f"Pruning (min_count={min_count}, top_n={top_n}, max_states={max_states})...")
+    for model in models.values():
+        model.prune(min_count=min_count, top_n=top_n, max_states=max_states)
+    if quantize_bits:
+        print(f"Quantizing log-probabilities to {quantize_bits} bits...")
+        models = quantize_models(models, quantize_bits)
+
+    after, after_scores = model_report(models, vocab, order, sessions)
+
+    print("\n--- Model Size and Throughput ---")
+    print(pd.DataFrame([before, after], index=['before', 'after']).to_string())
+    print(f"\nTop-{top_k} anomaly overlap: {top_k_overlap(before_scores, after_scores, top_k):.1%}")
+
+    save_models(models_file, models, vocab, order)
+    print(f"\nPruned models saved to '{models_file}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune and optionally quantize the peer-group Markov models.")
+    parser.add_argument("--order", type=int, default=2, help="Order of the model file to prune.")
+    parser.add_argument("--min-count", type=int, default=2, help="Drop transitions seen fewer times than this.")
+    parser.add_argument("--top-n", type=int, default=None, help="Keep only the N most frequent next actions per state.")
+    parser.add_argument("--max-states", type=int, default=None, help="Cap on context states per peer-group model.")
+    parser.add_argument("--quantize-bits", type=int, choices=[8, 16], default=None, help="Store log-probabilities as 8- or 16-bit integers.")
+    parser.add_argument("--top-k", type=int, default=100, help="Size of the top anomaly list compared before and after.")
+    args = parser.parse_args()
+    main(args.order, args.min_count, args.top_n, args.max_states, args.quantize_bits, args.top_k)
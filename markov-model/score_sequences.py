@@ -1,72 +1,175 @@
-
+import argparse
+import hashlib
 import pandas as pd
 import json
-import math
 from pathlib import Path
+from markov_trie import load_models, model_version, models_version, order_suffix
+from user_deltas import UserDeltaStore, delta_fingerprint, personalized_score
+from action_encoding import VOCAB_FILE, encode_actions, load_vocab
+
+def sequence_hash(group, user_id, sequence, delta_id=''):
+    return hashlib.sha1(f"{group}|{user_id}|{delta_id}|{sequence}".encode()).hexdigest()
 
-def get_simple_action(event):
-    if event['event_type'] == 'process' and pd.notna(event['process']):
-        return f"process_execute_{event['process']}"
-    return f"{event['event_type']}_{event['action']}"
+def load_score_cache(outfile):
+    """
+    Previous results as (scores keyed by (seq_hash, model_version), the
+    file's {session_id: (seq_hash, model_version)}). Session ids shift
+    whenever events are re-sessionized, so scores are only ever looked up by
+    content; the second mapping tells whether the file can be appended to.
+    Rows written before the cache columns existed are ignored.
+    """
+    cache, previous = {}, {}
+    if not outfile.exists():
+        return cache, previous
+    with open(outfile, 'r') as f:
+        for line in f:
+            row = json.loads(line)
+            if 'seq_hash' not in row or 'model_version' not in row:
+                continue
+            key = (row['seq_hash'], row['model_version'])
+            cache[key] = row
+            previous[row['session_id']] = key
+    return cache, previous
 
-def main():
+def write_results(path, rows, mode):
+    with open(path, mode) as f:
+        for row in sorted(rows, key=lambda r: (-r['score'], r['session_id'])):
+            f.write(json.dumps(row) + '\n')
+
+def main(order=2, full=False, personalize=False, max_users=100000, idle_days=30,
+         events=None, models=None, vocab=None, user_to_group=None, write=True):
+    """
+    Scores every session against its peer-group model and returns the results
+    sorted by score. ``events``, ``models``/``vocab`` (from build_markov_model)
+    and ``user_to_group`` are already loaded inputs to use instead of the
+    files; the event table is not modified. With ``write=False`` the results
+    file is left alone.
+    """
     SCRIPT_DIR = Path(__file__).resolve().parent
     PROJECT_ROOT = SCRIPT_DIR.parent
     
     data_file = PROJECT_ROOT / "data" / "normalized" / "events_sessionized.jsonl"
-    models_file = SCRIPT_DIR / "markov_models_by_group_2nd_order.json"
+    models_file = SCRIPT_DIR / f"markov_models_by_group_{order_suffix(order)}.json"
     peer_group_file = PROJECT_ROOT / "user_to_peer_group.json"
-    outfile = PROJECT_ROOT / "sequence_anomalies_2nd_order.jsonl"
+    outfile = PROJECT_ROOT / f"sequence_anomalies_{order_suffix(order)}.jsonl"
+    deltas_file = SCRIPT_DIR / f"markov_user_deltas_{order_suffix(order)}.jsonl"
 
-    with open(models_file, 'r') as f:
-        models = json.load(f)
+    if models is not None:
+        version = models_version(models, vocab, order)
+    else:
+        try:
+            models, vocab, order = load_models(models_file)
+        except FileNotFoundError:
+            print(f"Error: '{models_file.name}' not found. Please run build_markov_model.py first.")
+            return
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        version = model_version(models_file)
+    # Only an existing vocabulary file can disagree; without one there is nothing to compare.
+    if VOCAB_FILE.exists() and load_vocab()[:len(vocab)] != vocab:
+        print("Error: the action vocabulary changed since these models were built. Please re-run build_markov_model.py.")
+        return
         
-    with open(peer_group_file, 'r') as f:
-        user_to_group = json.load(f)
+    if user_to_group is None:
+        with open(peer_group_file, 'r') as f:
+            user_to_group = json.load(f)
+
+    store = None
+    if personalize:
+        if deltas_file.exists():
+            store = UserDeltaStore.load(deltas_file, vocab, max_users, idle_days)
+        if store is None:
+            print(f"Warning: no usable user deltas at '{deltas_file}'. Scoring with peer-group models only.")
+        else:
+            print(f"Loaded personalized deltas for {len(store)} users.")
+    fingerprints = {}
 
-    df = pd.read_json(data_file, lines=True)
-    df['simple_action'] = df.apply(get_simple_action, axis=1)
+    cache, previous = ({}, {}) if full else load_score_cache(outfile)
+    reusable = sum(1 for _, cached_version in cache if cached_version == version)
+    if reusable:
+        print(f"Loaded {reusable} cached sequence scores for model version {version}.")
+    else:
+        print(f"No reusable score cache for model version {version}; scoring all sessions.")
+
+    if events is not None:
+        df = events.copy(deep=False)
+    else:
+        df = pd.read_json(data_file, lines=True, dtype={'session_id': str})
+    # Actions never seen in training map to -1 and fall back to the base distribution.
+    encode_actions(df, vocab)
     df['peer_group'] = df['user_id'].map(user_to_group)
+    df.sort_values(by=['session_id', 'timestamp'], inplace=True)
     
     session_scores = {}
-    for session_id, session in df.groupby('session_id'):
+    new_rows = []
+    for session_id, session in df.groupby('session_id', sort=False):
         user = session['user_id'].iloc[0]
-        group = str(session['peer_group'].iloc[0]) if pd.notna(session['peer_group'].iloc[0]) else None
+        group = str(int(session['peer_group'].iloc[0])) if pd.notna(session['peer_group'].iloc[0]) else None
         
         if not group or group not in models:
             continue
             
-        model = models[group]
-        actions = session.sort_values(by='timestamp')['simple_action'].tolist()
-        log_probability = 0
-        transition_count = 0
-        
-        if len(actions) < 3:
+        actions = session['simple_action'].tolist()
+        if len(actions) < 2:
+            continue
+        sequence = " -> ".join(actions)
+        delta = store.get(user, session['timestamp'].iloc[-1].to_pydatetime()) if store else None
+        if delta is not None and user not in fingerprints:
+            fingerprints[user] = delta_fingerprint(delta)
+        seq_hash = sequence_hash(group, user, sequence, fingerprints.get(user, '') if delta is not None else '')
+
+        cached = cache.get((seq_hash, version))
+        if cached is not None:
+            # Only the score is reused; the ids always come from the current session.
+            session_scores[session_id] = {**cached, "session_id": session_id, "user_id": user}
             continue
         
-        for i in range(len(actions) - 2):
-            state = str(tuple(actions[i:i+2]))
-            next_state = actions[i+2]
-            prob = model.get(state, {}).get(next_state, 1e-9)
-            log_probability += -math.log(prob)
-            transition_count += 1
-            
-        score = log_probability / transition_count if transition_count > 0 else 0
-        
-        session_scores[session_id] = {
+        row = {
+            "session_id": session_id,
             "user_id": user,
-            "score": score,
-            "sequence": " -> ".join(actions)
+            "score": personalized_score(models[group], delta, session['action_code'].tolist()),
+            "sequence": sequence,
+            "seq_hash": seq_hash,
+            "model_version": version
         }
-        
+        session_scores[session_id] = row
+        new_rows.append(row)
+
+    print(f"Scored {len(new_rows)} new or changed sessions, reused {len(session_scores) - len(new_rows)} cached scores.")
+
+    # If every row already in the file still describes the same session, the
+    # sessions added since can be appended; otherwise the file is stale.
+    if write:
+        unchanged = all(
+            sid in session_scores and (session_scores[sid]['seq_hash'], session_scores[sid]['model_version']) == key
+            for sid, key in previous.items()
+        )
+        if previous and unchanged:
+            write_results(outfile, [row for sid, row in session_scores.items() if sid not in previous], 'a')
+        else:
+            write_results(outfile, session_scores.values(), 'w')
+
+    if not session_scores:
+        print("No sessions had a peer-group model and at least two actions; nothing to rank.")
+        return pd.DataFrame(columns=['session_id', 'user_id', 'score', 'sequence', 'seq_hash', 'model_version'])
+
     results_df = pd.DataFrame.from_dict(session_scores, orient='index')
     results_df.sort_values(by='score', ascending=False, inplace=True)
     
-    print("\n--- Top 10 Most Anomalous Sequences (2nd-Order Peer Group Models) ---")
-    print(results_df.head(10))
+    print(f"\n--- Top 10 Most Anomalous Sequences (Order-{order} Peer Group Models) ---")
+    print(results_df[['user_id', 'score', 'sequence']].head(10))
     
-    results_df.to_json(outfile, orient='records', lines=True)
-    print(f"\nFull 2nd-order sequence analysis results saved to '{outfile}'")
+    if write:
+        print(f"\nFull order-{order} sequence analysis results saved to '{outfile}'")
+    return results_df
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Score sessions against the peer-group Markov models.")
+    parser.add_argument("--order", type=int, default=2, help="Order of the model file to score against.")
+    parser.add_argument("--full", action="store_true", help="Ignore cached scores and rescore every session.")
+    parser.add_argument("--personalize", action="store_true", help="Blend in per-user deltas built with build_markov_model.py --user-deltas.")
+    parser.add_argument("--max-users", type=int, default=100000, help="Maximum number of user deltas held in memory.")
+    parser.add_argument("--idle-days", type=int, default=30, help="Drop deltas of users inactive for longer than this.")
+    args = parser.parse_args()
+    main(args.order, args.full, args.personalize, args.max_users, args.idle_days)
@@ -0,0 +1,172 @@
+import hashlib
+import heapq
+import json
+import math
+from collections import OrderedDict
+from datetime import datetime
+from markov_trie import ContextTrie, TOTAL, NEXT, KIDS, node_from_json
+
+# --- Per-User Deltas ---
+# A delta is a sparse trie shaped like the peer-group ContextTrie. It only
+# holds the contexts where a user picks some next action much more often
+# than their peer group does, stored as [user_total, {action: user_count}, kids].
+# Everything else is scored by the group model, so memory grows with how far
+# a user actually diverges rather than with how active they are.
+
+
+def extract_delta(group_model, node, history, min_count, ratio):
+    overrides = {
+        action: count for action, count in node[NEXT].items()
+        if count >= min_count and count / node[TOTAL] > ratio * math.exp(-group_model.cost(history, action))
+    }
+    kids = {}
+    for key, child in node[KIDS].items():
+        sub = extract_delta(group_model, child, [key] + history, min_count, ratio)
+        if sub is not None:
+            kids[key] = sub
+    if not overrides and not kids:
+        return None
+    return [node[TOTAL], overrides, kids]
+
+
+def build_user_delta(group_model, user_sessions, min_count=3, ratio=2.0):
+    """
+    Returns the user's delta against ``group_model`` or None if they behave
+    like their group. Only upward divergence is kept: the goal is to stop
+    flagging a user's own routine, not to make them look more anomalous.
+    """
+    user_trie = ContextTrie(group_model.order, group_model.vocab_size)
+    for codes in user_sessions:
+        user_trie.add_sequence(codes)
+    return extract_delta(group_model, user_trie.root, [], min_count, ratio)
+
+
+def delta_size(delta):
+    if delta is None:
+        return 0
+    return len(delta[NEXT]) + sum(delta_size(child) for child in delta[KIDS].values())
+
+
+def delta_fingerprint(delta):
+    if delta is None:
+        return ''
+    return hashlib.sha1(json.dumps(delta, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def blended_cost(group_model, delta, history, action, prior=5.0):
+    """
+    Mixes the group probability with the user's own estimate from the longest
+    delta context that overrides ``action``. The user's weight grows with how
+    often they have been in that context.
+    """
+    group_prob = math.exp(-group_model.cost(history, action))
+    best = None
+    node = delta
+    depth = 0
+    while node is not None:
+        if action in node[NEXT]:
+            best = node
+        if depth == len(history):
+            break
+        depth += 1
+        node = node[KIDS].get(history[-depth])
+    if best is None:
+        return -math.log(group_prob)
+    weight = best[TOTAL] / (best[TOTAL] + prior)
+    return -math.log((1 - weight) * group_prob + weight * best[NEXT][action] / best[TOTAL])
+
+
+def personalized_score(group_model, delta, codes, prior=5.0):
+    if delta is None:
+        return group_model.score(codes)
+    if len(codes) < 2:
+        return None
+    order = group_model.order
+    total = 0.0
+    for i in range(1, len(codes)):
+        total += blended_cost(group_model, delta, codes[max(0, i - order):i], codes[i], prior)
+    return total / (len(codes) - 1)
+
+
+# --- Bounded Store ---
+
+class UserDeltaStore:
+    """
+    LRU map of user -> delta with an idle timeout, so the number of resident
+    users stays bounded no matter how many users have deltas on disk.
+    """
+
+    def __init__(self, max_users=100000, idle_days=30):
+        self.max_users = max_users
+        self.idle_days = idle_days
+        self.deltas = OrderedDict()  # user_id -> (delta, last_seen datetime)
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def put(self, user_id, delta, last_seen):
+        if delta is None:
+            return
+        self.deltas[user_id] = (delta, last_seen)
+        self.deltas.move_to_end(user_id)
+        while len(self.deltas) > self.max_users:
+            self.deltas.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, user_id, now=None):
+        entry = self.deltas.get(user_id)
+        if entry is None:
+            return None
+        delta, last_seen = entry
+        if now is not None:
+            last_seen = max(last_seen, now)
+        self.deltas[user_id] = (delta, last_seen)
+        self.deltas.move_to_end(user_id)
+        return delta
+
+    def evict_idle(self, now):
+        cutoff = now.timestamp() - self.idle_days * 86400
+        idle = [user for user, (_, last_seen) in self.deltas.items() if last_seen.timestamp() < cutoff]
+        for user in idle:
+            del self.deltas[user]
+        self.evictions += len(idle)
+        return len(idle)
+
+    def save(self, path, vocab):
+        with open(path, 'w') as f:
+            f.write(json.dumps({"vocab": list(vocab)}) + '\n')
+            for user_id, (delta, last_seen) in self.deltas.items():
+                f.write(json.dumps({"user_id": user_id, "last_seen": last_seen.isoformat(), "delta": delta}) + '\n')
+
+    @classmethod
+    def load(cls, path, vocab, max_users=100000, idle_days=30, now=None):
+        """
+        Streams a deltas file and keeps only the most recently active users
+        that are within the idle window of ``now`` (default: the newest
+        last_seen in the file). Returns None if the file was built against a
+        different action vocabulary.
+        """
+        store = cls(max_users, idle_days)
+        with open(path, 'r') as f:
+            header = json.loads(f.readline())
+            if header.get("vocab") != list(vocab):
+                return None
+            recent = []
+            for line in f:
+                row = json.loads(line)
+                last_seen = datetime.fromisoformat(row['last_seen'])
+                entry = (last_seen.timestamp(), row['user_id'], last_seen, row['delta'])
+                if len(recent) < max_users:
+                    heapq.heappush(recent, entry)
+                else:
+                    heapq.heappushpop(recent, entry)
+        if not recent:
+            return store
+        newest = now or max(entry[2] for entry in recent)
+        cutoff = newest.timestamp() - idle_days * 86400
+        for ts, user_id, last_seen, delta in sorted(recent):
+            if ts >= cutoff:
+                store.put(user_id, node_from_json(delta), last_seen)
+        return store
+
@@ -1,9 +1,11 @@
 
+import argparse
 import os
 import re
 import json
 import csv
 from datetime import datetime
+from functools import partial
 
 # --- Configuration ---
 RAW_DIR = "data/raw"
@@ -25,11 +27,83 @@ fw_log_re = re.compile(
     r"dst=(?P<dst_ip>\S+):(?P<dst_port>\d+)\s+bytes=(?P<bytes>\d+)"
 )
 
-def parse_syslog_time(timestamp_str):
+def parse_syslog_time(timestamp_str, year=None):
+    # Syslog timestamps carry no year; default to the current one.
     dt_obj = datetime.strptime(timestamp_str, '%b %d %H:%M:%S')
-    return dt_obj.replace(year=datetime.now().year)
+    return dt_obj.replace(year=year or datetime.now().year)
 
-def normalize_all_logs(raw_dir=RAW_DIR, out_file=OUT_FILE):
+# --- Per-source parsers: each returns one normalized event dict, or None to skip ---
+
+def parse_auth_line(line, year=None):
+    match = auth_log_re.match(line)
+    if not match:
+        return None
+    fields = match.groupdict()
+    return {
+        "timestamp": parse_syslog_time(fields['timestamp'], year).isoformat() + "Z",
+        "event_type": "auth",
+        "action": "login",
+        "status": "success" if fields['status'] == "Accepted" else "failure",
+        "user_id": fields['user_id'],
+        "host": fields['host'],
+        "src_ip": fields['src_ip'],
+        "src_port": int(fields['src_port']),
+        "raw": line.strip()
+    }
+
+def parse_endpoint_json(line):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return {
+        "timestamp": record.get('timestamp'),
+        "event_type": "process",
+        "action": "start",
+        "user_id": record.get('user'),
+        "host": record.get('host'),
+        "process": record.get('process'),
+        "raw": record.get('cmdline')
+    }
+
+def parse_web_proxy_json(line):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    record['action'] = (record.get('http_method') or '').lower()
+    record['raw'] = line.strip()
+    return record
+
+def parse_file_audit_row(row):
+    try:
+        bytes_out = int(row['bytes'])
+    except (KeyError, TypeError, ValueError):
+        bytes_out = 0
+    return {
+        "timestamp": row.get('timestamp'),
+        "event_type": "file",
+        "action": row.get('action'),
+        "user_id": row.get('user'),
+        "resource": row.get('path'),
+        "bytes_out": bytes_out
+    }
+
+# Parsers by source kind, for records that arrive one at a time rather than from files.
+SOURCE_PARSERS = {
+    "auth": parse_auth_line,
+    "web": parse_web_proxy_json,
+    "proc": parse_endpoint_json,
+    "file": parse_file_audit_row,
+}
+
+def normalize_stream(records):
+    """Normalizes (kind, raw record) pairs as they arrive, in the order given. File audit records are dict rows."""
+    for kind, record in records:
+        if event := SOURCE_PARSERS[kind](record):
+            yield event
+
+def normalize_all_logs(raw_dir=RAW_DIR, out_file=OUT_FILE, syslog_year=None):
     os.makedirs(os.path.dirname(out_file), exist_ok=True)
     events = []
     
@@ -37,7 +111,7 @@ def normalize_all_logs(raw_dir=RAW_DIR, out_file=OUT_FILE):
     
     # Define which parser to use for each file
     file_parsers = {
-        "auth.log": ("line", parse_auth_line),
+        "auth.log": ("line", partial(parse_auth_line, year=syslog_year)),
         "endpoint_proc.jsonl": ("line", parse_endpoint_json),
         "web_proxy.jsonl": ("line", parse_web_proxy_json), # <-- ADDED NEW FILE
         "file_audit.csv": ("csv", parse_file_audit_row)
@@ -78,4 +152,9 @@ def normalize_all_logs(raw_dir=RAW_DIR, out_file=OUT_FILE):
     print(f"\nSuccessfully normalized {len(all_events)} events into '{out_file}'")
 
 if __name__ == "__main__":
-    normalize_all_logs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Normalize the raw logs into one chronological JSONL file.")
+    parser.add_argument("--raw-dir", default=RAW_DIR, help="Directory holding the raw log files.")
+    parser.add_argument("--out", default=OUT_FILE, help="Where to write the normalized events.")
+    parser.add_argument("--syslog-year", type=int, default=None, help="Year for auth.log timestamps, which have none (default: the current year).")
+    args = parser.parse_args()
+    normalize_all_logs(args.raw_dir, args.out, args.syslog_year)
\ No newline at end of file
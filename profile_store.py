@@ -0,0 +1,190 @@
+import json
+import sqlite3
+
+PROFILE_SQLITE_DB = 'user_profiles.db'
+
+# Profile keys stored in their own columns/tables; everything else goes into 'attrs'.
+KNOWN_KINDS = {'known_ips': 'ip', 'known_hosts': 'host'}
+COLUMN_KEYS = ('user_id', 'last_seen', 'risk_score', *KNOWN_KINDS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id TEXT PRIMARY KEY,
+    risk_score INTEGER NOT NULL DEFAULT 0,
+    last_seen TEXT,
+    attrs TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS known_entities (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    UNIQUE (user_id, kind, value)
+);
+CREATE TABLE IF NOT EXISTS group_sketches (
+    group_id TEXT PRIMARY KEY,
+    sketch TEXT NOT NULL
+);
+"""
+
+
+def _snapshot(profile):
+    """What a profile looked like when loaded, to tell later whether it changed."""
+    return (
+        profile.get('risk_score'), profile.get('last_seen'),
+        {key: len(profile.get(key, [])) for key in KNOWN_KINDS},
+        json.dumps({k: v for k, v in profile.items() if k not in COLUMN_KEYS}, sort_keys=True),
+    )
+
+
+class SQLiteProfileStore:
+    """
+    Drop-in replacement for the profiles dict in analysis_pipeline, backed by
+    an indexed SQLite database.
+
+    Profiles are read lazily (one user, or a batch with load_many) and cached
+    for the run; flush() upserts only the profiles that changed since they
+    were loaded, in batched transactions. Known IPs and hosts live in their
+    own table with a unique (user_id, kind, value) key, so they behave as sets
+    on disk while profiles keep exposing them as ordered lists.
+    """
+
+    def __init__(self, path=PROFILE_SQLITE_DB, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Same rounding as the JSON path (Python's round, not SQLite's ROUND).
+        self.conn.create_function('py_round', 1, round, deterministic=True)
+        self._cache = {}
+        self._loaded = {}   # user_id -> snapshot at load time, None for new profiles
+        self._missing = set()
+
+    # --- Mapping interface used by analysis_pipeline ---
+
+    def __contains__(self, user_id):
+        if user_id in self._cache:
+            return True
+        if user_id in self._missing:
+            return False
+        self.load_many([user_id])
+        return user_id in self._cache
+
+    def __getitem__(self, user_id):
+        if user_id not in self:
+            raise KeyError(user_id)
+        return self._cache[user_id]
+
+    def __setitem__(self, user_id, profile):
+        self._cache[user_id] = profile
+        self._loaded.setdefault(user_id, None)
+        self._missing.discard(user_id)
+
+    def __len__(self):
+        stored = self.conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+        return stored + sum(1 for snap in self._loaded.values() if snap is None)
+
+    def get(self, user_id, default=None):
+        return self[user_id] if user_id in self else default
+
+    def items(self):
+        """Cached profiles only; use decay_risk_scores for whole-table updates."""
+        return self._cache.items()
+
+    # --- Loading ---
+
+    def load_many(self, user_ids):
+        pending = [u for u in dict.fromkeys(user_ids) if u not in self._cache and u not in self._missing]
+        for start in range(0, len(pending), 500):
+            chunk = pending[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT user_id, risk_score, last_seen, attrs FROM profiles WHERE user_id IN ({marks})", chunk
+            ).fetchall()
+            known = {}
+            for user_id, kind, value in self.conn.execute(
+                f"SELECT user_id, kind, value FROM known_entities WHERE user_id IN ({marks}) ORDER BY id", chunk
+            ):
+                known.setdefault((user_id, kind), []).append(value)
+
+            for user_id, risk_score, last_seen, attrs in rows:
+                profile = {
+                    "user_id": user_id,
+                    "known_ips": known.get((user_id, 'ip'), []),
+                    "known_hosts": known.get((user_id, 'host'), []),
+                    **json.loads(attrs),
+                    "last_seen": last_seen,
+                    "risk_score": risk_score,
+                }
+                self._cache[user_id] = profile
+                self._loaded[user_id] = _snapshot(profile)
+            self._missing.update(u for u in chunk if u not in self._cache)
+
+    # --- Writing ---
+
+    def decay_risk_scores(self, factor):
+        with self.conn:
+            self.conn.execute("UPDATE profiles SET risk_score = py_round(risk_score * ?)", (factor,))
+        for profile in self._cache.values():
+            profile['risk_score'] = round(profile.get('risk_score', 0) * factor)
+        self._loaded = {u: (_snapshot(self._cache[u]) if snap is not None else None) for u, snap in self._loaded.items()}
+
+    def flush(self):
+        """Upserts profiles that are new or changed since load. Returns how many were written."""
+        changed = [u for u, snap in self._loaded.items() if snap is None or snap != _snapshot(self._cache[u])]
+        for start in range(0, len(changed), self.batch_size):
+            chunk = changed[start:start + self.batch_size]
+            profile_rows, entity_rows = [], []
+            for user_id in chunk:
+                profile = self._cache[user_id]
+                snap = self._loaded[user_id]
+                profile_rows.append((
+                    user_id, profile.get('risk_score', 0), profile.get('last_seen'),
+                    json.dumps({k: v for k, v in profile.items() if k not in COLUMN_KEYS}),
+                ))
+                for key, kind in KNOWN_KINDS.items():
+                    already = snap[2][key] if snap is not None else 0
+                    entity_rows.extend((user_id, kind, value) for value in profile.get(key, [])[already:])
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO profiles (user_id, risk_score, last_seen, attrs) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET risk_score=excluded.risk_score, "
+                    "last_seen=excluded.last_seen, attrs=excluded.attrs",
+                    profile_rows,
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO known_entities (user_id, kind, value) VALUES (?, ?, ?)", entity_rows
+                )
+        for user_id in changed:
+            self._loaded[user_id] = _snapshot(self._cache[user_id])
+        return len(changed)
+
+    # --- Peer-group sketches ---
+
+    def load_group_sketches(self):
+        return {group_id: json.loads(sketch) for group_id, sketch in
+                self.conn.execute("SELECT group_id, sketch FROM group_sketches")}
+
+    def save_group_sketches(self, sketches):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO group_sketches (group_id, sketch) VALUES (?, ?) "
+                "ON CONFLICT(group_id) DO UPDATE SET sketch=excluded.sketch",
+                [(group_id, json.dumps(sketch)) for group_id, sketch in sketches.items()],
+            )
+
+    def import_json(self, path):
+        """One-off migration from user_profiles.json. Returns the number of profiles imported."""
+        try:
+            with open(path, 'r') as f:
+                profiles = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+        for user_id, profile in profiles.items():
+            self[user_id] = profile
+        return self.flush()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,235 @@
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import socket
+import time
+from datetime import datetime, timezone
+
+from faker import Faker
+
+from alert_store import ALERT_SINK_TYPES, open_alert_sink
+from generate_logs import (ATTACK_STAGES, FILE_AUDIT_HEADER, RAW_FILES, TOTAL_USERS, RecordSink, build_pools,
+                           generate_normal_activity, generate_personas)
+from normalize import normalize_stream
+
+ATTACK_LOG = 'replay_attack.json'
+
+
+# --- Burst Profiles ---
+# Each maps seconds since the start of the replay to a multiple of the base rate.
+
+def constant_profile(t, period, factor, burst_seconds):
+    return 1.0
+
+
+def spike_profile(t, period, factor, burst_seconds):
+    """``factor`` times the base rate for ``burst_seconds`` at the start of every period."""
+    return factor if t % period < burst_seconds else 1.0
+
+
+def wave_profile(t, period, factor, burst_seconds):
+    """A raised cosine between the base rate and ``factor`` times it, like a compressed working day."""
+    return 1.0 + (factor - 1.0) * (1 - math.cos(2 * math.pi * t / period)) / 2
+
+
+BURST_PROFILES = {'constant': constant_profile, 'spike': spike_profile, 'wave': wave_profile}
+
+
+# --- Targets ---
+
+class RawFileTarget:
+    """Appends raw records to the four raw log files, flushing after every tick so tailers see them."""
+
+    def __init__(self, outdir):
+        os.makedirs(outdir, exist_ok=True)
+        self.files = {}
+        for kind, name in RAW_FILES.items():
+            path = os.path.join(outdir, name)
+            needs_header = kind == 'file' and (not os.path.exists(path) or os.path.getsize(path) == 0)
+            self.files[kind] = open(path, "a", newline='' if kind == 'file' else None)
+            if needs_header:
+                csv.writer(self.files[kind]).writerow(FILE_AUDIT_HEADER)
+        self.csv_writer = csv.writer(self.files['file'])
+
+    def send(self, records):
+        for kind, record in records:
+            if kind == 'file':
+                self.csv_writer.writerow([record[column] for column in FILE_AUDIT_HEADER])
+            else:
+                self.files[kind].write(record)
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class SocketTarget:
+    """Sends normalized JSON lines to a stream_detector.py --source socket listener."""
+
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+
+    def send(self, records):
+        # sendall blocks while the detector's queue is full, so the achieved rate shows the backpressure.
+        payload = ''.join(json.dumps(event) + '\n' for event in normalize_stream(records))
+        self.sock.sendall(payload.encode())
+
+    def close(self):
+        self.sock.close()
+
+
+# --- Time to Alert ---
+
+def wait_for_alert(alert_sink, user_id, injected_at, timeout, poll_interval=0.5):
+    """The first alert for ``user_id`` appended to the sink at or after ``injected_at``, or None after ``timeout`` seconds."""
+    sink = open_alert_sink(alert_sink)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            alerts = [a for a in sink.query(user_id=user_id)
+                      if datetime.fromisoformat(a['created_at']) >= injected_at]
+            if alerts:
+                return min(alerts, key=lambda a: a['created_at'])
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+    finally:
+        sink.close()
+
+
+def main(rate=200.0, duration=60.0, profile='constant', period=60.0, factor=5.0, burst_seconds=5.0,
+         target='files', outdir='data/raw', host='127.0.0.1', port=9514, attack_at=None,
+         attacker_id=None, users=TOTAL_USERS, seed=None, tick=0.1, attack_log=ATTACK_LOG,
+         alert_sink=None, alert_timeout=30.0, report_interval=10.0, stage_gap=5.0):
+    """
+    Replays synthetic activity stamped with the current time at ``rate``
+    events/sec shaped by a burst profile, and injects the stages of the
+    scripted attack chain ``stage_gap`` seconds apart from ``attack_at``
+    seconds in (default: halfway). Each stage is stamped with the time it is
+    sent, and its injection time is written to ``attack_log``; with
+    ``alert_sink`` the sink is then polled for the attacker's first alert to
+    record the time to alert from the first stage.
+    """
+    rng = random.Random(seed)
+    if seed is not None:
+        random.seed(seed)
+        Faker.seed(seed)
+    personas = [p for p in generate_personas(users) if p['user_id'] != 'test_attacker']
+    pools = build_pools()
+    # A fresh attacker id keeps earlier runs' profiles from hiding the attack.
+    attacker = {'user_id': attacker_id or f"replay_attacker_{int(time.time())}", 'role': 'developer',
+                'home_ip': '198.51.100.99', 'home_host': 'host-7'}
+    attack_at = duration / 2 if attack_at is None else attack_at
+    rate_multiple = BURST_PROFILES[profile]
+
+    if target == 'socket':
+        sink = SocketTarget(host, port)
+        print(f"Replaying to {host}:{port} at {rate:g} events/s ({profile}) for {duration:g}s...")
+    else:
+        sink = RawFileTarget(outdir)
+        print(f"Appending to the raw logs in '{outdir}' at {rate:g} events/s ({profile}) for {duration:g}s...")
+
+    records = []
+    writers = {kind: RecordSink(kind, records) for kind in RAW_FILES}
+    attack = None
+    stages = list(ATTACK_STAGES.items())
+    sent, budget = 0, 0.0
+    started = next_tick = last_report = time.monotonic()
+    try:
+        while (elapsed := time.monotonic() - started) < duration:
+            budget += rate * rate_multiple(elapsed, period, factor, burst_seconds) * tick
+            now = datetime.utcnow()
+            while budget >= 1:
+                before = len(records)
+                generate_normal_activity(writers, rng.choice(personas), now, rng, pools)
+                budget -= len(records) - before
+            if records:
+                sent += len(records)
+                sink.send(records)
+                records.clear()
+            done = len(attack['stages']) if attack else 0
+            if done < len(stages) and elapsed >= attack_at + done * stage_gap:
+                name, stage = stages[done]
+                stage(writers, attacker, datetime.utcnow(), rng, pools)
+                sink.send(records)
+                injected_at = datetime.now(timezone.utc).isoformat()
+                if attack is None:
+                    attack = {'user_id': attacker['user_id'], 'injected_at': injected_at,
+                              'seconds_into_replay': round(elapsed, 3), 'events_before': sent,
+                              'attack_events': 0, 'target': target, 'stages': []}
+                attack['stages'].append({'stage': name, 'injected_at': injected_at,
+                                         'seconds_into_replay': round(elapsed, 3), 'events': len(records)})
+                attack['attack_events'] += len(records)
+                sent += len(records)
+                records.clear()
+                with open(attack_log, 'w') as f:
+                    json.dump(attack, f, indent=2)
+                print(f"[replay] attack stage '{name}' for '{attacker['user_id']}' injected at {injected_at}")
+            if time.monotonic() - last_report >= report_interval:
+                print(f"[replay] {sent} events in {elapsed:.1f}s ({sent / elapsed:.0f}/s)")
+                last_report = time.monotonic()
+            # Sleep to the next tick on a fixed schedule so slow ticks don't drift the rate.
+            next_tick += tick
+            time.sleep(max(next_tick - time.monotonic(), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+
+    elapsed = time.monotonic() - started
+    print(f"\n[replay] {sent} events in {elapsed:.1f}s ({sent / elapsed:.0f}/s against a {rate:g}/s base rate)")
+    if attack is None:
+        print("[replay] the replay ended before the attack chain was injected.")
+        return None
+    if len(attack['stages']) < len(stages):
+        print(f"[replay] the replay ended after {len(attack['stages'])} of {len(stages)} attack stages.")
+
+    if alert_sink:
+        print(f"Waiting up to {alert_timeout:g}s for an alert on '{attack['user_id']}' in the {alert_sink} sink...")
+        first = wait_for_alert(alert_sink, attack['user_id'], datetime.fromisoformat(attack['injected_at']), alert_timeout)
+        if first is None:
+            print("[replay] no alert for the attacker before the timeout.")
+            attack['time_to_alert_s'] = None
+        else:
+            attack['first_alert'] = first
+            attack['time_to_alert_s'] = (datetime.fromisoformat(first['created_at'])
+                                         - datetime.fromisoformat(attack['injected_at'])).total_seconds()
+            print(f"[replay] first alert '{first['alert_type']}' after {attack['time_to_alert_s']:.3f}s")
+        with open(attack_log, 'w') as f:
+            json.dump(attack, f, indent=2)
+    print(f"Attack injection recorded in '{attack_log}'")
+    return attack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthetic activity at a controlled rate and record when the attack chain is injected.")
+    parser.add_argument("--rate", type=float, default=200.0, help="Base rate in events per second.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to replay for.")
+    parser.add_argument("--profile", choices=list(BURST_PROFILES), default="constant", help="How the rate varies over time.")
+    parser.add_argument("--period", type=float, default=60.0, help="Seconds per spike or wave cycle.")
+    parser.add_argument("--factor", type=float, default=5.0, help="Peak rate as a multiple of the base rate.")
+    parser.add_argument("--burst-seconds", type=float, default=5.0, help="Length of each spike for --profile spike.")
+    parser.add_argument("--target", choices=["files", "socket"], default="files", help="Append raw logs to files or send normalized events to a socket.")
+    parser.add_argument("--outdir", default="data/raw", help="Raw log directory for --target files.")
+    parser.add_argument("--host", default="127.0.0.1", help="Detector address for --target socket.")
+    parser.add_argument("--port", type=int, default=9514, help="Detector port for --target socket.")
+    parser.add_argument("--attack-at", type=float, default=None, help="Seconds into the replay to inject the attack chain (default: halfway).")
+    parser.add_argument("--stage-gap", type=float, default=5.0, help="Seconds between the attack chain's stages.")
+    parser.add_argument("--attacker-id", default=None, help="User id for the attack chain (default: a fresh replay_attacker_<time>).")
+    parser.add_argument("--users", type=int, default=TOTAL_USERS, help="Number of personas to draw activity from.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the personas and activity.")
+    parser.add_argument("--tick", type=float, default=0.1, help="Seconds between batches of events.")
+    parser.add_argument("--attack-log", default=ATTACK_LOG, help="Where to record the attack injection.")
+    parser.add_argument("--alert-sink", choices=ALERT_SINK_TYPES, default=None, help="Poll this alert sink afterwards to measure time to alert.")
+    parser.add_argument("--alert-timeout", type=float, default=30.0, help="Seconds to wait for the attacker's first alert.")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress reports.")
+    args = parser.parse_args()
+    main(args.rate, args.duration, args.profile, args.period, args.factor, args.burst_seconds,
+         args.target, args.outdir, args.host, args.port, args.attack_at, args.attacker_id, args.users,
+         args.seed, args.tick, args.attack_log, args.alert_sink, args.alert_timeout, args.report_interval,
+         args.stage_gap)
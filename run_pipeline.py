@@ -0,0 +1,323 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+MARKOV_DIR = ROOT / "markov-model"
+STATE_FILE = ROOT / ".pipeline_state.json"
+
+# markov-model/ is a directory of scripts rather than a package.
+sys.path.insert(0, str(MARKOV_DIR))
+from markov_trie import order_suffix  # noqa: E402
+from generate_logs import SEEDED_START  # noqa: E402
+from instrumentation import (RUN_REPORT, count_paths_rows, count_rows, measure,  # noqa: E402
+                             measured_call, print_stage_table, write_run_report)
+
+RAW_LOGS = ['data/raw/auth.log', 'data/raw/web_proxy.jsonl', 'data/raw/endpoint_proc.jsonl', 'data/raw/file_audit.csv']
+EVENTS = 'data/normalized/events.jsonl'
+SESSIONIZED = 'data/normalized/events_sessionized.jsonl'
+
+
+def pipeline_stages(count=20000, order=2, som_epochs=10, seed=None, users=None, shards=0, start=None):
+    """
+    Every stage with the entry point it runs and the files it reads and
+    writes, relative to the repo root. Dependencies between stages follow
+    from these declarations.
+    """
+    suffix = order_suffix(order)
+    models = f'markov-model/markov_models_by_group_{suffix}.json'
+    generate_kwargs = {'count': count, 'outdir': 'data/raw'}
+    normalize_kwargs = {}
+    if seed is not None:
+        generate_kwargs['seed'] = seed
+    if start is not None:
+        generate_kwargs['start'] = start
+    if seed is not None or start is not None:
+        # auth.log has no year, so normalize needs the one generate_logs used.
+        normalize_kwargs['syslog_year'] = (date.fromisoformat(start) if start else SEEDED_START).year
+    if users is not None:
+        generate_kwargs['users'] = users
+    if shards:
+        generate_kwargs['shards'] = shards
+    return [
+        {'name': 'generate_logs', 'module': 'generate_logs', 'func': 'main',
+         'kwargs': generate_kwargs, 'inputs': [], 'outputs': RAW_LOGS},
+        {'name': 'normalize', 'module': 'normalize', 'func': 'normalize_all_logs',
+         'kwargs': normalize_kwargs, 'inputs': RAW_LOGS, 'outputs': [EVENTS]},
+        {'name': 'sessionize', 'module': 'sessionize_events', 'func': 'main',
+         'kwargs': {}, 'inputs': [EVENTS], 'outputs': [SESSIONIZED]},
+        {'name': 'build_features', 'module': 'build_features', 'func': 'generate_hackathon_features',
+         'kwargs': {}, 'inputs': [SESSIONIZED], 'outputs': ['user_features.csv']},
+        {'name': 'assign_peer_groups', 'module': 'assign_peer_groups', 'func': 'create_peer_groups',
+         'kwargs': {'num_clusters': 4}, 'inputs': ['user_features.csv'], 'outputs': ['user_to_peer_group.json']},
+        {'name': 'build_markov_model', 'module': 'build_markov_model', 'func': 'main',
+         'kwargs': {'order': order}, 'inputs': [SESSIONIZED, 'user_to_peer_group.json'],
+         'outputs': [models, 'markov-model/action_vocab.json']},
+        {'name': 'score_sequences', 'module': 'score_sequences', 'func': 'main',
+         'kwargs': {'order': order}, 'inputs': [SESSIONIZED, 'user_to_peer_group.json', models, 'markov-model/action_vocab.json'],
+         'outputs': [f'sequence_anomalies_{suffix}.jsonl']},
+        {'name': 'som_analysis', 'module': 'som_analysis', 'func': 'run_som_analysis',
+         'kwargs': {'num_epochs': som_epochs}, 'inputs': ['user_features.csv'],
+         'outputs': ['som_results.json', 'som_u_matrix.png', 'som_model.npz']},
+        {'name': 'analysis_pipeline', 'module': 'analysis_pipeline', 'func': 'run_analysis',
+         'kwargs': {}, 'inputs': [SESSIONIZED, 'user_to_peer_group.json'], 'outputs': ['alerts.json', 'user_profiles.json']},
+    ]
+
+
+# --- Content Hashes ---
+# Digests are cached by (size, mtime) so unchanged files are not re-read.
+
+def file_digest(path, cache):
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cached = cache.get(path)
+    if cached and cached[:2] == key:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    cache[path] = key + [digest.hexdigest()]
+    return cache[path][2]
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'stages': {}, 'digests': {}}
+
+
+def save_state(state):
+    with open(STATE_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def skip_reason(stage, state, forced):
+    """Why ``stage`` can be skipped, or None if it has to run."""
+    if forced:
+        return None
+    if not all(os.path.exists(path) for path in stage['outputs']):
+        return None
+    record = state['stages'].get(stage['name'])
+    if record is None:
+        # Source stages (no inputs) are never re-run just because they were never recorded.
+        return "outputs present" if not stage['inputs'] else None
+    if record['kwargs'] != stage['kwargs']:
+        return None
+    digests = state['digests']
+    if any(record['inputs'].get(path) != file_digest(path, digests) for path in stage['inputs']):
+        return None
+    if any(record['outputs'].get(path) != file_digest(path, digests) for path in stage['outputs']):
+        return None
+    return "inputs unchanged"
+
+
+def record_stage(stage, state):
+    digests = state['digests']
+    state['stages'][stage['name']] = {
+        'kwargs': stage['kwargs'],
+        'inputs': {path: file_digest(path, digests) for path in stage['inputs']},
+        'outputs': {path: file_digest(path, digests) for path in stage['outputs']},
+    }
+
+
+def run_stage(stage, profile=False, trace_memory=False):
+    """
+    Runs one stage entry point and returns its report record. Module-level so
+    it can run in a worker process. Rows come from the stage's line-oriented
+    input files and from its result, or its output files when it returns
+    nothing.
+    """
+    os.chdir(ROOT)
+    entry_point = getattr(importlib.import_module(stage['module']), stage['func'])
+    with measure(stage['name'], count_paths_rows(stage['inputs']), profile, trace_memory) as record:
+        record['rows_out'] = count_rows(entry_point(**stage['kwargs']))
+    if record['rows_out'] is None:
+        record['rows_out'] = count_paths_rows(stage['outputs'])
+        if record['rows_per_sec'] is None and record['rows_out'] is not None and record['wall_s'] > 0:
+            record['rows_per_sec'] = record['rows_out'] / record['wall_s']
+    return record
+
+
+# --- In-Memory Mode ---
+
+def load_events(path=SESSIONIZED):
+    """The sessionized events as one typed table, shared by every in-memory stage."""
+    import pandas as pd
+    df = pd.read_json(path, lines=True, dtype={'session_id': str})
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    return df
+
+
+def run_in_memory(order=2, som_epochs=10, write_outputs=True, profile=(), trace_memory=(), report_path=RUN_REPORT):
+    """
+    Runs the stages after sessionization in this process. The sessionized
+    events are parsed once and the same table (which no stage modifies) is
+    handed to features, Markov training and scoring, and the rules; the
+    feature matrix and peer groups are passed on the same way. With
+    ``write_outputs=False`` only user profiles and the action vocabulary,
+    which are state rather than outputs, are written. ``profile`` and
+    ``trace_memory`` name the stages to capture cProfile / tracemalloc data for.
+    """
+    os.chdir(ROOT)
+    if not os.path.exists(SESSIONIZED):
+        print(f"Error: '{SESSIONIZED}' not found. Please run the pipeline up to sessionize first.")
+        return
+    import build_markov_model
+    import score_sequences
+    from analysis_pipeline import run_analysis
+    from assign_peer_groups import create_peer_groups
+    from build_features import generate_hackathon_features
+    from som_analysis import run_som_analysis
+
+    records = []
+
+    def timed(name, func, *args, rows_in=None, **kwargs):
+        print(f"[pipeline] {name}: started")
+        result, record = measured_call(name, func, *args, rows_in=rows_in,
+                                       profile=name in profile or 'all' in profile,
+                                       trace_memory=name in trace_memory or 'all' in trace_memory, **kwargs)
+        records.append(record)
+        return result
+
+    started = time.perf_counter()
+    events = timed('load_events', load_events)
+    features = timed('build_features', generate_hackathon_features, events=events, rows_in=len(events),
+                     output_path='user_features.csv' if write_outputs else None)
+    user_to_group = timed('assign_peer_groups', create_peer_groups, 4, features=features, rows_in=len(features),
+                          output_path='user_to_peer_group.json' if write_outputs else None)
+    models, vocab = timed('build_markov_model', build_markov_model.main, order, events=events, rows_in=len(events),
+                          user_to_group=user_to_group, save=write_outputs)
+    timed('score_sequences', score_sequences.main, order, events=events, models=models, vocab=vocab,
+          rows_in=len(events), user_to_group=user_to_group, write=write_outputs)
+    som_outputs = {} if write_outputs else {'results_path': None, 'model_path': None, 'output_image_path': None}
+    timed('som_analysis', run_som_analysis, num_epochs=som_epochs, features=features, rows_in=len(features), **som_outputs)
+    timed('analysis_pipeline', run_analysis, events=events, user_to_group=user_to_group, rows_in=len(events),
+          alert_sink='json' if write_outputs else None)
+    total = time.perf_counter() - started
+
+    print("\n--- In-Memory Pipeline Summary ---")
+    print_stage_table(records)
+    print(f"\nTotal {total:.2f}s wall.")
+    if report_path:
+        write_run_report('in-memory', records, total, report_path, order=order, som_epochs=som_epochs)
+        print(f"Run report saved to '{report_path}'")
+    return records
+
+
+def main(count=20000, order=2, som_epochs=10, workers=None, force=(), profile=(), trace_memory=(),
+         report_path=RUN_REPORT, seed=None, users=None, shards=0, start=None):
+    os.chdir(ROOT)
+    stages = {stage['name']: stage for stage in pipeline_stages(count, order, som_epochs, seed, users, shards, start)}
+    producers = {path: name for name, stage in stages.items() for path in stage['outputs']}
+    deps = {name: {producers[path] for path in stage['inputs'] if path in producers} for name, stage in stages.items()}
+    forced = set(stages) if 'all' in force else set(force)
+    unknown = forced - set(stages)
+    if unknown:
+        print(f"Error: unknown stage(s) {', '.join(sorted(unknown))}. Stages: {', '.join(stages)}")
+        return
+    state = load_state()
+    workers = workers or os.cpu_count() or 1
+
+    status, records = {}, {}
+    pending = list(stages)
+    running = {}
+    started = time.perf_counter()
+    print(f"Running {len(stages)} stages on up to {workers} worker(s)...")
+
+    # One fresh process per stage: stages rely on module-level state and their own pools.
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name in list(pending):
+                    if any(status.get(dep) in ('failed', 'blocked') for dep in deps[name]):
+                        status[name] = 'blocked'
+                    elif all(status.get(dep) in ('ran', 'skipped') for dep in deps[name]):
+                        stage = stages[name]
+                        reason = skip_reason(stage, state, name in forced)
+                        if reason:
+                            status[name] = 'skipped'
+                            print(f"[pipeline] {name}: skipped ({reason})")
+                            if state['stages'].get(name) is None:
+                                record_stage(stage, state)
+                        else:
+                            print(f"[pipeline] {name}: started")
+                            running[pool.submit(run_stage, stage, name in profile or 'all' in profile,
+                                                name in trace_memory or 'all' in trace_memory)] = name
+                    else:
+                        continue
+                    pending.remove(name)
+                    progressed = True
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stage = stages[name]
+                try:
+                    records[name] = future.result()
+                except Exception as e:
+                    print(f"[pipeline] {name}: failed ({e!r})")
+                    status[name] = 'failed'
+                    continue
+                missing = [path for path in stage['outputs'] if not os.path.exists(path)]
+                if missing:
+                    print(f"[pipeline] {name}: failed (did not write {', '.join(missing)})")
+                    status[name] = 'failed'
+                    continue
+                status[name] = 'ran'
+                record_stage(stage, state)
+                save_state(state)
+                print(f"[pipeline] {name}: done in {records[name]['wall_s']:.1f}s")
+
+    save_state(state)
+    total = time.perf_counter() - started
+
+    report = [dict(records.get(name, {'stage': name}), status=status.get(name, 'blocked')) for name in stages]
+    print("\n--- Pipeline Summary ---")
+    print_stage_table(report, status)
+    stage_total = sum(record['wall_s'] for record in records.values())
+    print(f"\nTotal {total:.2f}s wall for {stage_total:.2f}s of stage time.")
+    if report_path:
+        write_run_report('dag', report, total, report_path, count=count, order=order, som_epochs=som_epochs,
+                         workers=workers, seed=seed, users=users, shards=shards, start=start)
+        print(f"Run report saved to '{report_path}'")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the UEBA pipeline stages, skipping those whose inputs are unchanged.")
+    parser.add_argument("--count", type=int, default=20000, help="Approximate number of normal events for generate_logs.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for generate_logs.")
+    parser.add_argument("--users", type=int, default=None, help="Number of users for generate_logs (default: its own).")
+    parser.add_argument("--start", default=None, help="Start date of the generated 30-day window, YYYY-MM-DD (default: generate_logs' own).")
+    parser.add_argument("--shards", type=int, default=0, help="Generate logs in this many shards with a process pool (0: single process).")
+    parser.add_argument("--order", type=int, default=2, help="Markov model order.")
+    parser.add_argument("--som-epochs", type=int, default=10, help="SOM training epochs.")
+    parser.add_argument("--workers", type=int, default=None, help="Stages run concurrently (default: all cores).")
+    parser.add_argument("--force", nargs='*', default=[], help="Stages to re-run regardless of their inputs ('all' for every stage).")
+    parser.add_argument("--in-memory", action="store_true", help="Run the stages after sessionize in one process on a single loaded event table.")
+    parser.add_argument("--no-outputs", action="store_true", help="With --in-memory, skip writing the per-stage output files.")
+    parser.add_argument("--profile", nargs='*', default=[], help="Stages to run under cProfile ('all' for every stage); dumps go to profiles/.")
+    parser.add_argument("--trace-memory", nargs='*', default=[], help="Stages to run under tracemalloc ('all' for every stage).")
+    parser.add_argument("--report", default=RUN_REPORT, help="Where to write the JSON run report.")
+    args = parser.parse_args()
+    if args.in_memory:
+        run_in_memory(args.order, args.som_epochs, write_outputs=not args.no_outputs,
+                      profile=args.profile, trace_memory=args.trace_memory, report_path=args.report)
+    else:
+        main(args.count, args.order, args.som_epochs, args.workers, args.force,
+             profile=args.profile, trace_memory=args.trace_memory, report_path=args.report,
+             seed=args.seed, users=args.users, shards=args.shards, start=args.start)
@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import math
+import numpy as np
+
+
+def hash_positions(values, num_hashes, size):
+    """
+    ``num_hashes`` positions in [0, size) for every value, by double hashing
+    (h1 + i * h2) over a 128-bit blake2b digest. Unlike hash(), this is
+    stable across processes, so persisted sketches stay valid.
+    """
+    digests = b''.join(hashlib.blake2b(str(v).encode(), digest_size=16).digest() for v in values)
+    h = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+    i = np.arange(num_hashes, dtype=np.uint64)
+    return ((h[:, :1] + i * h[:, 1:2]) % np.uint64(size)).astype(np.int64)
+
+
+class BloomFilter:
+    """
+    Fixed-size "seen before" set sized for ``capacity`` items at the given
+    false-positive rate (past capacity, the FP rate climbs). ``count`` is the
+    number of values added, which ScalableBloomFilter uses to tell when it
+    is full.
+    """
+
+    def __init__(self, capacity=1000, fp_rate=0.01, bits=None, count=0):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.count = count
+        self.num_bits = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8) if bits is None else bits
+
+    def positions(self, values):
+        return hash_positions(values, self.num_hashes, self.num_bits)
+
+    def test_bits(self, positions):
+        return ((self.bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1) == 1
+
+    def set_bits(self, positions):
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def add(self, value):
+        self.set_bits(self.positions([value])[0])
+        self.count += 1
+
+    def __contains__(self, value):
+        return bool(self.test_bits(self.positions([value])[0]).all())
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'fp_rate': self.fp_rate, 'count': self.count,
+                'bits': base64.b64encode(self.bits.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        bits = np.frombuffer(base64.b64decode(data['bits']), dtype=np.uint8).copy()
+        # Filters saved without a count are treated as full.
+        return cls(data['capacity'], data['fp_rate'], bits, data.get('count', data['capacity']))
+
+
+class ScalableBloomFilter:
+    """
+    A "seen before" set that grows with what it holds (Almeida et al.'s
+    scalable Bloom filter). Values go into the newest layer; once it is
+    full a layer of GROWTH times the capacity is added at TIGHTENING times
+    the FP rate, so memory follows the number of distinct values and the
+    combined FP rate stays under ``fp_rate``. Layers stop being added once
+    another would take the total capacity past ``max_capacity``; the newest
+    layer then keeps taking values and the FP rate climbs instead, so memory
+    per entity stays capped.
+    """
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, initial_capacity=16, fp_rate=0.01, layers=None, max_capacity=None):
+        self.initial_capacity = initial_capacity
+        self.fp_rate = fp_rate
+        self.max_capacity = max_capacity
+        self.layers = layers or []
+
+    @property
+    def capacity(self):
+        return sum(layer.capacity for layer in self.layers)
+
+    def can_grow(self):
+        """Whether another layer fits under max_capacity (there is always a first one)."""
+        if not self.layers or self.max_capacity is None:
+            return True
+        return self.capacity + self.layers[-1].capacity * self.GROWTH <= self.max_capacity
+
+    def needs_layer(self):
+        return not self.layers or (self.layers[-1].full and self.can_grow())
+
+    def add_layer(self):
+        if self.layers:
+            last = self.layers[-1]
+            layer = BloomFilter(last.capacity * self.GROWTH, last.fp_rate * self.TIGHTENING)
+        else:
+            layer = BloomFilter(self.initial_capacity, self.fp_rate * (1 - self.TIGHTENING))
+        self.layers.append(layer)
+        return layer
+
+    def current_layer(self):
+        """The layer new values go into, adding one if the newest is full and the cap allows."""
+        return self.add_layer() if self.needs_layer() else self.layers[-1]
+
+    def add(self, value):
+        if value not in self:
+            self.current_layer().add(value)
+
+    def __contains__(self, value):
+        return any(value in layer for layer in self.layers)
+
+    @property
+    def nbytes(self):
+        return sum(layer.nbytes for layer in self.layers)
+
+    def to_dict(self):
+        return {'initial_capacity': self.initial_capacity, 'fp_rate': self.fp_rate,
+                'layers': [layer.to_dict() for layer in self.layers]}
+
+    @classmethod
+    def from_dict(cls, data, initial_capacity=16, fp_rate=0.01, max_capacity=None):
+        """
+        Restores a filter saved with to_dict, or returns an empty one if
+        ``data`` is None. The cap is a setting rather than part of the
+        saved filter, so raising it lets full filters grow again.
+        """
+        if data is None:
+            return cls(initial_capacity, fp_rate, max_capacity=max_capacity)
+        if 'layers' not in data:
+            # A single fixed-size filter from before baselines could grow.
+            return cls(data['capacity'], data['fp_rate'], [BloomFilter.from_dict(data)], max_capacity)
+        return cls(data['initial_capacity'], data['fp_rate'],
+                   [BloomFilter.from_dict(layer) for layer in data['layers']], max_capacity)
+
+
+class CountMinSketch:
+    """
+    Approximate per-value counts in ``depth`` x ``width`` counters, a fixed
+    size however many values are added. Estimates never undercount, and a
+    value whose estimate is 0 has never been added. for_capacity sizes it so
+    that, with ``capacity`` distinct values in, an estimate exceeds the true
+    count by more than total/capacity with probability at most ``fp_rate``.
+    """
+
+    def __init__(self, width, depth, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int32) if table is None else table
+
+    @classmethod
+    def for_capacity(cls, capacity=1000, fp_rate=0.01):
+        return cls(math.ceil(math.e * capacity), max(1, math.ceil(math.log(1 / fp_rate))))
+
+    def cells(self, values):
+        return hash_positions(values, self.depth, self.width)
+
+    def add_cells(self, cells, counts=1):
+        for d in range(self.depth):
+            np.add.at(self.table[d], cells[:, d], counts)
+
+    def add(self, values, counts=1):
+        self.add_cells(self.cells(values), counts)
+
+    def estimate(self, values):
+        cells = self.cells(values)
+        return np.min([self.table[d, cells[:, d]] for d in range(self.depth)], axis=0)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth,
+                'table': base64.b64encode(self.table.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        table = np.frombuffer(base64.b64decode(data['table']), dtype=np.int32).reshape(data['depth'], data['width']).copy()
+        return cls(data['width'], data['depth'], table)
@@ -1,25 +1,72 @@
+import argparse
+import os
 import pandas as pd
 import numpy as np
 from minisom import MiniSom
+from batch_som import BMU_INDEX_TYPES, BatchSOM, bmu_indices, build_bmu_index, quantization_errors
+from som_model import SOM_MODEL_PATH, save_som_model
 import matplotlib.pyplot as plt
 from pathlib import Path
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import json
 
-def run_som_analysis(user_features_path='user_features.csv', output_image_path='som_u_matrix.png'):
+def epoch_seeds(seed, num_epochs):
+    """Independent, reproducible per-epoch seeds derived from one base seed."""
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(num_epochs)]
 
-    print(f"Starting Advanced SOM analysis from '{user_features_path}'...")
+def train_epoch(data, map_x, map_y, seed, iterations, trainer='minisom', batch_size=None, bmu_index=None):
+    """
+    Trains one SOM and returns (outlier row indices, U-matrix, codebook,
+    quantization errors, error threshold). Module-level so it can run in a
+    worker process.
+    """
+    if trainer == 'batch':
+        som = BatchSOM(map_x, map_y, data.shape[1], sigma=1.5, random_seed=seed, bmu_index=bmu_index)
+        som.random_weights_init(data)
+        som.train_batch(data, iterations, batch_size=batch_size)
+    else:
+        som = MiniSom(map_x, map_y, data.shape[1],
+                      sigma=1.5, learning_rate=0.5,
+                      random_seed=seed)
 
-    input_file = Path(user_features_path)
-    if not input_file.exists():
-        print(f"Error: {user_features_path} not found. Please run build_features.py first.")
-        return
+        som.random_weights_init(data)
+        som.train_random(data, iterations, verbose=False)
+
+    codebook = som.get_weights().reshape(-1, data.shape[1])
+    q_errors = quantization_errors(data, codebook, index=build_bmu_index(codebook, bmu_index))
+
+    error_threshold = np.percentile(q_errors, 95)
+
+    outlier_indices = np.where(q_errors > error_threshold)[0]
+    return outlier_indices, som.distance_map(), som.get_weights(), q_errors, error_threshold
+
+def run_som_analysis(user_features_path='user_features.csv', output_image_path='som_u_matrix.png',
+                     results_path='som_results.json', model_path=SOM_MODEL_PATH, num_epochs=10, seed=42, workers=None,
+                     trainer='minisom', batch_iterations=100, batch_size=None, bmu_index=None, features=None):
+    """
+    ``features`` is a feature matrix indexed by user_id (as returned by
+    build_features) to use instead of reading ``user_features_path``. Any of
+    the output paths can be None to skip that file. Returns the consensus
+    outliers.
+    """
+    if features is not None:
+        print("Starting Advanced SOM analysis from the in-memory feature matrix...")
+        user_features_df = features
+    else:
+        print(f"Starting Advanced SOM analysis from '{user_features_path}'...")
+
+        input_file = Path(user_features_path)
+        if not input_file.exists():
+            print(f"Error: {user_features_path} not found. Please run build_features.py first.")
+            return
+
+        user_features_df = pd.read_csv(input_file, index_col='user_id')
 
-    user_features_df = pd.read_csv(input_file, index_col='user_id')
-    
     feature_cols = [col for col in user_features_df.columns if not col.endswith('_score')]
     data = user_features_df[feature_cols].values.astype(float)
-    
+
     print(f"Loaded feature matrix for {data.shape[0]} users with {data.shape[1]} features each.")
 
     if len(np.unique(data, axis=0)) == 1:
@@ -27,58 +74,97 @@ def run_som_analysis(user_features_path='user_features.csv', output_image_path='
         print("The SOM cannot find outliers if there is no variation in the data.")
         return
 
-    num_epochs = 10
     all_outliers = []
-    
-    print(f"\nRunning {num_epochs} independent training epochs to find consistent outliers...")
+    workers = min(workers or os.cpu_count() or 1, num_epochs)
+
+    print(f"\nRunning {num_epochs} independent training epochs on {workers} worker(s) to find consistent outliers...")
 
     num_users = data.shape[0]
     map_size = int(np.ceil(np.sqrt(5 * np.sqrt(num_users))))
     map_x, map_y = map_size, map_size
     print(f"Dynamically set map size to {map_x}x{map_y} for {num_users} users.")
 
-    for epoch in range(num_epochs):
-        print(f"\r--- Epoch {epoch + 1}/{num_epochs} ---", end="")
-        
-        som = MiniSom(map_x, map_y, data.shape[1],
-                      sigma=1.5, learning_rate=0.5,
-                      random_seed=np.random.randint(1000))
-
-        som.random_weights_init(data)
-        
+    if trainer == 'batch':
+        # Each batch iteration already visits every user (or a minibatch of them).
+        iterations = batch_iterations
+        print(f"Using the batch SOM trainer with {iterations} iterations per epoch.")
+    else:
         iterations = max(500, num_users * 5)
-        som.train_random(data, iterations, verbose=False)
-        
-        
-        q_errors = np.linalg.norm(som.quantization(data) - data, axis=1)
+    train = partial(train_epoch, data, map_x, map_y, iterations=iterations, trainer=trainer,
+                    batch_size=batch_size, bmu_index=bmu_index)
+    seeds = epoch_seeds(seed, num_epochs)
 
+    # Epochs share nothing, so they run in parallel. Results come back in epoch
+    # order and every epoch has a fixed seed, so the outcome does not depend
+    # on the number of workers.
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            epoch_results = list(pool.map(train, seeds))
+    else:
+        epoch_results = list(map(train, seeds))
 
-        error_threshold = np.percentile(q_errors, 95)
-        
-        outlier_indices = np.where(q_errors > error_threshold)[0]
-        
+    for outlier_indices, *_ in epoch_results:
         for idx in outlier_indices:
             all_outliers.append(user_features_df.index[idx])
-    
+    _, u_matrix, codebook, q_errors, error_threshold = epoch_results[-1]
+
     print("\n--- Multi-Epoch Analysis Complete ---")
 
     if not all_outliers:
         print("No significant outliers were found across any of the training epochs.")
 
-    with open(results_path, 'w') as f:
-        json.dump(sorted_outliers, f, indent=2)
-    print(f"\n SOM analysis results saved to '{results_path}'")
-        
-    plt.figure(figsize=(12, 12))
-    plt.pcolor(som.distance_map().T, cmap='viridis')
-    plt.colorbar(label='Inter-neuron Distance')
-    plt.title(f'SOM U-Matrix (from last epoch, epoch {num_epochs})')
-    plt.xlabel('SOM X-coordinate')
-    plt.ylabel('SOM Y-coordinate')
-    plt.savefig(output_image_path)
-    print(f" U-matrix visualization from the last epoch saved to '{output_image_path}'")
-    plt.close()
+    # Keep users flagged in a majority of epochs.
+    outlier_counts = Counter(all_outliers)
+    min_flagged = num_epochs // 2 + 1
+    sorted_outliers = [
+        {
+            "user_id": user_id,
+            "flagged_epochs": count,
+            "total_epochs": num_epochs,
+            "attack_score": int(user_features_df.loc[user_id].get('attack_score', 0)),
+            "benign_score": int(user_features_df.loc[user_id].get('benign_score', 0)),
+        }
+        for user_id, count in outlier_counts.items() if count >= min_flagged
+    ]
+    sorted_outliers.sort(key=lambda r: (-r['flagged_epochs'], -r['attack_score'], -r['benign_score'], r['user_id']))
+    print(f"Found {len(sorted_outliers)} users flagged in at least {min_flagged}/{num_epochs} epochs.")
 
-if __name__ == "__main__":
-    run_som_analysis()
+    if results_path is not None:
+        with open(results_path, 'w') as f:
+            json.dump(sorted_outliers, f, indent=2)
+        print(f"\n SOM analysis results saved to '{results_path}'")
 
+    # Keep the last epoch's map so new users can be projected without retraining.
+    if model_path is not None:
+        flat_codebook = codebook.reshape(-1, codebook.shape[2])
+        bmus = bmu_indices(data, flat_codebook, index=build_bmu_index(flat_codebook, bmu_index))
+        bmu_coords = np.column_stack(np.unravel_index(bmus, (map_x, map_y)))
+        save_som_model(model_path, codebook, u_matrix, user_features_df.index, feature_cols,
+                       bmu_coords, q_errors, error_threshold)
+        print(f" SOM codebook and user projections saved to '{model_path}'")
+
+    if output_image_path is not None:
+        plt.figure(figsize=(12, 12))
+        plt.pcolor(u_matrix.T, cmap='viridis')
+        plt.colorbar(label='Inter-neuron Distance')
+        plt.title(f'SOM U-Matrix (from last epoch, epoch {num_epochs})')
+        plt.xlabel('SOM X-coordinate')
+        plt.ylabel('SOM Y-coordinate')
+        plt.savefig(output_image_path)
+        print(f" U-matrix visualization from the last epoch saved to '{output_image_path}'")
+        plt.close()
+    return sorted_outliers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-epoch SOM outlier analysis over the user feature matrix.")
+    parser.add_argument("--epochs", type=int, default=10, help="Number of independent SOM training runs.")
+    parser.add_argument("--seed", type=int, default=42, help="Base seed; each epoch derives its own seed from it.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores).")
+    parser.add_argument("--trainer", choices=["minisom", "batch"], default="minisom", help="Per-sample MiniSom training or the vectorized batch SOM.")
+    parser.add_argument("--batch-iterations", type=int, default=100, help="Iterations per epoch for the batch trainer.")
+    parser.add_argument("--batch-size", type=int, default=None, help="Minibatch size for the batch trainer (default: all users).")
+    parser.add_argument("--bmu-index", choices=BMU_INDEX_TYPES, default=None, help="Spatial index over the codebook for BMU search (default: brute force).")
+    args = parser.parse_args()
+    run_som_analysis(num_epochs=args.epochs, seed=args.seed, workers=args.workers,
+                     trainer=args.trainer, batch_iterations=args.batch_iterations, batch_size=args.batch_size,
+                     bmu_index=args.bmu_index)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from batch_som import bmu_indices, build_bmu_index
+
+SOM_MODEL_PATH = 'som_model.npz'
+
+
+def save_som_model(path, codebook, u_matrix, user_ids, feature_cols, bmu_coords, q_errors, error_threshold):
+    """Writes the trained map and every user's projection onto it as one compressed .npz."""
+    np.savez_compressed(
+        path,
+        codebook=codebook.astype(np.float32),
+        u_matrix=u_matrix.astype(np.float32),
+        user_ids=np.asarray(user_ids, dtype=str),
+        feature_cols=np.asarray(feature_cols, dtype=str),
+        bmu=np.asarray(bmu_coords, dtype=np.int32),
+        q_error=np.asarray(q_errors, dtype=np.float32),
+        error_threshold=np.float32(error_threshold),
+    )
+
+
+def load_som_model(path=SOM_MODEL_PATH):
+    with np.load(path) as f:
+        return {key: f[key] for key in f.files}
+
+
+def project(users, model=None, model_path=SOM_MODEL_PATH, bmu_index=None):
+    """
+    Maps users onto a stored SOM without retraining.
+
+    ``users`` is a feature DataFrame indexed by user_id (e.g. rows of
+    user_features.csv); extra columns are ignored. Returns a DataFrame with
+    each user's BMU coordinates, quantization error and whether that error
+    is above the outlier threshold the map was trained with. ``bmu_index``
+    ('kdtree' or 'balltree') speeds up lookups on large maps.
+    """
+    if model is None:
+        model = load_som_model(model_path)
+    codebook = model['codebook'].astype(float)
+    map_x, map_y, dim = codebook.shape
+    data = users[list(model['feature_cols'])].to_numpy(dtype=float)
+
+    flat = codebook.reshape(-1, dim)
+    bmus = bmu_indices(data, flat, index=build_bmu_index(flat, bmu_index))
+    q_errors = np.linalg.norm(flat[bmus] - data, axis=1)
+    bmu_x, bmu_y = np.unravel_index(bmus, (map_x, map_y))
+
+    return pd.DataFrame({
+        'bmu_x': bmu_x,
+        'bmu_y': bmu_y,
+        'q_error': q_errors,
+        'is_outlier': q_errors > float(model['error_threshold']),
+    }, index=users.index)
@@ -0,0 +1,614 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import sys
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from alert_store import ALERT_SINK_PATHS, ALERT_SINK_TYPES, open_alert_sink
+from analysis_pipeline import ALERT_WEIGHTS, get_or_create_profile, load_profiles, save_profiles
+from profile_store import PROFILE_SQLITE_DB, SQLiteProfileStore
+
+# markov-model/ is a directory of scripts rather than a package.
+MARKOV_DIR = Path(__file__).resolve().parent / "markov-model"
+sys.path.insert(0, str(MARKOV_DIR))
+from action_encoding import event_action, load_vocab  # noqa: E402
+from markov_trie import load_models, model_version, order_suffix  # noqa: E402
+
+SESSION_GAP_SECONDS = 1800  # same gap as sessionize_events.py
+ALLOWED_LATENESS_SECONDS = 300
+CHECKPOINT_PATH = 'stream_checkpoint.bin'
+CHECKPOINT_VERSION = 3
+
+
+def _present(value):
+    return value is not None and value == value
+
+
+class SessionTracker:
+    """
+    The open session of each user, least recently active first. A session
+    ends once its user has been idle for longer than the sessionization gap;
+    evict_idle drops those from the front, so memory follows the number of
+    concurrently active users rather than every session ever seen.
+    ``max_sessions`` additionally caps the tracker, evicting the least
+    recently active session when full.
+
+    Events only need to be in time order per user. Across users they may
+    arrive up to ``allowed_lateness_seconds`` late, so idleness is measured
+    against a watermark (the newest event time seen, minus that lateness)
+    rather than against the newest event itself.
+    """
+
+    def __init__(self, gap_seconds=SESSION_GAP_SECONDS, max_sessions=None,
+                 allowed_lateness_seconds=ALLOWED_LATENESS_SECONDS):
+        self.gap = timedelta(seconds=gap_seconds)
+        self.max_sessions = max_sessions
+        self.lateness = timedelta(seconds=allowed_lateness_seconds)
+        self.newest = None
+        self.sessions = OrderedDict()
+        self.started = 0
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def touch(self, user_id, ts):
+        """The user's session for an event at ``ts``, starting a new one after an idle gap."""
+        session = self.sessions.get(user_id)
+        if session is None or ts - session['last_ts'] > self.gap:
+            session = {
+                'session_id': f"{user_id}:{ts.isoformat()}", 'last_ts': ts, 'state': None,
+                'history': [], 'cost': 0.0, 'transitions': 0, 'flagged': False,
+            }
+            self.sessions[user_id] = session
+            self.started += 1
+            if self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.capacity_evictions += 1
+        self.sessions.move_to_end(user_id)
+        session['last_ts'] = ts
+        return session
+
+    def evict_idle(self, now):
+        """
+        Drops sessions whose own last event is more than the gap before the
+        watermark, once an event at ``now`` has been seen. Returns how many.
+        Any event for such a user that is at most the allowed lateness behind
+        would start a new session anyway, so nothing still open is lost.
+        Sessions stay in activity order, so one behind a still-open session
+        is dropped at the latest one lateness window later.
+        """
+        if self.newest is None or now > self.newest:
+            self.newest = now
+        cutoff = self.newest - self.lateness - self.gap
+        evicted = 0
+        while self.sessions:
+            user_id, session = next(iter(self.sessions.items()))
+            if session['last_ts'] >= cutoff:
+                break
+            del self.sessions[user_id]
+            evicted += 1
+        self.idle_evictions += evicted
+        return evicted
+
+    def counters(self):
+        return {'live': len(self.sessions), 'started': self.started,
+                'idle_evictions': self.idle_evictions, 'capacity_evictions': self.capacity_evictions}
+
+
+class StreamingDetector:
+    """
+    The analysis_pipeline rules, plus per-session Markov scoring, applied one
+    event at a time. Events must arrive in time order per user; across users
+    they may be out of order by up to ``allowed_lateness_seconds``.
+
+    State: ``profiles`` (dict or SQLiteProfileStore), ``group_hosts`` (hosts
+    seen per peer group), ``session_tracker`` (open session per user, with
+    the last login state and the Markov context/running cost), and the known
+    IP/host sets mirroring each profile's lists for O(1) lookups.
+    """
+
+    def __init__(self, profiles, user_to_group, models=None, vocab=None, order=2,
+                 markov_threshold=None, min_transitions=3, max_sessions=None,
+                 allowed_lateness_seconds=ALLOWED_LATENESS_SECONDS):
+        self.profiles = profiles
+        self.user_to_group = user_to_group
+        self.models = models or {}
+        self.codes = {action: i for i, action in enumerate(vocab or [])}
+        self.order = order
+        self.markov_threshold = markov_threshold
+        self.min_transitions = min_transitions
+        self.group_hosts = {}
+        self.session_tracker = SessionTracker(max_sessions=max_sessions,
+                                              allowed_lateness_seconds=allowed_lateness_seconds)
+        self.known = {}
+
+    def _known_sets(self, user_id, profile):
+        if user_id not in self.known:
+            self.known[user_id] = {key: set(profile[key]) for key in ('known_ips', 'known_hosts')}
+        return self.known[user_id]
+
+    def process(self, event):
+        """Applies every rule to one event and returns the alerts it raised."""
+        user_id = event.get('user_id')
+        if not _present(user_id) or not event.get('timestamp'):
+            return []
+        ts = datetime.fromisoformat(event['timestamp'])
+        timestamp = ts.isoformat()
+        profile = get_or_create_profile(self.profiles, user_id)
+        known = self._known_sets(user_id, profile)
+        alerts = []
+
+        def alert(alert_type, details):
+            alerts.append({"alert_type": alert_type, "user_id": user_id, "details": details, "timestamp": timestamp})
+
+        # Rules 1 & 2: first time the user is seen with this IP / host.
+        for column, known_key, alert_type, prefix in (('src_ip', 'known_ips', "New IP", "New IP "),
+                                                       ('host', 'known_hosts', "New Host", "Accessed new host ")):
+            value = event.get(column)
+            if _present(value) and value not in known[known_key]:
+                known[known_key].add(value)
+                profile[known_key].append(value)
+                alert(alert_type, f"{prefix}{value}")
+
+        # Rule 3: a host new to the whole peer group, once the group knows more than 5 hosts.
+        group = self.user_to_group.get(user_id)
+        host = event.get('host')
+        if group is not None and _present(host):
+            hosts = self.group_hosts.setdefault(group, set())
+            if host not in hosts:
+                if len(hosts) > 5:
+                    alert("Peer Group Deviation", f"Accessed unusual host '{host}' for peer group {int(group)}.")
+                hosts.add(host)
+
+        # Rule 4: a successful login right after a failed one within the same session.
+        self.session_tracker.evict_idle(ts)
+        session = self.session_tracker.touch(user_id, ts)
+        action, status = event.get('action'), event.get('status')
+        if _present(action):
+            if session['state'] == 'login_failure' and action == 'login' and status == 'success':
+                alert("Suspicious Sequence", "Successful login followed a failed login in the same session.")
+            session['state'] = f"{action}_{status if _present(status) else 'nan'}"
+
+        # Markov: running mean transition cost of the session under the peer-group model.
+        model = self.models.get(str(int(group))) if group is not None else None
+        if model is not None:
+            code = self.codes.get(event_action(event), -1)
+            if session['history']:
+                session['cost'] += model.cost(session['history'], code)
+                session['transitions'] += 1
+                score = session['cost'] / session['transitions']
+                if (self.markov_threshold is not None and not session['flagged']
+                        and session['transitions'] >= self.min_transitions and score >= self.markov_threshold):
+                    session['flagged'] = True
+                    alert("Anomalous Sequence", f"Session action sequence scored {score:.3f} under the peer group {int(group)} model.")
+            session['history'] = (session['history'] + [code])[-self.order:]
+
+        for a in alerts:
+            profile['risk_score'] += ALERT_WEIGHTS[a['alert_type']]
+        profile['last_seen'] = timestamp
+        return alerts
+
+    def state(self):
+        """
+        Everything needed to resume. Profiles are included when they are an
+        in-memory dict; a SQLiteProfileStore is flushed before checkpointing
+        and reloads lazily. The known-entity sets are rebuilt from profiles.
+        """
+        return {
+            'group_hosts': self.group_hosts,
+            'session_tracker': self.session_tracker,
+            'profiles': self.profiles if isinstance(self.profiles, dict) else None,
+        }
+
+    def restore(self, state):
+        self.group_hosts = state['group_hosts']
+        # Open sessions come from the checkpoint; the limits from this run's settings.
+        tracker = state['session_tracker']
+        tracker.max_sessions, tracker.lateness = self.session_tracker.max_sessions, self.session_tracker.lateness
+        self.session_tracker = tracker
+        if state['profiles'] is not None and isinstance(self.profiles, dict):
+            self.profiles.clear()
+            self.profiles.update(state['profiles'])
+        self.known = {}
+
+
+# --- Checkpoints ---
+# A checkpoint is a zlib-compressed pickle of the detector state and the byte
+# offset of the next unread input line. It is written to a temporary file and
+# renamed into place, so a crash mid-write leaves the previous one intact.
+
+def save_checkpoint(path, detector, source_path, offset, model_version=None):
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'source_path': str(source_path) if source_path else None,
+        'offset': offset,
+        'model_version': model_version,
+        'saved_at': datetime.now().isoformat(),
+        **detector.state(),
+    }
+    data = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def emitted_path(checkpoint_path):
+    return f"{checkpoint_path}.emitted"
+
+
+def save_emitted(path, source_path, offset):
+    """Records that alerts for every input line ending at or before ``offset`` are in the sink."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'source_path': str(source_path), 'offset': offset}, f)
+    os.replace(tmp_path, path)
+
+
+def load_emitted(path, source_path):
+    """The offset saved by save_emitted for ``source_path``, or 0."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+    return data['offset'] if data.get('source_path') == str(source_path) else 0
+
+
+def load_checkpoint(path):
+    """The saved state, or None if there is no usable checkpoint at ``path``."""
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    if state.get('version') != CHECKPOINT_VERSION:
+        print(f"Warning: '{path}' is from an incompatible version. Starting from scratch.")
+        return None
+    return state
+
+
+class LatencyStats:
+    """Event-to-alert latencies over a sliding window, plus throughput counters."""
+
+    def __init__(self, window=100000):
+        self.latencies = deque(maxlen=window)
+        self.events = 0
+        self.alerts = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    def record(self, received, num_alerts):
+        self.events += 1
+        if num_alerts:
+            self.alerts += num_alerts
+            self.latencies.extend([time.perf_counter() - received] * num_alerts)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        line = f"{self.events} events ({self.events / max(elapsed, 1e-9):.0f}/s), {self.alerts} alerts"
+        if self.skipped:
+            line += f", {self.skipped} skipped"
+        if self.latencies:
+            p50, p99 = np.percentile(np.fromiter(self.latencies, dtype=float), [50, 99]) * 1000
+            line += f", event-to-alert p50 {p50:.2f}ms p99 {p99:.2f}ms"
+        return line
+
+
+# --- Event Sources ---
+# Each puts (receive time, line or event, offset) on a bounded queue. A full
+# queue suspends the source: the file tail stops reading and the socket stops
+# draining its connections, so TCP pushes back on the sender.
+
+async def tail_file(path, queue, follow=False, poll_interval=0.2, offset=0):
+    """Streams lines appended to ``path`` from byte ``offset``. Without ``follow``, stops at end of file."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        partial = b''
+        while True:
+            line = f.readline()
+            if line.endswith(b'\n'):
+                await queue.put((time.perf_counter(), partial + line, f.tell()))
+                partial = b''
+            else:
+                partial += line
+                if not follow:
+                    break
+                await asyncio.sleep(poll_interval)
+
+
+async def serve_socket(queue, host='127.0.0.1', port=9514):
+    """Accepts JSON lines from any number of local TCP clients."""
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            await queue.put((time.perf_counter(), line, None))
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Listening for events on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def feed_events(queue, events):
+    """Queues already-normalized events from an iterator, such as generate_logs.stream_events."""
+    for event in events:
+        await queue.put((time.perf_counter(), event, None))
+
+
+# --- Engine ---
+
+class StreamEngine:
+    """
+    Runs a source, the detector and a periodic flush of alerts and profiles.
+
+    With a ``checkpoint_path``, profiles are only flushed together with a
+    checkpoint, so the profile store never runs ahead of the saved offset.
+    Alerts are flushed sooner, so for a file source every flush also records
+    the offset they cover (save_emitted). Events after the last checkpoint
+    are replayed on restart to rebuild the state, but alerts from lines at
+    or before ``emitted_offset`` are dropped rather than appended again.
+    """
+
+    def __init__(self, detector, sink, flush_profiles, queue_size=10000, flush_interval=1.0,
+                 report_interval=10.0, yield_every=256, checkpoint_path=None, checkpoint_interval=60.0,
+                 source_path=None, offset=0, model_version=None, emitted_offset=0):
+        self.detector = detector
+        self.sink = sink
+        self.flush_profiles = flush_profiles
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.yield_every = yield_every
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.source_path = source_path
+        self.model_version = model_version
+        self.stats = LatencyStats()
+        self.pending_alerts = []
+        self.offset = offset
+        self.emitted_offset = emitted_offset
+        self.replayed_alerts = 0
+
+    async def consume(self):
+        while True:
+            received, line, offset = await self.queue.get()
+            if line is None:
+                break
+            try:
+                if isinstance(line, dict):
+                    alerts = self.detector.process(line)
+                else:
+                    line = line.strip()
+                    alerts = self.detector.process(json.loads(line)) if line else []
+            except Exception as e:
+                # One malformed event must not stop the consumer and leave the source blocked on a full queue.
+                self.stats.skipped += 1
+                where = f" ending at byte {offset}" if offset is not None else ""
+                print(f"[stream] skipped an event{where}: {e!r}")
+                alerts = []
+            if alerts and offset is not None and offset <= self.emitted_offset:
+                self.replayed_alerts += len(alerts)
+                alerts = []
+            self.pending_alerts.extend(alerts)
+            self.stats.record(received, len(alerts))
+            if offset is not None:
+                self.offset = offset
+            # get() on a non-empty queue never suspends; let the flusher and sources run.
+            if self.stats.events % self.yield_every == 0:
+                await asyncio.sleep(0)
+
+    def flush(self, profiles=True):
+        emitted = bool(self.pending_alerts)
+        if self.pending_alerts:
+            self.sink.append(self.pending_alerts)
+            self.pending_alerts = []
+        self.sink.flush()
+        if emitted and self.checkpoint_path and self.source_path and self.offset > self.emitted_offset:
+            save_emitted(emitted_path(self.checkpoint_path), self.source_path, self.offset)
+            self.emitted_offset = self.offset
+        if profiles:
+            self.flush_profiles()
+
+    def checkpoint(self):
+        # Runs between two events, so the state and offset always agree.
+        self.flush()
+        size = save_checkpoint(self.checkpoint_path, self.detector, self.source_path, self.offset, self.model_version)
+        return size
+
+    async def flush_periodically(self):
+        last_report = last_checkpoint = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self.checkpoint_path and time.perf_counter() - last_checkpoint >= self.checkpoint_interval:
+                size = self.checkpoint()
+                print(f"[stream] checkpoint at offset {self.offset} ({size / 1024:.0f} KB)")
+                last_checkpoint = time.perf_counter()
+            else:
+                self.flush(profiles=not self.checkpoint_path)
+            if time.perf_counter() - last_report >= self.report_interval:
+                sessions = self.detector.session_tracker.counters()
+                print(f"[stream] {self.stats.summary()}, queue depth {self.queue.qsize()}, "
+                      f"{sessions['live']} live sessions, {sessions['idle_evictions']} expired")
+                last_report = time.perf_counter()
+
+    async def run(self, source):
+        """
+        Runs until the source is exhausted and its events are processed. If
+        the consumer or the flusher stops first, the source is cancelled and
+        the error re-raised rather than leaving the source blocked on a full
+        queue; no checkpoint is written then, so a restart resumes from the
+        last good one.
+        """
+        source = asyncio.ensure_future(source)
+        consumer = asyncio.create_task(self.consume())
+        flusher = asyncio.create_task(self.flush_periodically())
+        tasks = [source, consumer, flusher]
+        failed = False
+        try:
+            done, _ = await asyncio.wait({source, consumer, flusher}, return_when=asyncio.FIRST_COMPLETED)
+            if source in done:
+                source.result()
+                tasks.append(asyncio.create_task(self.queue.put((None, None, None))))
+                done, _ = await asyncio.wait({consumer, flusher}, return_when=asyncio.FIRST_COMPLETED)
+            for task, name in ((consumer, 'consumer'), (flusher, 'flusher')):
+                if task in done:
+                    task.result()
+                    if task is flusher or not source.done():
+                        raise RuntimeError(f"the stream {name} stopped unexpectedly")
+        except Exception:
+            failed = True
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            if failed:
+                self.flush(profiles=not self.checkpoint_path)
+            elif self.checkpoint_path:
+                self.checkpoint()
+            else:
+                self.flush()
+
+
+def load_markov(order):
+    """Peer-group models, vocabulary, order and model version, or (None, None, order, None) if unavailable."""
+    models_file = MARKOV_DIR / f"markov_models_by_group_{order_suffix(order)}.json"
+    try:
+        models, vocab, order = load_models(models_file)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Warning: Markov scoring disabled ({e}).")
+        return None, None, order, None
+    if load_vocab()[:len(vocab)] != vocab:
+        print("Warning: the action vocabulary changed since the Markov models were built. Markov scoring disabled.")
+        return None, None, order, None
+    return models, vocab, order, model_version(models_file)
+
+
+def batch_score_threshold(order, percentile=99):
+    scores_file = Path(f"sequence_anomalies_{order_suffix(order)}.jsonl")
+    if not scores_file.exists():
+        return None
+    with open(scores_file, 'r') as f:
+        scores = [json.loads(line)['score'] for line in f if line.strip()]
+    return float(np.percentile(scores, percentile)) if scores else None
+
+
+def main(source='file', path='data/normalized/events.jsonl', follow=False, host='127.0.0.1', port=9514,
+         profile_store='sqlite', alert_sink='sqlite', order=2, markov_threshold=None,
+         queue_size=10000, flush_interval=1.0, report_interval=10.0,
+         checkpoint_path=CHECKPOINT_PATH, checkpoint_interval=60.0, resume=False, max_sessions=None,
+         allowed_lateness=ALLOWED_LATENESS_SECONDS, count=10000, seed=None, users=None):
+    try:
+        with open('user_to_peer_group.json', 'r') as f:
+            user_to_group = json.load(f)
+    except FileNotFoundError:
+        print("Warning: 'user_to_peer_group.json' not found. Skipping peer group analysis.")
+        user_to_group = {}
+
+    if profile_store == 'sqlite':
+        profiles = SQLiteProfileStore(PROFILE_SQLITE_DB)
+        flush_profiles = profiles.flush
+    else:
+        profiles = load_profiles()
+        flush_profiles = lambda: save_profiles(profiles)  # noqa: E731
+
+    models, vocab, order, version = load_markov(order)
+    if models is not None and markov_threshold is None:
+        markov_threshold = batch_score_threshold(order)
+        if markov_threshold is None:
+            print("No batch sequence scores to derive a threshold from; scoring sessions without alerting.")
+    if markov_threshold is not None:
+        print(f"Alerting on sessions with a mean transition cost >= {markov_threshold:.3f}.")
+
+    detector = StreamingDetector(profiles, user_to_group, models, vocab, order, markov_threshold,
+                                 max_sessions=max_sessions, allowed_lateness_seconds=allowed_lateness)
+    offset = emitted = 0
+    if resume:
+        started = time.perf_counter()
+        state = load_checkpoint(checkpoint_path)
+        if state is None:
+            print(f"No checkpoint at '{checkpoint_path}'. Starting from scratch.")
+        else:
+            detector.restore(state)
+            if source == 'file' and state['source_path'] == str(path):
+                offset = state['offset']
+                emitted = load_emitted(emitted_path(checkpoint_path), path)
+            if state['model_version'] != version:
+                print("Warning: the Markov models changed since the checkpoint; open sessions keep their old running scores.")
+            print(f"Restored {len(detector.session_tracker)} open sessions and {len(detector.group_hosts)} peer groups "
+                  f"from '{checkpoint_path}' ({state['saved_at']}) in {time.perf_counter() - started:.2f}s, resuming at byte {offset}.")
+            if emitted > offset:
+                print(f"Alerts up to byte {emitted} were already emitted; replayed events will not append them again.")
+
+    sink = open_alert_sink(alert_sink)
+    engine = StreamEngine(detector, sink, flush_profiles, queue_size, flush_interval, report_interval,
+                          checkpoint_path=checkpoint_path, checkpoint_interval=checkpoint_interval,
+                          source_path=path if source == 'file' else None, offset=offset, model_version=version,
+                          emitted_offset=emitted)
+
+    if source == 'socket':
+        feed = serve_socket(engine.queue, host, port)
+    elif source == 'generate':
+        from generate_logs import TOTAL_USERS, stream_events
+        print(f"Generating ~{count} time-ordered events in process...")
+        feed = feed_events(engine.queue, stream_events(count, seed, users or TOTAL_USERS))
+    else:
+        print(f"Reading events from '{path}'{' and following new lines' if follow else ''}...")
+        feed = tail_file(path, engine.queue, follow, offset=offset)
+    try:
+        asyncio.run(engine.run(feed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+        if profile_store == 'sqlite':
+            profiles.close()
+    print(f"\n[stream] {engine.stats.summary()}")
+    if engine.replayed_alerts:
+        print(f"[stream] {engine.replayed_alerts} alerts from replayed events were already emitted and skipped")
+    sessions = detector.session_tracker.counters()
+    print(f"[stream] sessions: {sessions['started']} started, {sessions['live']} live, "
+          f"{sessions['idle_evictions']} expired after {SESSION_GAP_SECONDS}s idle, {sessions['capacity_evictions']} evicted at capacity")
+    print(f"Alerts appended to {ALERT_SINK_PATHS[alert_sink]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming detection over normalized events from a tailed file or a local socket.")
+    parser.add_argument("--source", choices=["file", "socket", "generate"], default="file", help="Where events come from ('generate' streams synthetic events without touching disk).")
+    parser.add_argument("--path", default="data/normalized/events.jsonl", help="JSONL file to read for --source file.")
+    parser.add_argument("--follow", action="store_true", help="Keep tailing the file for new events instead of stopping at the end.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on for --source socket.")
+    parser.add_argument("--port", type=int, default=9514, help="Port to listen on for --source socket.")
+    parser.add_argument("--profile-store", choices=["json", "sqlite"], default="sqlite", help="Where user profiles are kept.")
+    parser.add_argument("--alert-sink", choices=ALERT_SINK_TYPES, default="sqlite", help="Where alerts are appended.")
+    parser.add_argument("--order", type=int, default=2, help="Order of the Markov model file to score with.")
+    parser.add_argument("--markov-threshold", type=float, default=None, help="Mean transition cost that raises an alert (default: p99 of the batch scores).")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Events buffered before the source is paused.")
+    parser.add_argument("--flush-interval", type=float, default=1.0, help="Seconds between alert/profile flushes.")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between throughput/latency reports.")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Snapshot file for the detector state ('' to disable).")
+    parser.add_argument("--checkpoint-interval", type=float, default=60.0, help="Seconds between snapshots.")
+    parser.add_argument("--resume", action="store_true", help="Restore the latest snapshot and continue from its input offset.")
+    parser.add_argument("--max-sessions", type=int, default=None, help="Hard cap on open sessions; the least recently active is evicted.")
+    parser.add_argument("--allowed-lateness", type=float, default=ALLOWED_LATENESS_SECONDS, help="Seconds an event may lag other users' events before its idle session may already be closed.")
+    parser.add_argument("--count", type=int, default=10000, help="Approximate number of activity bursts for --source generate.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for --source generate.")
+    parser.add_argument("--users", type=int, default=None, help="Number of users for --source generate (default: the generator's own).")
+    args = parser.parse_args()
+    main(args.source, args.path, args.follow, args.host, args.port, args.profile_store, args.alert_sink,
+         args.order, args.markov_threshold, args.queue_size, args.flush_interval, args.report_interval,
+         args.checkpoint or None, args.checkpoint_interval, args.resume, args.max_sessions,
+         args.allowed_lateness, args.count, args.seed, args.users)